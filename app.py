@@ -1,11 +1,12 @@
 import os
 import sys
+import math
 import logging
 import secrets
 import time
 from datetime import datetime
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, stream_with_context
 from werkzeug.middleware.proxy_fix import ProxyFix
 from utils.cloudflare import (
     check_cloudflared_installed, 
@@ -22,7 +23,6 @@ from utils.cloudflare import (
 from utils.sistema import (
     check_dependencies, 
     install_dependencies, 
-    get_system_info,
     check_service_status
 )
 from utils.configuracion import (
@@ -39,9 +39,19 @@ from utils.cloudflare_auth import (
     remove_cloudflare_config
 )
 from utils.monitorizacion import (
-    get_tunnel_metrics,
-    check_tunnel_connectivity
+    get_tunnel_metrics
 )
+from utils.estado_tuneles import collect_tunnels_status
+from utils.stream_estado import broadcaster
+from utils.recolector import collector, get_snapshot
+from utils.series_temporales import TUNNEL_SERIES, get_tunnel_history, get_tunnels_history, history_stats
+from utils.incidencias import get_incident_reader
+from utils.procesos import format_elapsed
+from utils.salud import disk_headroom, process_uptime, readiness, system_uptime
+from utils.muestreo_host import host_sampler
+from utils.ejecucion import run_command, get_command_stats
+from utils.rendimiento import register_timing, get_route_stats
+from utils.perfilado import ProfilerBusy, profile, memory_start, memory_stop, memory_status, memory_diff
 
 # Configuración del logging para producción
 log_level = logging.INFO if os.environ.get('FLASK_ENV') == 'production' else logging.DEBUG
@@ -51,6 +61,9 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+# Versión de Python, calculada una sola vez para /health
+PYTHON_VERSION = os.environ.get('PYTHON_VERSION', '.'.join(map(str, tuple(sys.version_info)[:3])))
+
 # Inicializar la aplicación Flask
 app = Flask(__name__)
 
@@ -74,6 +87,9 @@ if os.environ.get('FLASK_ENV') == 'production':
     # Otras configuraciones de producción
     app.config['PREFERRED_URL_SCHEME'] = 'https'
     
+# Medir cada petición (cabecera Server-Timing y percentiles por ruta en /debug/perf)
+register_timing(app)
+
 # Configurar encabezados de seguridad
 @app.after_request
 def add_security_headers(response):
@@ -86,30 +102,18 @@ def add_security_headers(response):
 # Ruta principal
 @app.route('/')
 def index():
-    # Obtener información del sistema
-    system_info = get_system_info()
-    
-    # Verificar si cloudflared está instalado
-    cloudflared_installed = check_cloudflared_installed()
-    cloudflared_version = get_cloudflared_version() if cloudflared_installed else None
+    # Información del sistema, de cloudflared y de los túneles desde la última instantánea
+    snapshot = get_snapshot()
     
     # Verificar si Cloudflare API está configurada
     cloudflare_configured = is_cloudflare_configured()
     
-    # Obtener información de túneles si cloudflared está instalado
-    tunnels = []
-    if cloudflared_installed:
-        try:
-            tunnels = get_tunnels_list()
-        except Exception as e:
-            app.logger.error(f"Error al obtener túneles: {str(e)}")
-    
     return render_template(
         'index.html', 
-        system_info=system_info,
-        cloudflared_installed=cloudflared_installed,
-        cloudflared_version=cloudflared_version,
-        tunnels=tunnels,
+        system_info=snapshot.system_info,
+        cloudflared_installed=snapshot.cloudflared_installed,
+        cloudflared_version=snapshot.cloudflared_version,
+        tunnels=snapshot.tunnels,
         cloudflare_configured=cloudflare_configured
     )
 
@@ -225,7 +229,6 @@ def instalar_cloudflared_manual():
         
         # La instalación puede tardar, crear un thread para no bloquear la respuesta
         import threading
-        import subprocess
         from queue import Queue
         
         result_queue = Queue()
@@ -233,7 +236,7 @@ def instalar_cloudflared_manual():
             try:
                 # Ejecutar el script
                 cmd = ['sudo', './install_cloudflared.sh']
-                result = subprocess.run(
+                result = run_command(
                     cmd, 
                     capture_output=True, 
                     text=True,
@@ -344,6 +347,8 @@ def crear_tunel():
     
     try:
         resultado = create_tunnel(nombre_tunel)
+        # Reflejar el cambio en la próxima instantánea sin esperar al siguiente ciclo
+        collector.request_refresh()
         if resultado['success']:
             flash(f'Túnel "{nombre_tunel}" creado exitosamente. ID: {resultado["tunnel_id"]}', 'success')
             # Guardar el token para uso futuro (configuración de servicios)
@@ -366,6 +371,8 @@ def crear_tunel():
 def iniciar_tunel(nombre_tunel):
     try:
         resultado = start_tunnel(nombre_tunel)
+        # Reflejar el cambio en la próxima instantánea sin esperar al siguiente ciclo
+        collector.request_refresh()
         if resultado['success']:
             flash(f'Túnel "{nombre_tunel}" iniciado correctamente.', 'success')
         else:
@@ -381,6 +388,8 @@ def iniciar_tunel(nombre_tunel):
 def detener_tunel(nombre_tunel):
     try:
         resultado = stop_tunnel(nombre_tunel)
+        # Reflejar el cambio en la próxima instantánea sin esperar al siguiente ciclo
+        collector.request_refresh()
         if resultado['success']:
             flash(f'Túnel "{nombre_tunel}" detenido correctamente.', 'success')
         else:
@@ -396,6 +405,8 @@ def detener_tunel(nombre_tunel):
 def eliminar_tunel(nombre_tunel):
     try:
         resultado = delete_tunnel(nombre_tunel)
+        # Reflejar el cambio en la próxima instantánea sin esperar al siguiente ciclo
+        collector.request_refresh()
         if resultado['success']:
             flash(f'Túnel "{nombre_tunel}" eliminado correctamente.', 'success')
         else:
@@ -411,6 +422,8 @@ def eliminar_tunel(nombre_tunel):
 def configurar_servicio_tunel(nombre_tunel):
     try:
         resultado = configure_tunnel_service(nombre_tunel)
+        # Reflejar el cambio en la próxima instantánea sin esperar al siguiente ciclo
+        collector.request_refresh()
         if resultado['success']:
             # Verificar el método de configuración
             if resultado.get('method') == 'script':
@@ -501,65 +514,279 @@ def eliminar_servicio():
 # Ruta para monitorizar el estado
 @app.route('/estado')
 def estado():
-    # Verificar si cloudflared está instalado
-    cloudflared_installed = check_cloudflared_installed()
+    # El recolector mantiene el estado de los túneles actualizado en segundo plano
+    snapshot = get_snapshot()
     
-    if not cloudflared_installed:
+    if not snapshot.cloudflared_installed:
         flash('Primero debe instalar CloudFlared para acceder al estado.', 'warning')
         return redirect(url_for('instalacion'))
     
-    # Obtener la lista de túneles
-    tunnels = []
-    tunnel_statuses = {}
-    tunnel_metrics = {}
-    
-    try:
-        tunnels = get_tunnels_list()
-        
-        # Obtener el estado de cada túnel
-        for tunnel in tunnels:
-            status = get_tunnel_status(tunnel['name'])
-            tunnel_statuses[tunnel['name']] = status
-            
-            # Obtener métricas si el túnel está activo
-            if status['running']:
-                metrics = get_tunnel_metrics(tunnel['name'])
-                tunnel_metrics[tunnel['name']] = metrics
-            else:
-                tunnel_metrics[tunnel['name']] = None
-                
-    except Exception as e:
-        flash(f'Error al obtener información de los túneles: {str(e)}', 'danger')
-        app.logger.error(f"Error al obtener información de los túneles: {str(e)}")
-    
     return render_template(
         'estado.html', 
-        tunnels=tunnels, 
-        tunnel_statuses=tunnel_statuses,
-        tunnel_metrics=tunnel_metrics
+        tunnels=snapshot.tunnels, 
+        tunnel_statuses=snapshot.statuses,
+        tunnel_metrics=snapshot.metrics
     )
 
 # Ruta para refrescar el estado de un túnel
 @app.route('/api/estado-tunel/<nombre_tunel>')
 def api_estado_tunel(nombre_tunel):
     try:
-        status = get_tunnel_status(nombre_tunel)
-        metrics = get_tunnel_metrics(nombre_tunel) if status['running'] else None
-        connectivity = check_tunnel_connectivity(nombre_tunel) if status['running'] else False
+        payload = get_snapshot().tunnel_payload(nombre_tunel)
+        if payload is None:
+            # Túnel aún no incluido en la instantánea (p. ej. recién creado)
+            status = get_tunnel_status(nombre_tunel)
+            payload = {
+                'status': status,
+                'metrics': get_tunnel_metrics(nombre_tunel) if status['running'] else None,
+                'connectivity': status['connectivity'] if status['running'] else False
+            }
+        
+        return jsonify(dict(payload, success=True))
+    except Exception as e:
+        app.logger.error(f"Error al obtener estado del túnel: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+def _requested_tunnels(snapshot):
+    """
+    Túneles pedidos: todos los del inventario, o el subconjunto del cuerpo JSON {"tuneles": [...]} (POST)
+    o de ?tunel=a&tunel=b. Lanza ValueError si alguno no está en el inventario
+    """
+    inventory = snapshot.tunnel_names()
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        names = body.get('tuneles')
+        if names is not None and not (isinstance(names, list) and all(isinstance(name, str) for name in names)):
+            raise ValueError("'tuneles' debe ser una lista de nombres")
+    else:
+        names = request.args.getlist('tunel') or None
+    if names is None:
+        return inventory
+
+    known = set(inventory)
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise ValueError(f"Túneles desconocidos: {', '.join(unknown[:10])}")
+    return names
+
+# Ruta para refrescar el estado de todos los túneles (o de un subconjunto) en una sola petición
+# Los subconjuntos grandes se piden por POST: con cientos de ?tunel= la URL supera el límite de gunicorn
+@app.route('/api/estado-tuneles', methods=['GET', 'POST'])
+def api_estado_tuneles():
+    try:
+        snapshot = get_snapshot()
+        tunnel_names = _requested_tunnels(snapshot)
+        
+        tunnels = {}
+        missing = []
+        for name in tunnel_names:
+            payload = snapshot.tunnel_payload(name)
+            if payload is None:
+                missing.append(name)
+            else:
+                tunnels[name] = payload
+        
+        if missing:
+            # Túneles del inventario aún sin estado en la instantánea: consultarlos en una sola pasada
+            statuses, metrics = collect_tunnels_status(missing)
+            for name in missing:
+                status = statuses[name]
+                tunnels[name] = {
+                    'status': status,
+                    'metrics': metrics[name] if status['running'] else None,
+                    # get_tunnel_status ya verifica la conectividad, no se repite la consulta
+                    'connectivity': status['connectivity'] if status['running'] else False
+                }
         
         return jsonify({
             'success': True,
-            'status': status,
-            'metrics': metrics,
-            'connectivity': connectivity
+            'tunnels': tunnels,
+            'timestamp': datetime.now().strftime("%H:%M:%S")
         })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
-        app.logger.error(f"Error al obtener estado del túnel: {str(e)}")
+        app.logger.error(f"Error al obtener estado de los túneles: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+# Ruta para obtener el histórico de métricas de todos los túneles (o de un subconjunto) en una sola petición
+# Mismos parámetros que /api/metricas/<tunel>; el subconjunto como en /api/estado-tuneles (?tunel= o POST {"tuneles": [...]})
+@app.route('/api/metricas', methods=['GET', 'POST'])
+def api_metricas():
+    try:
+        tunnel_names = _requested_tunnels(get_snapshot())
+        resolution = _numeric_arg('resolucion', 60, type=int)
+        since = _numeric_arg('desde')
+        metrics = [m for m in request.args.getlist('serie') if m in TUNNEL_SERIES] or TUNNEL_SERIES
+        
+        return jsonify({
+            'success': True,
+            'resolution': resolution,
+            'tunnels': get_tunnels_history(tunnel_names, resolution, since, metrics)
+        })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        app.logger.error(f"Error al obtener el histórico de métricas: {str(e)}")
         return jsonify({
             'success': False,
             'error': str(e)
         })
 
+# Ruta para obtener el histórico de métricas de un túnel
+@app.route('/api/metricas/<nombre_tunel>')
+def api_metricas_tunel(nombre_tunel):
+    try:
+        # ?resolucion=15|60|3600 (segundos por punto; la más fina sigue a COLLECTOR_FULL_INTERVAL), ?desde=<timestamp> y ?serie=<métrica> (repetible)
+        resolution = request.args.get('resolucion', 60, type=int)
+        since = request.args.get('desde', None, type=float)
+        metrics = [m for m in request.args.getlist('serie') if m in TUNNEL_SERIES] or TUNNEL_SERIES
+        
+        return jsonify({
+            'success': True,
+            'tunnel': nombre_tunel,
+            'resolution': resolution,
+            'series': get_tunnel_history(nombre_tunel, resolution, since, metrics)
+        })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        app.logger.error(f"Error al obtener el histórico de métricas: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+# Formatos de fecha y duración para la página de incidencias
+@app.template_filter('fecha')
+def fecha_filter(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else ''
+
+@app.template_filter('duracion')
+def duracion_filter(seconds):
+    return format_elapsed(seconds) if seconds is not None else '—'
+
+def _numeric_arg(name, default=None, type=float):
+    """Parámetro numérico de la petición; ValueError si no es un número válido"""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = type(value)
+    except ValueError:
+        raise ValueError(f"El parámetro '{name}' debe ser un número")
+    # float() acepta 'nan' e 'inf', que no sirven como límites de una ventana
+    if not math.isfinite(number):
+        raise ValueError(f"El parámetro '{name}' debe ser un número finito")
+    return number
+
+def _incident_window():
+    """Ventana de consulta del histórico de incidencias: ?desde/?hasta (timestamps) o ?dias (7 por defecto)"""
+    until = _numeric_arg('hasta')
+    if until is None:
+        until = time.time()
+    since = _numeric_arg('desde')
+    if since is None:
+        days = _numeric_arg('dias', 7)
+        if days <= 0:
+            raise ValueError("El número de días debe ser positivo")
+        since = until - days * 86400
+    if since >= until:
+        raise ValueError("La ventana debe terminar después de empezar")
+    return since, until
+
+# Ruta con el histórico de incidencias registrado por el monitor
+@app.route('/incidencias')
+def incidencias():
+    try:
+        since, until = _incident_window()
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('incidencias'))
+
+    tunnel = request.args.get('tunel') or None
+    reader = get_incident_reader()
+
+    try:
+        summary = reader.summary(since, until, tunnels=get_snapshot().tunnel_names())
+        incidents = reader.list_incidents(tunnel, since, until, limit=100)
+    except Exception as e:
+        app.logger.error(f"Error al leer el histórico de incidencias: {str(e)}")
+        flash(f'Error al leer el histórico de incidencias: {str(e)}', 'danger')
+        summary, incidents = {}, []
+
+    return render_template(
+        'incidencias.html',
+        # Los túneles con peor disponibilidad primero
+        summary=sorted(summary.items(), key=lambda item: (item[1]['availability'], item[0])),
+        incidents=incidents,
+        days=round((until - since) / 86400, 2),
+        tunnel=tunnel,
+        now=time.time()
+    )
+
+# Ruta para consultar el histórico de incidencias (resumen por túnel y lista de incidencias)
+@app.route('/api/incidencias')
+def api_incidencias():
+    try:
+        since, until = _incident_window()
+        tunnel = request.args.get('tunel') or None
+        limit = _numeric_arg('limite', 100, type=int)
+        if limit <= 0:
+            raise ValueError("El límite debe ser positivo")
+        limit = min(limit, 1000)
+        reader = get_incident_reader()
+
+        return jsonify({
+            'success': True,
+            'since': since,
+            'until': until,
+            'summary': reader.summary(since, until, tunnel=tunnel),
+            'incidents': reader.list_incidents(tunnel, since, until, limit=limit)
+        })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        app.logger.error(f"Error al leer el histórico de incidencias: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+# Flujo Server-Sent Events con los cambios de estado de los túneles
+@app.route('/api/estado/stream')
+def api_estado_stream():
+    # El navegador envía Last-Event-ID al reconectar para recibir solo lo que se perdió
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    
+    return Response(
+        stream_with_context(broadcaster.stream(last_event_id)),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # Evitar que Nginx acumule los eventos en su búfer
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 # Decorator para limitar el acceso por IP
 def restrict_access_by_ip(allowed_networks=['127.0.0.1/8', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16']):
     def decorator(f):
@@ -583,39 +810,31 @@ def restrict_access_by_ip(allowed_networks=['127.0.0.1/8', '10.0.0.0/8', '172.16
 # Ruta de estado de salud para monitoreo
 @app.route('/health')
 def health_check():
-    # Verificar componentes críticos
+    # Resumen compatible con versiones anteriores, construido solo con datos en caché
     try:
-        # Verificar que podemos acceder al sistema de archivos
-        os.access('.', os.R_OK)
+        snapshot = collector.peek()
+        disk = disk_headroom()
         
-        # Verificar si podemos ejecutar comandos de sistema (básico)
-        import subprocess
-        subprocess.run(["echo", "test"], capture_output=True, check=True)
-        
-        # Comprobar espacio en disco
-        disk_usage = os.statvfs('.')
-        free_space_gb = (disk_usage.f_bavail * disk_usage.f_frsize) / (1024**3)
-        
-        # Si tenemos menos de 100MB de espacio libre, mostrar advertencia
-        disk_status = "ok" if free_space_gb > 0.1 else "low"
-        
-        # Verificar tiempo de actividad
-        uptime = time.time() - os.path.getmtime('/proc/1/cmdline')
-        
-        # Información de versión
+        # Información de versión (desde la última instantánea del recolector)
+        if snapshot is None:
+            cloudflared_version = "Desconocido"
+        elif snapshot.cloudflared_installed:
+            cloudflared_version = snapshot.cloudflared_version
+        else:
+            cloudflared_version = "No instalado"
         version_info = {
             "app_version": "1.0.0",
-            "python_version": os.environ.get('PYTHON_VERSION', '.'.join(map(str, tuple(sys.version_info)[:3]))),
-            "cloudflared_version": get_cloudflared_version() if check_cloudflared_installed() else "No instalado"
+            "python_version": PYTHON_VERSION,
+            "cloudflared_version": cloudflared_version
         }
         
         return jsonify({
             "status": "ok",
             "timestamp": datetime.now().isoformat(),
-            "uptime_seconds": uptime,
+            "uptime_seconds": system_uptime(),
             "disk_space": {
-                "free_gb": round(free_space_gb, 2),
-                "status": disk_status
+                "free_gb": disk["free_gb"],
+                "status": disk["status"]
             },
             "components": {
                 "filesystem": "ok",
@@ -631,53 +850,47 @@ def health_check():
             "timestamp": datetime.now().isoformat()
         }), 500
 
+# Liveness: el proceso responde (sin procesos externos ni acceso a disco)
+@app.route('/health/live')
+def health_live():
+    return jsonify({
+        "status": "ok",
+        "uptime_seconds": round(process_uptime(), 1)
+    })
+
+# Readiness: estado en caché de los componentes; 503 si el worker no debe recibir tráfico
+@app.route('/health/ready')
+def health_ready():
+    try:
+        components, ready = readiness(collector.peek())
+        # Informativo: un histórico lleno descarta las series nuevas pero no impide servir tráfico
+        components["history"] = history_stats()
+        return jsonify({
+            "status": "ok" if ready else "unavailable",
+            "timestamp": datetime.now().isoformat(),
+            "components": components
+        }), 200 if ready else 503
+    except Exception as e:
+        app.logger.error(f"Error en readiness check: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 503
+
 # Ruta protegida para estadísticas detalladas del sistema
 @app.route('/system-stats')
 @restrict_access_by_ip()
 def system_stats():
     try:
-        import psutil
+        # Última muestra del hilo de muestreo: CPU, memoria, disco y procesos cloudflared
+        stats = host_sampler.get_stats()
         
-        # Información del sistema
-        cpu_usage = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
-        
-        # Procesos relacionados con CloudFlare
-        cloudflare_processes = []
-        for proc in psutil.process_iter(['pid', 'name', 'cmdline', 'cpu_percent', 'memory_percent']):
-            try:
-                if 'cloudflared' in proc.info['name'] or \
-                   any('cloudflared' in cmd for cmd in proc.info['cmdline'] if cmd):
-                    cloudflare_processes.append({
-                        'pid': proc.info['pid'],
-                        'cpu_percent': proc.info['cpu_percent'],
-                        'memory_percent': proc.info['memory_percent'],
-                        'cmdline': ' '.join(proc.info['cmdline']) if proc.info['cmdline'] else ''
-                    })
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
+        # Información de túneles (sin esperar al recolector)
+        snapshot = collector.peek()
+        stats['tunnels_count'] = len(snapshot.tunnels) if snapshot else None
         
-        # Información de túneles
-        tunnels = get_tunnels_list() if check_cloudflared_installed() else []
-        
-        return jsonify({
-            'system': {
-                'cpu_percent': cpu_usage,
-                'memory': {
-                    'total_gb': round(memory.total / (1024**3), 2),
-                    'used_gb': round(memory.used / (1024**3), 2),
-                    'percent': memory.percent
-                },
-                'disk': {
-                    'total_gb': round(disk.total / (1024**3), 2),
-                    'used_gb': round(disk.used / (1024**3), 2),
-                    'percent': disk.percent
-                }
-            },
-            'cloudflared_processes': cloudflare_processes,
-            'tunnels_count': len(tunnels)
-        })
+        return jsonify(stats)
     except Exception as e:
         app.logger.error(f"Error al generar estadísticas del sistema: {str(e)}")
         return jsonify({
@@ -685,6 +898,81 @@ def system_stats():
             'error': str(e)
         }), 500
 
+# Ruta protegida con los tiempos de respuesta por ruta y de los comandos externos
+@app.route('/debug/perf')
+@restrict_access_by_ip()
+def debug_perf():
+    route_stats = get_route_stats()
+    command_stats = get_command_stats()
+    
+    if request.args.get('formato') == 'json':
+        return jsonify({
+            'routes': route_stats,
+            'commands': command_stats,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    return render_template('debug_perf.html', route_stats=route_stats, command_stats=command_stats)
+
+# Ruta protegida con las estadísticas de los comandos externos (latencia, fallos, timeouts)
+@app.route('/debug/comandos')
+@restrict_access_by_ip()
+def debug_comandos():
+    return jsonify({
+        'commands': get_command_stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+# Ruta protegida que perfila este worker durante unos segundos (pilas plegadas para flamegraph)
+@app.route('/debug/perfil')
+@restrict_access_by_ip()
+def debug_perfil():
+    try:
+        seconds = float(request.args.get('segundos', 10))
+        interval = float(request.args.get('intervalo', 0.01))
+    except ValueError:
+        return jsonify({'error': 'Parámetros numéricos no válidos'}), 400
+    if seconds <= 0 or interval <= 0:
+        return jsonify({'error': 'Los parámetros deben ser positivos'}), 400
+    
+    try:
+        text = profile(seconds, interval, idle=request.args.get('inactivos') == '1')
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    
+    return Response(text, mimetype='text/plain', headers={'X-Worker-Pid': str(os.getpid())})
+
+# Ruta protegida para seguir el crecimiento de memoria de este worker con tracemalloc
+@app.route('/debug/memoria', methods=['GET', 'POST'])
+@restrict_access_by_ip()
+def debug_memoria():
+    if request.method == 'POST':
+        action = request.form.get('accion') or request.args.get('accion')
+        if action == 'iniciar':
+            result = memory_start()
+        elif action == 'detener':
+            result = memory_stop()
+        else:
+            return jsonify({'error': 'Acción no válida (iniciar o detener)'}), 400
+        return jsonify(dict(result, pid=os.getpid()))
+    
+    if not memory_status()['has_baseline']:
+        return jsonify(dict(memory_status(), pid=os.getpid()))
+    
+    try:
+        limit = int(request.args.get('limite', 25))
+        diff = memory_diff(
+            limit=limit,
+            group_by=request.args.get('agrupar', 'lineno'),
+            reset=request.args.get('reiniciar') == '1'
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    
+    return jsonify(dict(diff, pid=os.getpid(), timestamp=datetime.now().isoformat()))
+
 # Ruta para configurar API Cloudflare
 @app.route('/configurar-cloudflare')
 def configurar_cloudflare():
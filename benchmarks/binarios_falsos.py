@@ -0,0 +1,190 @@
+"""
+Binarios falsos de cloudflared, systemctl, pgrep, ss y ps para los benchmarks
+
+Cada binario es un script sh que espera FAKE_LATENCY segundos (la latencia
+de un comando real) y devuelve salidas generadas de antemano para la flota.
+Todas las invocaciones se anotan en FAKE_CALLS_LOG para poder contar cuántos
+procesos lanza cada operación.
+"""
+import os
+import sys
+import json
+import uuid
+import subprocess
+
+FAKE_BINARIES = ("cloudflared", "systemctl", "pgrep", "ss", "ps")
+
+# Cabecera común: registrar la llamada y simular la latencia del comando real
+_PREAMBLE = """#!/bin/sh
+echo "$(basename "$0") $*" >> "$FAKE_CALLS_LOG"
+if [ "$FAKE_LATENCY" != "0" ]; then sleep "$FAKE_LATENCY"; fi
+"""
+
+_SCRIPTS = {
+    "cloudflared": """
+case "$1 $2" in
+  "tunnel list") cat "$FAKE_DATA_DIR/tunnel_list.json";;
+  "tunnel info")
+    if [ "$4" = "--output" ] && [ -f "$FAKE_DATA_DIR/info/$3.json" ]; then
+      cat "$FAKE_DATA_DIR/info/$3.json"
+    else
+      echo "NAME:     $3"
+      echo "CONNECTOR ID  CREATED  ARCHITECTURE  VERSION  ORIGIN IP  EDGE"
+      echo "Active connectors: 1"
+      echo "Connections: 4 active connections"
+    fi;;
+  "--version "*|"version"*) echo "cloudflared version 2024.1.0 (built 2024-01-01-0000 UTC)";;
+  *) echo "cloudflared falso: orden no soportada: $*" >&2; exit 1;;
+esac
+""",
+    "systemctl": """
+case "$1" in
+  show) cat "$FAKE_DATA_DIR/systemctl_show.txt";;
+  is-active) echo active;;
+  --version) echo "systemd 252 (252.22-1)";;
+  *) exit 0;;
+esac
+""",
+    "pgrep": """
+cat "$FAKE_DATA_DIR/pgrep.txt"
+""",
+    "ss": """
+cat "$FAKE_DATA_DIR/ss.txt"
+""",
+    "ps": """
+cat "$FAKE_DATA_DIR/ps.txt"
+"""
+}
+
+# Programa de cada conector simulado: un servidor /metrics con series de cloudflared
+_CONNECTOR_PROGRAM = """
+import http.server
+
+BODY = b'''# TYPE cloudflared_tunnel_total_requests counter
+cloudflared_tunnel_total_requests 1500
+cloudflared_tunnel_request_errors 3
+cloudflared_tunnel_concurrent_requests_per_tunnel 2
+cloudflared_tunnel_ha_connections 4
+cloudflared_tunnel_response_by_code{status_code="200"} 1450
+cloudflared_tunnel_response_by_code{status_code="404"} 47
+quic_client_sent_bytes{conn_index="0"} 1048576
+quic_client_receive_bytes{conn_index="0"} 4194304
+quic_client_smoothed_rtt{conn_index="0"} 21
+quic_client_min_rtt{conn_index="0"} 18
+quic_client_latest_rtt{conn_index="0"} 22
+'''
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+http.server.HTTPServer(("127.0.0.1", 0), Handler).serve_forever()
+"""
+
+
+def install_fake_binaries(bin_dir):
+    """Escribir los scripts en bin_dir (que debe ir primero en el PATH)"""
+    os.makedirs(bin_dir, exist_ok=True)
+    for name in FAKE_BINARIES:
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(_PREAMBLE + _SCRIPTS[name].lstrip("\n"))
+        os.chmod(path, 0o755)
+
+
+def fleet_names(size):
+    return [f"tunel-{i:04d}" for i in range(size)]
+
+
+def write_fleet_fixtures(data_dir, config_dir, names, services_per_tunnel=3):
+    """
+    Generar las salidas de los binarios falsos y la configuración local de la flota
+    - data_dir: salidas de `cloudflared tunnel list`, `systemctl show`, etc.
+    - config_dir: equivalente a /etc/cloudflared (JSON de cada túnel en configs/)
+    """
+    os.makedirs(os.path.join(data_dir, "info"), exist_ok=True)
+    os.makedirs(os.path.join(config_dir, "configs"), exist_ok=True)
+
+    tunnels = []
+    units = []
+    for i, name in enumerate(names):
+        tunnel_id = str(uuid.UUID(int=i + 1))
+        tunnels.append({
+            "id": tunnel_id,
+            "name": name,
+            "created_at": "2024-01-01T00:00:00Z",
+            "deleted_at": "0001-01-01T00:00:00Z",
+            "connections": []
+        })
+        # Tres de cada cuatro unidades activas, como una flota real con túneles parados
+        active = i % 4 != 3
+        units.append(
+            f"Id=cloudflared-{name}.service\n"
+            f"ActiveState={'active' if active else 'inactive'}\n"
+            f"SubState={'running' if active else 'dead'}\n"
+            f"MainPID=0\n"
+            f"ActiveEnterTimestamp={'Mon 2024-01-01 00:00:00 UTC' if active else ''}\n"
+        )
+        with open(os.path.join(data_dir, "info", f"{name}.json"), "w") as f:
+            json.dump({"id": tunnel_id, "name": name, "conns": []}, f)
+
+        config = {
+            "tunnel_id": tunnel_id,
+            "credentials_file": os.path.join(config_dir, f"{tunnel_id}.json"),
+            "services": [
+                {"name": f"servicio-{j}", "port": 8000 + j, "domain": f"s{j}.{name}.example.com"}
+                for j in range(services_per_tunnel)
+            ]
+        }
+        with open(os.path.join(config_dir, "configs", f"{name}.json"), "w") as f:
+            json.dump(config, f, indent=2)
+
+    with open(os.path.join(data_dir, "tunnel_list.json"), "w") as f:
+        json.dump(tunnels, f)
+    with open(os.path.join(data_dir, "systemctl_show.txt"), "w") as f:
+        f.write("\n".join(units))
+    with open(os.path.join(data_dir, "pgrep.txt"), "w") as f:
+        f.write("")
+    with open(os.path.join(data_dir, "ss.txt"), "w") as f:
+        f.write("State  Recv-Q Send-Q Local Address:Port Peer Address:Port Process\n")
+    with open(os.path.join(data_dir, "ps.txt"), "w") as f:
+        f.write("  PID ELAPSED %CPU %MEM CMD\n")
+
+
+def spawn_connector(name):
+    """
+    Lanzar un proceso que /proc muestra como `cloudflared tunnel run <name>`
+    (el intérprete de Python con argv[0] cambiado, leyendo su programa de stdin)
+    """
+    process = subprocess.Popen(
+        ["cloudflared", "-", "tunnel", "run", name],
+        executable=sys.executable,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    process.stdin.write(_CONNECTOR_PROGRAM.encode())
+    process.stdin.close()
+    return process
+
+
+def count_calls(calls_log):
+    """Invocaciones de cada binario falso anotadas en el registro"""
+    counts = {}
+    try:
+        with open(calls_log) as f:
+            for line in f:
+                binary = line.split(" ", 1)[0].strip()
+                if binary:
+                    counts[binary] = counts.get(binary, 0) + 1
+    except FileNotFoundError:
+        pass
+    return counts
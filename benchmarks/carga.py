@@ -0,0 +1,383 @@
+"""
+Prueba de carga de extremo a extremo del panel web
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.carga                                  # concurrencia 1, 5, 20 y 50
+    python -m benchmarks.carga --escenario operadores           # 20 operadores con pestañas abiertas
+    python -m benchmarks.carga --mezcla "/estado=1,/health=4" --concurrencia 10 --hilos 16
+
+Arranca main:app en este mismo proceso bajo el servidor WSGI multihilo de
+werkzeug, con los comandos del sistema sustituidos por los binarios falsos de
+los microbenchmarks. Los clientes son hilos con conexiones persistentes, repartidos
+en procesos aparte para no competir por el GIL, que piden rutas según una mezcla
+ponderada. Delante de la aplicación un semáforo de
+--hilos plazas imita los hilos de un worker gthread de gunicorn: el tiempo que
+las peticiones esperan plaza y la ocupación de los hilos indican la saturación
+del worker, y con ello cuántos workers o hilos hacen falta.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import http.client
+import multiprocessing
+from datetime import datetime
+
+from werkzeug.serving import make_server
+
+from benchmarks.microbench import FakeEnvironment, RESULTS_DIR, _git_revision
+
+# Mezcla por defecto: ruta=peso; {tunel} se sustituye por un túnel de la flota
+DEFAULT_MIX = "/=1,/estado=2,/api/estado-tunel/{tunel}=4,/health=2,/system-stats=1"
+
+# Escenarios predefinidos: cada cliente es un operador con una pestaña abierta
+SCENARIOS = {
+    "operadores": {
+        "mix": "/=1,/estado=1,/api/estado-tuneles=6,/api/estado-tunel/{tunel}=6,/health=2,/system-stats=1",
+        "concurrency": "20",
+        "think_ms": 2000
+    }
+}
+
+DEFAULT_CONCURRENCY = "1,5,20,50"
+# Hilos por worker en el despliegue recomendado (gunicorn --threads 16)
+DEFAULT_THREADS = 16
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _latency_summary(latencies):
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "p50_ms": round(_percentile(ms, 0.50), 2) if ms else None,
+        "p90_ms": round(_percentile(ms, 0.90), 2) if ms else None,
+        "p99_ms": round(_percentile(ms, 0.99), 2) if ms else None,
+        "max_ms": round(max(ms), 2) if ms else None
+    }
+
+
+def parse_mix(text):
+    """'ruta=peso,...' → [(ruta, peso)]"""
+    mix = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        route, sep, weight = item.rpartition("=")
+        if not sep or not route.startswith("/"):
+            raise ValueError(f"Entrada de mezcla no válida: {item}")
+        mix.append((route, float(weight)))
+    if not mix:
+        raise ValueError("La mezcla está vacía")
+    return mix
+
+
+class WorkerGate:
+    """
+    Middleware WSGI que limita las peticiones simultáneas como los hilos de un worker
+    Mide la espera por un hilo libre y el tiempo que los hilos pasan ocupados
+    """
+
+    def __init__(self, app, threads):
+        self.app = app
+        self.threads = threads
+        self._semaphore = threading.BoundedSemaphore(threads)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.perf_counter()
+            self.busy_seconds = 0.0
+            self.queue_waits = []
+            self.waiting = 0
+            self.peak_waiting = 0
+            self.in_flight = 0
+            self.peak_in_flight = 0
+
+    def __call__(self, environ, start_response):
+        queued_at = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+        self._semaphore.acquire()
+        start = time.perf_counter()
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.queue_waits.append(start - queued_at)
+        try:
+            # La respuesta se genera entera dentro del hilo, como en gthread
+            response = self.app(environ, start_response)
+            try:
+                body = b"".join(response)
+            finally:
+                if hasattr(response, "close"):
+                    response.close()
+            return [body]
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.in_flight -= 1
+                self.busy_seconds += elapsed
+            self._semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            wall = time.perf_counter() - self.started
+            return {
+                "threads": self.threads,
+                "utilization": round(self.busy_seconds / (self.threads * wall), 3) if wall > 0 else None,
+                "peak_in_flight": self.peak_in_flight,
+                "peak_queued": self.peak_waiting,
+                "queue_wait": _latency_summary(self.queue_waits)
+            }
+
+
+class Server:
+    """main:app servido por werkzeug en un puerto libre de 127.0.0.1"""
+
+    def __init__(self, threads):
+        from main import app
+
+        self.gate = WorkerGate(app.wsgi_app, threads)
+        app.wsgi_app = self.gate
+        self._server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.port = self._server.server_port
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="servidor-carga", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+
+
+class Client(threading.Thread):
+    """Un operador: pide rutas de la mezcla en bucle, con espera opcional entre peticiones"""
+
+    def __init__(self, port, mix, tunnels, think_ms, stop_at, record_from, results):
+        super().__init__(daemon=True)
+        self.port = port
+        self.routes = [route for route, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.tunnels = tunnels
+        self.think = think_ms / 1000
+        self.stop_at = stop_at
+        self.record_from = record_from
+        self.results = results
+        self.random = random.Random()
+
+    def _request(self, connection, path):
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def run(self):
+        # http.client en vez de requests: el cliente debe costar mucho menos que el servidor
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        while time.monotonic() < self.stop_at:
+            route = self.random.choices(self.routes, self.weights)[0]
+            path = route.replace("{tunel}", self.random.choice(self.tunnels))
+            start = time.monotonic()
+            try:
+                status = self._request(connection, path)
+            except (OSError, http.client.HTTPException):
+                status = None
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+            end = time.monotonic()
+            if start >= self.record_from and end <= self.stop_at:
+                self.results.append((route, status, end - start))
+            if self.think:
+                # Espera exponencial: las pestañas no se sincronizan entre sí
+                time.sleep(self.random.expovariate(1 / self.think))
+        connection.close()
+
+
+def _client_process(port, mix, tunnels, think_ms, clients, stop_at, record_from, queue):
+    """Proceso generador de carga: varios clientes en hilos (fuera del GIL del servidor)"""
+    results = []
+    threads = [Client(port, mix, tunnels, think_ms, stop_at, record_from, results) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put(results)
+
+
+def run_level(server, mix, tunnels, concurrency, duration, warmup, think_ms, processes):
+    """Ejecutar un nivel de concurrencia y resumir lo medido tras el calentamiento"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    # CLOCK_MONOTONIC es común a todos los procesos: sirve para sincronizar el arranque
+    record_from = time.monotonic() + warmup
+    stop_at = record_from + duration
+    processes = max(1, min(processes, concurrency))
+    shares = [concurrency // processes + (1 if i < concurrency % processes else 0) for i in range(processes)]
+    workers = [
+        context.Process(
+            target=_client_process,
+            args=(server.port, mix, tunnels, think_ms, share, stop_at, record_from, queue),
+            daemon=True
+        )
+        for share in shares
+    ]
+    for worker in workers:
+        worker.start()
+
+    # Las métricas del servidor cuentan desde el final del calentamiento
+    time.sleep(max(0.0, record_from - time.monotonic()))
+    server.gate.reset()
+    results = []
+    for _ in workers:
+        results.extend(queue.get())
+    saturation = server.gate.stats()
+    for worker in workers:
+        worker.join()
+
+    routes = {}
+    for route, status, latency in list(results):
+        entry = routes.setdefault(route, {"latencies": [], "errors": 0, "statuses": {}})
+        entry["latencies"].append(latency)
+        key = str(status) if status is not None else "conexión"
+        entry["statuses"][key] = entry["statuses"].get(key, 0) + 1
+        if status is None or status >= 500:
+            entry["errors"] += 1
+
+    total = sum(len(entry["latencies"]) for entry in routes.values())
+    errors = sum(entry["errors"] for entry in routes.values())
+    return {
+        "concurrency": concurrency,
+        "duration_seconds": duration,
+        "requests": total,
+        "throughput_rps": round(total / duration, 2),
+        "error_rate": round(errors / total, 4) if total else None,
+        "latency": _latency_summary([latency for _, _, latency in results]),
+        "routes": {
+            route: dict(
+                _latency_summary(entry["latencies"]),
+                requests=len(entry["latencies"]),
+                throughput_rps=round(len(entry["latencies"]) / duration, 2),
+                error_rate=round(entry["errors"] / len(entry["latencies"]), 4),
+                statuses=entry["statuses"]
+            )
+            for route, entry in sorted(routes.items())
+        },
+        "saturation": saturation
+    }
+
+
+def _print_level(level):
+    saturation = level["saturation"]
+    print(
+        f"\nConcurrencia {level['concurrency']}: {level['throughput_rps']} pet/s, "
+        f"errores {level['error_rate'] or 0:.2%}, p50 {level['latency']['p50_ms']} ms, "
+        f"p99 {level['latency']['p99_ms']} ms"
+    )
+    print(
+        f"  Worker ({saturation['threads']} hilos): ocupación {saturation['utilization'] or 0:.0%}, "
+        f"máx. en curso {saturation['peak_in_flight']}, máx. en cola {saturation['peak_queued']}, "
+        f"espera de hilo p90 {saturation['queue_wait']['p90_ms']} ms"
+    )
+    print(f"  {'ruta':<32} {'pet/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'errores':>8}")
+    for route, stats in level["routes"].items():
+        print(
+            f"  {route:<32} {stats['throughput_rps']:>8} {stats['p50_ms']:>9} "
+            f"{stats['p90_ms']:>9} {stats['p99_ms']:>9} {stats['error_rate']:>8.2%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del panel web con binarios falsos")
+    parser.add_argument("--escenario", choices=sorted(SCENARIOS), help="Valores predefinidos de mezcla, concurrencia y espera")
+    parser.add_argument("--mezcla", help=f"Rutas y pesos (por defecto {DEFAULT_MIX})")
+    parser.add_argument("--concurrencia", help=f"Clientes simultáneos, uno o varios niveles (por defecto {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--espera-ms", type=float, help="Espera media de cada cliente entre peticiones (por defecto 0)")
+    parser.add_argument("--duracion", type=float, default=15, help="Segundos medidos por nivel")
+    parser.add_argument("--calentamiento", type=float, default=3, help="Segundos previos no medidos por nivel")
+    parser.add_argument("--hilos", type=int, default=DEFAULT_THREADS, help="Hilos del worker simulado (gunicorn --threads)")
+    parser.add_argument("--procesos-cliente", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Procesos que generan la carga (reparten los clientes entre ellos)")
+    parser.add_argument("--tuneles", type=int, default=20, help="Tamaño de la flota simulada")
+    parser.add_argument("--conectores", type=int, default=10, help="Túneles con proceso cloudflared simulado")
+    parser.add_argument("--latencia-ms", type=float, default=5.0, help="Latencia de cada binario falso")
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto benchmarks/resultados/)")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar los mensajes de la aplicación")
+    args = parser.parse_args()
+
+    scenario = SCENARIOS.get(args.escenario, {})
+    mix_text = args.mezcla or scenario.get("mix", DEFAULT_MIX)
+    concurrency_text = args.concurrencia or scenario.get("concurrency", DEFAULT_CONCURRENCY)
+    think_ms = args.espera_ms if args.espera_ms is not None else scenario.get("think_ms", 0)
+    try:
+        mix = parse_mix(mix_text)
+        levels = [int(level) for level in concurrency_text.split(",") if level.strip()]
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    logging.getLogger("werkzeug").setLevel(logging.INFO if args.verbose else logging.ERROR)
+
+    # El histórico de métricas y la configuración no deben tocar /opt ni /etc
+    env = FakeEnvironment(args.latencia_ms)
+    os.environ.setdefault("TSDB_PATH", os.path.join(env.root, "metricas.tsdb"))
+    os.environ.setdefault("FLASK_ENV", "production")
+    env.patch_modules()
+
+    try:
+        tunnels = env.prepare_fleet(args.tuneles, args.conectores)
+        server = Server(args.hilos)
+        server.start()
+        print(f"Servidor en {server.base_url}; flota de {len(tunnels)} túneles; mezcla {mix_text}")
+
+        results = [
+            run_level(server, mix, tunnels, level, args.duracion, args.calentamiento, think_ms, args.procesos_cliente)
+            for level in levels
+        ]
+        for level in results:
+            _print_level(level)
+        server.stop()
+    finally:
+        env.cleanup()
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(),
+            "revision": _git_revision(),
+            "python": sys.version.split()[0],
+            "cpus": os.cpu_count(),
+            "mix": mix_text,
+            "think_ms": think_ms,
+            "threads": args.hilos,
+            "client_processes": args.procesos_cliente,
+            "tunnels": args.tuneles,
+            "connectors": args.conectores,
+            "latency_ms": args.latencia_ms
+        },
+        "levels": results
+    }
+    output = args.salida
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"carga-{stamp}-{report['meta']['revision'] or 'sin-git'}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResultados guardados en {output}")
+
+
+if __name__ == "__main__":
+    main()
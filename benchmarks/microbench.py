@@ -0,0 +1,333 @@
+"""
+Microbenchmarks de las rutas calientes de utils con una flota simulada
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.microbench                       # 10, 100 y 1000 túneles
+    python -m benchmarks.microbench --tamanos 10,100 --latencia-ms 20
+    python -m benchmarks.microbench --comparar base.json actual.json
+
+Los binarios cloudflared, systemctl, pgrep, ss y ps se sustituyen por scripts
+falsos (benchmarks/binarios_falsos.py) y los directorios de configuración por
+uno temporal, así que se puede ejecutar sin privilegios y sin tocar el sistema.
+Cada caso se mide en frío (cachés invalidadas antes de cada repetición) y en
+caliente, y se anota cuántos procesos externos lanza.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+from benchmarks.binarios_falsos import (
+    install_fake_binaries, fleet_names, write_fleet_fixtures, spawn_connector, count_calls
+)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "resultados")
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+DEFAULT_SIZES = (10, 100, 1000)
+
+# Casos medidos: (función a importar, ámbito)
+# "flota" recorre todos los túneles, como hacen /estado y el monitor; "llamada" es una sola
+CASES = {
+    "get_tunnels_list": ("utils.cloudflare", "llamada"),
+    "get_tunnel_status": ("utils.cloudflare", "flota"),
+    "get_tunnel_metrics": ("utils.monitorizacion", "flota"),
+    "get_available_services": ("utils.configuracion", "llamada"),
+    "read_tunnel_config": ("utils.configuracion", "flota"),
+    "generate_tunnel_config_yaml": ("utils.configuracion", "flota")
+}
+
+# Diferencias menores que esta (ms) se consideran ruido al comparar
+COMPARE_NOISE_MS = 1.0
+
+
+class FakeEnvironment:
+    """PATH, variables de los binarios falsos y directorios temporales de una ejecución"""
+
+    def __init__(self, latency_ms):
+        self.root = tempfile.mkdtemp(prefix="bench-tuneles-")
+        self.bin_dir = os.path.join(self.root, "bin")
+        self.data_dir = os.path.join(self.root, "datos")
+        self.config_dir = os.path.join(self.root, "cloudflared")
+        self.systemd_dir = os.path.join(self.root, "systemd")
+        self.calls_log = os.path.join(self.root, "llamadas.log")
+        self.connectors = []
+
+        install_fake_binaries(self.bin_dir)
+        os.makedirs(self.systemd_dir, exist_ok=True)
+        os.environ["PATH"] = self.bin_dir + os.pathsep + os.environ.get("PATH", os.defpath)
+        os.environ["FAKE_LATENCY"] = f"{latency_ms / 1000:g}"
+        os.environ["FAKE_DATA_DIR"] = self.data_dir
+        os.environ["FAKE_CALLS_LOG"] = self.calls_log
+
+    def patch_modules(self):
+        """Dirigir las rutas fijas de utils a los directorios temporales"""
+        import utils.cloudflare as cloudflare
+        import utils.configuracion as configuracion
+
+        cloudflare.CLOUDFLARED_CONFIG_DIR = self.config_dir
+        cloudflare.SYSTEMD_DIR = self.systemd_dir
+        configuracion.CLOUDFLARED_CONFIG_DIR = self.config_dir
+        configuracion.CONFIG_DIR = os.path.join(self.config_dir, "configs")
+
+    def prepare_fleet(self, size, connectors):
+        """Generar la flota y arrancar conectores reales para una parte de ella"""
+        self.stop_connectors()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+        shutil.rmtree(self.config_dir, ignore_errors=True)
+        names = fleet_names(size)
+        write_fleet_fixtures(self.data_dir, self.config_dir, names)
+
+        # Solo las unidades activas (tres de cada cuatro) tienen proceso
+        running = [name for i, name in enumerate(names) if i % 4 != 3][:connectors]
+        self.connectors = [spawn_connector(name) for name in running]
+        self._wait_for_connectors()
+        return names
+
+    def _wait_for_connectors(self, timeout=30):
+        """Esperar a que cada conector escuche en su puerto de /metrics"""
+        from utils.sockets_escucha import get_listener_index
+
+        deadline = time.monotonic() + timeout
+        pending = {process.pid for process in self.connectors}
+        while pending and time.monotonic() < deadline:
+            index = get_listener_index(max_age=0)
+            pending = {pid for pid in pending if not index.tcp_addresses(pid)}
+            if pending:
+                time.sleep(0.1)
+        if pending:
+            logging.warning(f"{len(pending)} conectores simulados no llegaron a escuchar")
+
+    def stop_connectors(self):
+        for process in self.connectors:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.wait()
+        self.connectors = []
+
+    def reset_calls(self):
+        open(self.calls_log, "w").close()
+
+    def calls(self):
+        return count_calls(self.calls_log)
+
+    def cleanup(self):
+        self.stop_connectors()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def reset_caches():
+    """Invalidar todas las cachés de proceso para medir el camino en frío"""
+    from utils.cloudflare import invalidate_tunnels_cache
+    from utils.systemd import invalidate_units_state
+    from utils.procesos import invalidate_process_index
+    from utils.sockets_escucha import invalidate_listener_index
+    from utils.capacidades import capabilities
+
+    invalidate_tunnels_cache()
+    invalidate_units_state()
+    invalidate_process_index()
+    invalidate_listener_index()
+    capabilities.invalidate()
+
+
+def _case_runner(case, names):
+    """Función sin argumentos que ejecuta una repetición del caso"""
+    module_name, scope = CASES[case]
+    module = __import__(module_name, fromlist=[case])
+    func = getattr(module, case)
+
+    if case == "generate_tunnel_config_yaml":
+        from utils.configuracion import read_tunnel_config
+        configs = {name: read_tunnel_config(name) for name in names}
+        return lambda: [func(name, configs[name]) for name in names]
+    if scope == "flota":
+        return lambda: [func(name) for name in names]
+    return func
+
+
+def _summary(durations, calls, size, scope):
+    durations_ms = sorted(d * 1000 for d in durations)
+    median = statistics.median(durations_ms)
+    p95 = durations_ms[min(len(durations_ms) - 1, int(round(0.95 * (len(durations_ms) - 1))))]
+    return {
+        "runs": len(durations_ms),
+        "min_ms": round(durations_ms[0], 3),
+        "median_ms": round(median, 3),
+        "p95_ms": round(p95, 3),
+        "max_ms": round(durations_ms[-1], 3),
+        "per_tunnel_ms": round(median / size, 4) if scope == "flota" else None,
+        # Procesos lanzados por repetición, por binario
+        "commands_per_run": {binary: round(n / len(durations_ms), 2) for binary, n in sorted(calls.items())}
+    }
+
+
+def measure(env, case, names, repetitions):
+    """Medir un caso en frío y en caliente"""
+    scope = CASES[case][1]
+    run = _case_runner(case, names)
+    results = {}
+
+    for mode in ("frio", "caliente"):
+        if mode == "caliente":
+            run()
+        durations = []
+        env.reset_calls()
+        for _ in range(repetitions):
+            if mode == "frio":
+                reset_caches()
+            start = time.perf_counter()
+            run()
+            durations.append(time.perf_counter() - start)
+        results[mode] = _summary(durations, env.calls(), len(names), scope)
+    return results
+
+
+def _git_revision():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR, capture_output=True, text=True, timeout=10
+        )
+        return result.stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def run_benchmarks(sizes, cases, latency_ms, repetitions, connectors):
+    env = FakeEnvironment(latency_ms)
+    results = {}
+    try:
+        env.patch_modules()
+        for size in sizes:
+            names = env.prepare_fleet(size, connectors)
+            results[str(size)] = {}
+            for case in cases:
+                results[str(size)][case] = measure(env, case, names, repetitions)
+                cold = results[str(size)][case]["frio"]
+                warm = results[str(size)][case]["caliente"]
+                print(
+                    f"{size:>5} túneles  {case:<28} frío {cold['median_ms']:>10.2f} ms"
+                    f"  caliente {warm['median_ms']:>10.2f} ms"
+                    f"  comandos {sum(cold['commands_per_run'].values()):g}",
+                    flush=True
+                )
+    finally:
+        env.cleanup()
+
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "host": platform.node(),
+            "cpus": os.cpu_count(),
+            "latency_ms": latency_ms,
+            "repetitions": repetitions,
+            "connectors": connectors
+        },
+        "results": results
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    Comparar la mediana de cada caso entre dos ejecuciones
+    Retorna la lista de regresiones (más lentas que threshold o con más comandos)
+    """
+    regressions = []
+    for key in ("latency_ms", "connectors", "cpus"):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            print(f"Aviso: {key} distinto ({baseline['meta'].get(key)} → {current['meta'].get(key)}), "
+                  f"las cifras no son comparables")
+    print(f"{'túneles':>7}  {'caso':<28} {'modo':<8} {'base ms':>10} {'actual ms':>10} {'cambio':>8}")
+    for size, cases in current["results"].items():
+        for case, modes in cases.items():
+            for mode, stats in modes.items():
+                base = baseline["results"].get(size, {}).get(case, {}).get(mode)
+                if base is None:
+                    continue
+                before, after = base["median_ms"], stats["median_ms"]
+                change = (after - before) / before if before else 0.0
+                commands_before = sum(base["commands_per_run"].values())
+                commands_after = sum(stats["commands_per_run"].values())
+                slower = change > threshold and after - before > COMPARE_NOISE_MS
+                more_commands = commands_after > commands_before
+                flag = ""
+                if slower or more_commands:
+                    regressions.append((size, case, mode))
+                    flag = "  REGRESIÓN" + (f" ({commands_before:g} → {commands_after:g} comandos)" if more_commands else "")
+                print(f"{size:>7}  {case:<28} {mode:<8} {before:>10.2f} {after:>10.2f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks de utils con binarios falsos")
+    parser.add_argument("--tamanos", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="Tamaños de flota separados por comas (por defecto 10,100,1000)")
+    parser.add_argument("--casos", default=",".join(CASES), help="Casos a medir separados por comas")
+    parser.add_argument("--latencia-ms", type=float, default=5.0,
+                        help="Latencia de cada invocación de un binario falso")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Repeticiones por caso y modo")
+    parser.add_argument("--conectores", type=int, default=50,
+                        help="Máximo de procesos cloudflared simulados (cada uno es un intérprete de Python)")
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto benchmarks/resultados/)")
+    parser.add_argument("--comparar", nargs="+", metavar="JSON",
+                        help="Comparar con una ejecución base: BASE [ACTUAL]; sin ACTUAL se ejecuta ahora")
+    parser.add_argument("--umbral", type=float, default=0.25,
+                        help="Empeoramiento relativo de la mediana que se considera regresión")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar los mensajes de utils")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+
+    if args.comparar and len(args.comparar) > 2:
+        parser.error("--comparar admite BASE y, opcionalmente, ACTUAL")
+
+    if args.comparar and len(args.comparar) == 2:
+        current = _load(args.comparar[1])
+    else:
+        cases = [case.strip() for case in args.casos.split(",") if case.strip()]
+        unknown = [case for case in cases if case not in CASES]
+        if unknown:
+            parser.error(f"Casos desconocidos: {', '.join(unknown)}")
+        sizes = [int(size) for size in args.tamanos.split(",") if size.strip()]
+
+        current = run_benchmarks(sizes, cases, args.latencia_ms, args.repeticiones, args.conectores)
+
+        output = args.salida
+        if output is None:
+            os.makedirs(RESULTS_DIR, exist_ok=True)
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            output = os.path.join(RESULTS_DIR, f"{stamp}-{current['meta']['revision'] or 'sin-git'}.json")
+        with open(output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Resultados guardados en {output}")
+
+    if args.comparar:
+        regressions = compare(_load(args.comparar[0]), current, args.umbral)
+        if regressions:
+            print(f"{len(regressions)} regresiones por encima del {args.umbral:.0%}")
+            sys.exit(1)
+        print("Sin regresiones")
+
+
+if __name__ == "__main__":
+    main()
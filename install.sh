@@ -159,7 +159,7 @@ After=network.target
 Type=simple
 User=root
 WorkingDirectory=$INSTALL_DIR
-ExecStart=$INSTALL_DIR/venv/bin/gunicorn --bind 0.0.0.0:5000 --reuse-port --reload main:app
+ExecStart=$INSTALL_DIR/venv/bin/gunicorn --bind 0.0.0.0:5000 --workers 4 --worker-class gthread --threads 16 --timeout 120 --reuse-port --reload main:app
 Restart=on-failure
 RestartSec=5s
 StandardOutput=syslog
@@ -223,7 +223,7 @@ start_service() {
     echo "Iniciando Gestor de Túneles CloudFlare..."
     cd \$INSTALL_DIR
     source venv/bin/activate
-    nohup \$INSTALL_DIR/venv/bin/gunicorn --bind 0.0.0.0:5000 --reuse-port --reload main:app > \$LOG_FILE 2>&1 &
+    nohup \$INSTALL_DIR/venv/bin/gunicorn --bind 0.0.0.0:5000 --workers 4 --worker-class gthread --threads 16 --timeout 120 --reuse-port --reload main:app > \$LOG_FILE 2>&1 &
     echo \$! > \$PID_FILE
     echo "Servicio iniciado con PID \$(cat \$PID_FILE)"
 }
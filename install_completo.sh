@@ -165,7 +165,7 @@ After=network.target
 Type=simple
 User=root
 WorkingDirectory=$INSTALL_DIR
-ExecStart=$INSTALL_DIR/venv/bin/gunicorn --bind 0.0.0.0:5000 --reuse-port --reload main:app
+ExecStart=$INSTALL_DIR/venv/bin/gunicorn --bind 0.0.0.0:5000 --workers 4 --worker-class gthread --threads 16 --timeout 120 --reuse-port --reload main:app
 Restart=on-failure
 RestartSec=5s
 StandardOutput=syslog
@@ -242,6 +242,7 @@ cat > "$INSTALL_DIR/config/monitor_config.json" << EOF
     "smtp_port": 587,
     "smtp_user": "usuario@example.com",
     "smtp_password": "contraseña_segura",
+    "smtp_starttls": true,
     "notification_email": "admin@example.com",
     "from_email": "cloudflare-monitor@example.com",
     "check_interval_seconds": 300,
@@ -5,16 +5,26 @@ Este script verifica el estado de los túneles y notifica problemas
 """
 
 import os
-import sys
 import time
 import json
+import signal
+import asyncio
 import logging
 import argparse
-import smtplib
-import subprocess
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from datetime import datetime
+from utils.backend_tuneles import get_backend
+from utils.alertas import AlertDispatcher
+from utils.incidencias import IncidentStore
+from utils.planificador import (
+    MonitorScheduler,
+    MONITOR_CONCURRENCY,
+    MONITOR_CHECK_TIMEOUT,
+    MONITOR_JITTER,
+    MONITOR_MAX_INTERVAL,
+    MONITOR_FAST_INTERVAL
+)
+from utils.perfilado import install_signal_handlers, memory_start
+from utils.metricas_monitor import monitor_metrics, MONITOR_METRICS_PORT, MONITOR_METRICS_TEXTFILE
 
 # Configuración de logging
 logging.basicConfig(
@@ -28,6 +38,7 @@ logging.basicConfig(
 CONFIG_DIR = "/opt/gestor-tuneles-cloudflare/config"
 ALERT_RECOVERY_MINUTES = 30  # Tiempo antes de enviar alerta de recuperación
 TUNNEL_CHECK_INTERVAL = 300  # Intervalo para verificar túneles (5 min)
+# Archivo de problemas conocidos de versiones anteriores (se importa al histórico de incidencias)
 KNOWN_ISSUES_FILE = "/tmp/cloudflare_monitor_known_issues.json"
 
 def load_config():
@@ -44,6 +55,7 @@ def load_config():
             "smtp_password": "",
             "notification_email": "",
             "from_email": "cloudflare-monitor@localhost",
+            "smtp_starttls": True,
             "check_interval_seconds": TUNNEL_CHECK_INTERVAL,
             "alert_recovery_minutes": ALERT_RECOVERY_MINUTES
         }
@@ -59,9 +71,7 @@ def load_config():
 def get_tunnels():
     """Obtener lista de túneles configurados"""
     try:
-        cmd = ["cloudflared", "tunnel", "list", "--output", "json"]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return json.loads(result.stdout)
+        return list(get_backend().list_tunnels())
     except Exception as e:
         logging.error(f"Error al obtener túneles: {str(e)}")
         return []
@@ -69,33 +79,13 @@ def get_tunnels():
 def check_tunnel_status(tunnel_name):
     """Verificar el estado de un túnel específico"""
     try:
-        # Comprobar si el servicio systemd está activo
-        cmd_service = ["systemctl", "is-active", f"cloudflared-{tunnel_name}"]
-        service_result = subprocess.run(cmd_service, capture_output=True, text=True)
-        service_active = service_result.stdout.strip() == "active"
-        
-        # Verificar conectividad del proceso
-        cmd_ps = ["pgrep", "-f", f"cloudflared.*{tunnel_name}"]
-        ps_result = subprocess.run(cmd_ps, capture_output=True, text=True)
-        process_running = len(ps_result.stdout.strip()) > 0
-        
-        # Obtener métricas si está activo
-        metrics = None
-        if process_running:
-            try:
-                # Intentar obtener métricas usando la API de cloudflared
-                cmd_metrics = ["cloudflared", "tunnel", "info", tunnel_name]
-                metrics_result = subprocess.run(cmd_metrics, capture_output=True, text=True, timeout=5)
-                if metrics_result.returncode == 0:
-                    metrics = metrics_result.stdout
-            except Exception as e:
-                logging.warning(f"No se pudieron obtener métricas para el túnel {tunnel_name}: {str(e)}")
+        check = get_backend().check(tunnel_name)
         
         return {
             "tunnel_name": tunnel_name,
-            "service_active": service_active,
-            "process_running": process_running,
-            "metrics": metrics,
+            "service_active": check["service_active"],
+            "process_running": check["process_running"],
+            "metrics": check["info"],
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -106,104 +96,57 @@ def check_tunnel_status(tunnel_name):
             "timestamp": datetime.now().isoformat()
         }
 
-def load_known_issues():
-    """Cargar problemas conocidos para evitar alertas duplicadas"""
-    if not os.path.exists(KNOWN_ISSUES_FILE):
-        return {}
-    
-    try:
-        with open(KNOWN_ISSUES_FILE, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"Error al cargar problemas conocidos: {str(e)}")
-        return {}
-
-def save_known_issues(issues):
-    """Guardar problemas conocidos"""
-    try:
-        with open(KNOWN_ISSUES_FILE, 'w') as f:
-            json.dump(issues, f)
-    except Exception as e:
-        logging.error(f"Error al guardar problemas conocidos: {str(e)}")
+def evaluate_status(status):
+    """Determinar si el resultado de una comprobación indica un problema; retorna (hay_problema, descripción)"""
+    if status.get("error"):
+        return True, f"Error al verificar estado: {status.get('error')}"
+    if not status.get("service_active"):
+        return True, "El servicio systemd no está activo"
+    if not status.get("process_running"):
+        return True, "El proceso no está en ejecución"
+    return False, ""
 
-def send_email_alert(config, subject, message):
-    """Enviar alerta por correo electrónico"""
-    if not config.get("email_notifications"):
-        logging.info("Notificaciones por correo electrónico desactivadas")
-        return False
+class TunnelAlerts:
+    """Incidencias abiertas de los túneles y alertas de problema y recuperación"""
     
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = config.get("from_email")
-        msg['To'] = config.get("notification_email")
-        msg['Subject'] = subject
-        
-        msg.attach(MIMEText(message, 'plain'))
-        
-        with smtplib.SMTP(config.get("smtp_server"), config.get("smtp_port")) as server:
-            server.starttls()
-            if config.get("smtp_user") and config.get("smtp_password"):
-                server.login(config.get("smtp_user"), config.get("smtp_password"))
-            server.send_message(msg)
-            
-        logging.info(f"Alerta enviada por correo electrónico: {subject}")
-        return True
-    except Exception as e:
-        logging.error(f"Error al enviar alerta por correo electrónico: {str(e)}")
-        return False
-
-def monitor_tunnels():
-    """Función principal para monitorizar túneles"""
-    config = load_config()
-    known_issues = load_known_issues()
-    current_time = time.time()  # Definir current_time para resolver el problema
+    def __init__(self, store=None):
+        self.config = load_config()
+        self.store = store or IncidentStore()
+        self.store.migrate_known_issues(KNOWN_ISSUES_FILE)
+        # Solo las transiciones (problema nuevo o recuperación) escriben en el histórico
+        self.open_issues = self.store.open_incidents()
+        self.recent_recoveries = self.store.last_resolved(time.time() - self.quiet_seconds())
+        self.dispatcher = AlertDispatcher(self.config).start()
     
-    # Cargar lista de túneles
-    tunnels = get_tunnels()
-    if not tunnels:
-        logging.warning("No se encontraron túneles para monitorizar")
-        return
-    
-    logging.info(f"Iniciando monitorización de {len(tunnels)} túneles")
+    def quiet_seconds(self):
+        """Tiempo tras una recuperación durante el que un nuevo problema del mismo túnel se registra sin alerta"""
+        return self.config.get("alert_recovery_minutes", ALERT_RECOVERY_MINUTES) * 60 * 2
     
-    # Verificar el estado de cada túnel
-    for tunnel in tunnels:
-        tunnel_name = tunnel.get("name")
-        tunnel_id = tunnel.get("id")
-        
-        if not tunnel_name:
-            continue
-        
-        status = check_tunnel_status(tunnel_name)
-        
-        # Determinar si hay problemas
-        has_issue = False
-        issue_description = ""
-        
-        if status.get("error"):
-            has_issue = True
-            issue_description = f"Error al verificar estado: {status.get('error')}"
-        elif not status.get("service_active"):
-            has_issue = True
-            issue_description = "El servicio systemd no está activo"
-        elif not status.get("process_running"):
-            has_issue = True
-            issue_description = "El proceso no está en ejecución"
-        
+    def update(self, tunnel_name, tunnel_id, status):
+        """
+        Registrar el resultado de la comprobación de un túnel
+        Retorna la lista de alertas (tipo, asunto, mensaje) que hay que enviar
+        """
+        has_issue, issue_description = evaluate_status(status)
         current_time = time.time()
         
         # Gestionar alertas y recuperaciones
         if has_issue:
-            if tunnel_name not in known_issues:
+            if tunnel_name not in self.open_issues:
                 # Nuevo problema detectado
-                known_issues[tunnel_name] = {
-                    "first_detected": current_time,
-                    "last_notified": current_time,
+                resolved_at = self.recent_recoveries.get(tunnel_name)
+                notify = resolved_at is None or current_time - resolved_at >= self.quiet_seconds()
+                self.store.open_incident(tunnel_name, tunnel_id, issue_description, current_time, notify)
+                self.open_issues[tunnel_name] = {
+                    "started_at": current_time,
                     "description": issue_description,
-                    "resolved": False
+                    "notified": notify
                 }
                 
-                # Enviar alerta
+                if not notify:
+                    logging.info(f"Problema en túnel '{tunnel_name}' poco después de recuperarse, se registra sin alerta: {issue_description}")
+                    return []
+                
                 subject = f"⚠️ ALERTA: Problema en túnel CloudFlare '{tunnel_name}'"
                 message = f"""
 Se ha detectado un problema en el túnel CloudFlare '{tunnel_name}':
@@ -215,63 +158,136 @@ ID del túnel: {tunnel_id}
 
 Por favor, revise el estado del túnel en la interfaz web del gestor.
 """
-                send_email_alert(config, subject, message)
                 logging.warning(f"Problema detectado en túnel '{tunnel_name}': {issue_description}")
+                return [("problema", subject, message)]
         else:
             # Verificar si hay una recuperación
-            if tunnel_name in known_issues and known_issues[tunnel_name]["resolved"] == False:
+            issue = self.open_issues.pop(tunnel_name, None)
+            if issue is not None:
                 # Túnel recuperado
-                recovery_time = current_time - known_issues[tunnel_name]["first_detected"]
-                recovery_minutes = recovery_time / 60
+                self.store.resolve_incident(tunnel_name, current_time)
+                self.recent_recoveries[tunnel_name] = current_time
+                recovery_minutes = (current_time - issue["started_at"]) / 60
                 
-                known_issues[tunnel_name]["resolved"] = True
-                known_issues[tunnel_name]["resolved_at"] = current_time
+                if not issue["notified"]:
+                    return []
                 
-                # Enviar alerta de recuperación
                 subject = f"✅ RECUPERADO: Túnel CloudFlare '{tunnel_name}'"
                 message = f"""
 El túnel CloudFlare '{tunnel_name}' se ha recuperado:
 
-Problema anterior: {known_issues[tunnel_name]["description"]}
+Problema anterior: {issue["description"]}
 Duración del problema: {int(recovery_minutes)} minutos
 Fecha y hora de recuperación: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
 No se requiere acción adicional.
 """
-                send_email_alert(config, subject, message)
                 logging.info(f"Túnel '{tunnel_name}' recuperado después de {int(recovery_minutes)} minutos")
+                return [("recuperacion", subject, message)]
+        
+        return []
     
-    # Limpiar problemas muy antiguos ya resueltos
-    clean_time = current_time - (config.get("alert_recovery_minutes", ALERT_RECOVERY_MINUTES) * 60 * 2)
-    tunnels_to_remove = []
+    async def handle(self, tunnel_name, tunnel_id, status):
+        """Manejador del planificador: el histórico se escribe en un hilo y las alertas se encolan"""
+        alerts = await asyncio.to_thread(self.update, tunnel_name, tunnel_id, status)
+        for kind, subject, message in alerts:
+            self.dispatcher.submit(subject, message, kind)
     
-    for tunnel_name, issue in known_issues.items():
-        if issue["resolved"] and issue.get("resolved_at", 0) < clean_time:
-            tunnels_to_remove.append(tunnel_name)
+    def clean(self):
+        """Olvidar las recuperaciones fuera del periodo de silencio y las incidencias fuera de la retención"""
+        clean_time = time.time() - self.quiet_seconds()
+        for tunnel_name, resolved_at in list(self.recent_recoveries.items()):
+            if resolved_at < clean_time:
+                del self.recent_recoveries[tunnel_name]
+        
+        try:
+            self.store.prune()
+        except Exception as e:
+            logging.error(f"Error al limpiar el histórico de incidencias: {str(e)}")
     
-    for tunnel_name in tunnels_to_remove:
-        del known_issues[tunnel_name]
+    def maintenance(self):
+        """Tarea periódica del modo demonio: releer la configuración y limpiar"""
+        self.config = load_config()
+        self.dispatcher.update_config(self.config)
+        self.clean()
     
-    # Guardar estado actual de problemas conocidos
-    save_known_issues(known_issues)
+    def close(self):
+        """Enviar las alertas pendientes (sin esperar al final de la ventana de agrupación)"""
+        self.dispatcher.stop()
+
+def monitor_tunnels(concurrency=None, timeout=None, metrics_textfile=None):
+    """Función principal para monitorizar túneles (una pasada, con las comprobaciones en paralelo)"""
+    alerts = TunnelAlerts()
+    scheduler = MonitorScheduler(TUNNEL_CHECK_INTERVAL, alerts.handle, concurrency=concurrency, timeout=timeout)
     
-    logging.info("Monitorización de túneles completada")
+    logging.info("Iniciando monitorización de túneles")
+    try:
+        count = asyncio.run(scheduler.run_once())
+    finally:
+        # Las alertas de la pasada salen juntas en un único resumen
+        alerts.close()
+        if metrics_textfile:
+            monitor_metrics.write_textfile(metrics_textfile)
+    if not count:
+        logging.warning("No se encontraron túneles para monitorizar")
+        return
+    
+    alerts.clean()
+    
+    logging.info(f"Monitorización de {count} túneles completada")
+
+def run_daemon(interval, concurrency=None, timeout=None, jitter=None, max_interval=None, fast_interval=None,
+               metrics_port=None, metrics_textfile=None):
+    """Modo demonio: cada túnel se comprueba con su propio calendario adaptativo hasta recibir SIGTERM o SIGINT"""
+    alerts = TunnelAlerts()
+    scheduler = MonitorScheduler(
+        interval, alerts.handle,
+        concurrency=concurrency, timeout=timeout, jitter=jitter,
+        max_interval=max_interval, fast_interval=fast_interval,
+        on_inventory=alerts.maintenance
+    )
+    
+    async def main():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop_event.set)
+        await scheduler.run(stop_event)
+    
+    monitor_metrics.serve(metrics_port)
+    monitor_metrics.start_textfile(metrics_textfile)
+    try:
+        asyncio.run(main())
+    finally:
+        alerts.close()
+        monitor_metrics.stop(metrics_textfile)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Monitoriza el estado de los túneles CloudFlare")
     parser.add_argument("--daemon", action="store_true", help="Ejecutar como demonio")
     parser.add_argument("--interval", type=int, default=TUNNEL_CHECK_INTERVAL, help="Intervalo de verificación en segundos")
+    parser.add_argument("--max-interval", type=float, default=MONITOR_MAX_INTERVAL, help="Intervalo máximo en segundos para los túneles que siguen sanos")
+    parser.add_argument("--fast-interval", type=float, default=MONITOR_FAST_INTERVAL, help="Intervalo en segundos del carril rápido (fallos sin confirmar y resultados dudosos)")
+    parser.add_argument("--concurrency", type=int, default=MONITOR_CONCURRENCY, help="Comprobaciones de túneles simultáneas como máximo")
+    parser.add_argument("--check-timeout", type=float, default=MONITOR_CHECK_TIMEOUT, help="Tiempo máximo en segundos de la comprobación de un túnel")
+    parser.add_argument("--jitter", type=float, default=MONITOR_JITTER, help="Variación aleatoria del intervalo de cada túnel (fracción, 0.1 = ±10%%)")
+    parser.add_argument("--metrics-port", type=int, default=MONITOR_METRICS_PORT, help="Puerto local del endpoint /metrics del monitor en modo demonio (0 para desactivarlo)")
+    parser.add_argument("--metrics-textfile", default=MONITOR_METRICS_TEXTFILE, help="Archivo .prom para el textfile collector de node-exporter")
+    parser.add_argument("--profile-dir", help="Activar el perfilado por señales (SIGUSR1 pilas, SIGUSR2 memoria) y guardar los resultados en este directorio")
+    parser.add_argument("--tracemalloc", action="store_true", help="Seguir la memoria desde el arranque (requiere --profile-dir para obtener los diffs)")
     args = parser.parse_args()
     
+    if args.profile_dir:
+        install_signal_handlers(args.profile_dir)
+    if args.tracemalloc:
+        memory_start()
+    
     if args.daemon:
         logging.info(f"Iniciando monitorización en modo demonio (intervalo: {args.interval}s)")
-        
-        try:
-            while True:
-                monitor_tunnels()
-                time.sleep(args.interval)
-        except KeyboardInterrupt:
-            logging.info("Monitorización detenida por el usuario")
-            sys.exit(0)
+        run_daemon(
+            args.interval, args.concurrency, args.check_timeout, args.jitter, args.max_interval, args.fast_interval,
+            args.metrics_port, args.metrics_textfile
+        )
+        logging.info("Monitorización detenida")
     else:
-        monitor_tunnels()
\ No newline at end of file
+        monitor_tunnels(args.concurrency, args.check_timeout, args.metrics_textfile)
\ No newline at end of file
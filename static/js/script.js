@@ -18,9 +18,13 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    // Refresh de estado de túnel cada 30 segundos en la página de estado
+    // Estado de los túneles en tiempo real; sondeo cada 30 segundos si el navegador no soporta SSE
     if (document.querySelector('.tunnel-status-card')) {
-        setInterval(refreshTunnelStatus, 30000);
+        if (window.EventSource) {
+            subscribeTunnelStatus();
+        } else {
+            setInterval(refreshTunnelStatus, 30000);
+        }
     }
 
     // Inicializar gráficos si estamos en la página de estado
@@ -30,49 +34,107 @@ document.addEventListener('DOMContentLoaded', function() {
     validateForms();
 });
 
-// Función para refrescar el estado de los túneles
+// Función para pedir el estado de varios túneles en una sola petición
+// Sin nombres se piden todos; un subconjunto va en el cuerpo (con cientos de túneles no cabe en la URL)
+function fetchTunnelsStatus(tunnelNames) {
+    if (!tunnelNames) {
+        return fetch('/api/estado-tuneles').then(response => response.json());
+    }
+    return fetch('/api/estado-tuneles', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ tuneles: tunnelNames })
+    }).then(response => response.json());
+}
+
+// Función para refrescar el estado de los túneles (una sola petición para todas las tarjetas)
 function refreshTunnelStatus() {
     const tunnelCards = document.querySelectorAll('.tunnel-status-card');
+    if (!tunnelCards.length) {
+        return;
+    }
     
-    tunnelCards.forEach(card => {
-        const tunnelName = card.getAttribute('data-tunnel-name');
-        const statusBadge = card.querySelector('.status-badge');
-        const connectivityBadge = card.querySelector('.connectivity-badge');
-        const lastUpdated = card.querySelector('.last-updated');
-        
-        fetch(`/api/estado-tunel/${tunnelName}`)
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    // Actualizar el badge de estado
-                    statusBadge.className = 'badge status-badge';
-                    statusBadge.classList.add(data.status.running ? 'bg-success' : 'bg-danger');
-                    statusBadge.textContent = data.status.running ? 'Activo' : 'Inactivo';
-                    
-                    // Actualizar el badge de conectividad
-                    if (data.connectivity !== null) {
-                        connectivityBadge.className = 'badge connectivity-badge';
-                        connectivityBadge.classList.add(data.connectivity ? 'bg-success' : 'bg-warning');
-                        connectivityBadge.textContent = data.connectivity ? 'Conectado' : 'Problemas de conectividad';
-                    }
-                    
-                    // Actualizar fecha de último refresco
-                    const now = new Date();
-                    lastUpdated.textContent = 'Última actualización: ' + 
-                        now.getHours().toString().padStart(2, '0') + ':' + 
-                        now.getMinutes().toString().padStart(2, '0') + ':' + 
-                        now.getSeconds().toString().padStart(2, '0');
-                    
-                    // Actualizar gráficos si hay métricas
-                    if (data.metrics && window.tunnelCharts && window.tunnelCharts[tunnelName]) {
-                        updateCharts(tunnelName, data.metrics);
-                    }
+    // La página de estado muestra todos los túneles del inventario
+    fetchTunnelsStatus(null)
+        .then(data => {
+            if (!data.success) {
+                return;
+            }
+            
+            tunnelCards.forEach(card => {
+                const tunnelName = card.getAttribute('data-tunnel-name');
+                if (data.tunnels[tunnelName]) {
+                    updateTunnelCard(card, tunnelName, data.tunnels[tunnelName]);
                 }
-            })
-            .catch(error => {
-                console.error('Error al actualizar el estado del túnel:', error);
             });
+        })
+        .catch(error => {
+            console.error('Error al actualizar el estado de los túneles:', error);
+        });
+}
+
+// Función para recibir los cambios de estado mediante Server-Sent Events
+function subscribeTunnelStatus() {
+    // EventSource reconecta solo y envía Last-Event-ID para recuperar los eventos perdidos
+    const source = new EventSource('/api/estado/stream');
+    
+    source.addEventListener('estado', function(event) {
+        const data = JSON.parse(event.data);
+        const card = document.querySelector(`.tunnel-status-card[data-tunnel-name="${CSS.escape(data.tunnel)}"]`);
+        if (card) {
+            updateTunnelCard(card, data.tunnel, data);
+        }
     });
+    
+    source.onerror = function() {
+        console.warn('Conexión de estado en tiempo real interrumpida, reintentando...');
+    };
+}
+
+// Función para actualizar una tarjeta de túnel con su estado
+function updateTunnelCard(card, tunnelName, data) {
+    const statusBadge = card.querySelector('.status-badge');
+    const connectivityBadge = card.querySelector('.connectivity-badge');
+    const lastUpdated = card.querySelector('.last-updated');
+    
+    // Sin datos recientes: conservar lo mostrado y marcarlo como desactualizado
+    if (data.status.unknown) {
+        statusBadge.className = 'badge bg-secondary float-end status-badge';
+        statusBadge.textContent = 'Desconocido';
+        lastUpdated.textContent = 'Sin datos: el túnel no respondió a tiempo';
+        return;
+    }
+    
+    // Actualizar el badge de estado
+    statusBadge.className = 'badge float-end status-badge';
+    statusBadge.classList.add(data.status.running ? 'bg-success' : 'bg-danger');
+    statusBadge.textContent = data.status.running ? 'Activo' : 'Inactivo';
+    
+    // Actualizar el badge de conectividad
+    if (data.connectivity !== null) {
+        connectivityBadge.className = 'badge connectivity-badge';
+        if (data.status.running) {
+            connectivityBadge.classList.add(data.connectivity ? 'bg-success' : 'bg-warning');
+            connectivityBadge.textContent = data.connectivity ? 'Conectado' : 'Problemas de conectividad';
+        } else {
+            connectivityBadge.classList.add('bg-secondary');
+            connectivityBadge.textContent = '--';
+        }
+    }
+    
+    // Actualizar fecha de último refresco
+    const now = new Date();
+    lastUpdated.textContent = 'Última actualización: ' + 
+        now.getHours().toString().padStart(2, '0') + ':' + 
+        now.getMinutes().toString().padStart(2, '0') + ':' + 
+        now.getSeconds().toString().padStart(2, '0') +
+        (data.status.stale ? ' (desactualizado' +
+            (data.status.stale_age != null ? ', datos de hace ' + Math.round(data.status.stale_age) + ' s' : '') + ')' : '');
+    
+    // Actualizar gráficos si hay métricas
+    if (data.metrics && window.tunnelCharts && window.tunnelCharts[tunnelName]) {
+        updateCharts(tunnelName, data.metrics);
+    }
 }
 
 // Función para inicializar gráficos
@@ -164,6 +226,69 @@ function initializeCharts() {
             });
         }
     });
+    
+    if (metricContainers.length) {
+        loadChartsHistory();
+    }
+}
+
+// Función para rellenar los gráficos con el histórico guardado en el servidor (una sola petición para todos)
+function loadChartsHistory() {
+    // Los gráficos muestran los 10 últimos minutos; la página de estado incluye todos los túneles
+    const params = new URLSearchParams({ resolucion: 60, desde: Math.floor(Date.now() / 1000) - 600 });
+    ['connections', 'upload', 'download'].forEach(serie => params.append('serie', serie));
+    
+    fetch(`/api/metricas?${params.toString()}`)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                return;
+            }
+            Object.keys(data.tunnels).forEach(tunnelName => {
+                if (window.tunnelCharts[tunnelName]) {
+                    applyChartHistory(tunnelName, data.tunnels[tunnelName]);
+                }
+            });
+        })
+        .catch(error => {
+            console.error('Error al cargar el histórico de métricas:', error);
+        });
+}
+
+// Función para rellenar los gráficos de un túnel con su histórico
+function applyChartHistory(tunnelName, series) {
+    const charts = window.tunnelCharts[tunnelName];
+    const formatLabel = t => {
+        const date = new Date(t * 1000);
+        return date.getHours().toString().padStart(2, '0') + ':' +
+               date.getMinutes().toString().padStart(2, '0');
+    };
+    // Los gráficos muestran los 10 últimos puntos
+    const lastPoints = serie => (series[serie] || []).slice(-10);
+    
+    const connections = lastPoints('connections');
+    if (charts.connections && connections.length) {
+        const chart = charts.connections;
+        chart.data.labels.splice(0, connections.length);
+        chart.data.labels.push(...connections.map(p => formatLabel(p.t)));
+        chart.data.datasets[0].data.splice(0, connections.length);
+        chart.data.datasets[0].data.push(...connections.map(p => p.avg));
+        chart.update();
+    }
+    
+    const upload = lastPoints('upload');
+    const download = lastPoints('download');
+    if (charts.bandwidth && upload.length && upload.length === download.length) {
+        const chart = charts.bandwidth;
+        chart.data.labels.splice(0, upload.length);
+        chart.data.labels.push(...upload.map(p => formatLabel(p.t)));
+        // Convertir bytes/s a KB/s
+        chart.data.datasets[0].data.splice(0, upload.length);
+        chart.data.datasets[0].data.push(...upload.map(p => p.avg / 1024));
+        chart.data.datasets[1].data.splice(0, download.length);
+        chart.data.datasets[1].data.push(...download.map(p => p.avg / 1024));
+        chart.update();
+    }
 }
 
 // Función para actualizar los gráficos con nuevas métricas
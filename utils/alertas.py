@@ -0,0 +1,261 @@
+import os
+import time
+import queue
+import random
+import smtplib
+import logging
+import threading
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.utils import formatdate, make_msgid
+from datetime import datetime
+from utils.metricas_monitor import monitor_metrics
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Segundos que se esperan tras una alerta para agruparla con las siguientes en un único correo
+ALERT_DIGEST_SECONDS = float(os.environ.get('ALERT_DIGEST_SECONDS', 60))
+# Alertas como máximo en un mismo resumen (al alcanzarse se envía sin esperar al final de la ventana)
+ALERT_DIGEST_MAX = int(os.environ.get('ALERT_DIGEST_MAX', 200))
+# Alertas pendientes como máximo; si la cola se llena las nuevas se descartan
+ALERT_QUEUE_SIZE = int(os.environ.get('ALERT_QUEUE_SIZE', 10000))
+# Intentos de envío de un correo antes de descartarlo
+ALERT_MAX_ATTEMPTS = int(os.environ.get('ALERT_MAX_ATTEMPTS', 6))
+# Espera (segundos) antes del primer reintento; se duplica en cada intento hasta ALERT_RETRY_MAX
+ALERT_RETRY_BASE = float(os.environ.get('ALERT_RETRY_BASE', 5))
+ALERT_RETRY_MAX = float(os.environ.get('ALERT_RETRY_MAX', 300))
+# Segundos sin envíos tras los que se cierra la sesión SMTP (los servidores cortan las sesiones inactivas)
+SMTP_IDLE_SECONDS = float(os.environ.get('SMTP_IDLE_SECONDS', 120))
+# Tiempo máximo (segundos) de cada operación con el servidor SMTP
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', 30))
+
+# Parámetros de monitor_config.json que identifican la sesión SMTP
+_SESSION_KEYS = ("smtp_server", "smtp_port", "smtp_user", "smtp_password", "smtp_starttls")
+
+
+def build_message(config, subject, body):
+    """Correo de texto plano con los remitentes y destinatarios de la configuración"""
+    msg = MIMEMultipart()
+    msg['From'] = config.get("from_email")
+    msg['To'] = config.get("notification_email")
+    msg['Subject'] = subject
+    msg['Date'] = formatdate(localtime=True)
+    msg['Message-ID'] = make_msgid()
+    msg.attach(MIMEText(body, 'plain'))
+    return msg
+
+
+class SmtpSession:
+    """
+    Conexión SMTP autenticada que se reutiliza entre envíos
+    Se vuelve a abrir si el servidor la ha cerrado, si cambia la configuración SMTP o si
+    ha estado inactiva más de SMTP_IDLE_SECONDS
+    """
+
+    def __init__(self):
+        self._server = None
+        self._key = None
+        self._last_used = 0
+
+    def _connect(self, config):
+        server = smtplib.SMTP(config.get("smtp_server"), config.get("smtp_port"), timeout=SMTP_TIMEOUT)
+        try:
+            if config.get("smtp_starttls", True):
+                server.starttls()
+            if config.get("smtp_user") and config.get("smtp_password"):
+                server.login(config.get("smtp_user"), config.get("smtp_password"))
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+        self._key = tuple(config.get(key) for key in _SESSION_KEYS)
+        logger.info(f"Sesión SMTP abierta con {config.get('smtp_server')}:{config.get('smtp_port')}")
+
+    def send(self, config, msg):
+        key = tuple(config.get(key) for key in _SESSION_KEYS)
+        if self._server is not None and (key != self._key or self.idle() > SMTP_IDLE_SECONDS):
+            self.close()
+
+        if self._server is None:
+            self._connect(config)
+            self._server.send_message(msg)
+        else:
+            try:
+                self._server.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # El servidor cerró la sesión reutilizada: reconectar una vez
+                self.close()
+                self._connect(config)
+                self._server.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def idle(self):
+        return time.monotonic() - self._last_used
+
+    def close_if_idle(self):
+        if self._server is not None and self.idle() > SMTP_IDLE_SECONDS:
+            self.close()
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            self._server.close()
+        self._server = None
+        self._key = None
+
+
+class AlertDispatcher:
+    """
+    Envío de alertas por correo fuera del camino de las comprobaciones
+    submit() solo encola; un hilo agrupa las alertas que llegan dentro de la misma ventana
+    en un único correo, las envía por una sesión SMTP persistente y reintenta con espera
+    exponencial si el servidor falla. Mientras se reintenta, las alertas nuevas se acumulan
+    para el siguiente resumen.
+    """
+
+    def __init__(self, config, digest_seconds=None):
+        self.config = config
+        self.digest_seconds = ALERT_DIGEST_SECONDS if digest_seconds is None else float(digest_seconds)
+        self._queue = queue.Queue(maxsize=ALERT_QUEUE_SIZE)
+        self._session = SmtpSession()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"queued": 0, "emails": 0, "alerts_sent": 0, "failures": 0, "dropped": 0}
+        monitor_metrics.alerts_pending.callback = self._queue.qsize
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="alertas", daemon=True)
+            self._thread.start()
+        return self
+
+    def update_config(self, config):
+        """Nueva configuración (se aplica en el siguiente envío)"""
+        self.config = config
+
+    def submit(self, subject, message, kind="problema"):
+        """Encolar una alerta; retorna False si las notificaciones están desactivadas o la cola está llena"""
+        if not self.config.get("email_notifications"):
+            logger.info("Notificaciones por correo electrónico desactivadas")
+            return False
+
+        try:
+            self._queue.put_nowait({
+                "time": datetime.now(), "queued_at": time.monotonic(),
+                "kind": kind, "subject": subject, "message": message
+            })
+        except queue.Full:
+            self._count("dropped")
+            monitor_metrics.alerts.inc("descartada")
+            logger.error(f"Cola de alertas llena, se descarta: {subject}")
+            return False
+        self._count("queued")
+        return True
+
+    def stop(self, timeout=None):
+        """Enviar lo pendiente sin esperar al final de la ventana y terminar el hilo"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=self._queue.qsize())
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=0 if self._stop.is_set() else 1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    break
+                self._session.close_if_idle()
+                continue
+
+            self._deliver(self._collect(first))
+
+        self._session.close()
+
+    def _collect(self, first):
+        """Alertas que llegan dentro de la ventana de la primera"""
+        batch = [first]
+        deadline = time.monotonic() + self.digest_seconds
+        while len(batch) < ALERT_DIGEST_MAX:
+            remaining = deadline - time.monotonic()
+            stopping = self._stop.is_set()
+            if remaining <= 0 or stopping:
+                # Añadir lo que ya está en la cola sin esperar más
+                try:
+                    while len(batch) < ALERT_DIGEST_MAX:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                break
+            try:
+                # Espera corta para atender stop() sin demora
+                batch.append(self._queue.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                pass
+        return batch
+
+    def _compose(self, batch):
+        if len(batch) == 1:
+            return batch[0]["subject"], batch[0]["message"]
+
+        problems = sum(1 for alert in batch if alert["kind"] == "problema")
+        recoveries = len(batch) - problems
+        icon = "⚠️" if problems else "✅"
+        subject = f"{icon} {len(batch)} alertas de túneles CloudFlare ({problems} problemas, {recoveries} recuperaciones)"
+
+        sections = [
+            f"Resumen de {len(batch)} alertas entre "
+            f"{batch[0]['time'].strftime('%Y-%m-%d %H:%M:%S')} y {batch[-1]['time'].strftime('%H:%M:%S')}:",
+            ""
+        ]
+        sections.extend(f"- {alert['subject']}" for alert in batch)
+        for alert in batch:
+            sections.extend(["", "=" * 60, alert["subject"], alert["message"].strip()])
+        return subject, "\n".join(sections) + "\n"
+
+    def _deliver(self, batch):
+        subject, body = self._compose(batch)
+        attempt = 0
+        while True:
+            attempt += 1
+            config = self.config
+            start = time.monotonic()
+            try:
+                self._session.send(config, build_message(config, subject, body))
+                sent_at = time.monotonic()
+                monitor_metrics.alert_send.observe(sent_at - start, "enviado")
+                monitor_metrics.alerts.inc("enviada", amount=len(batch))
+                for alert in batch:
+                    monitor_metrics.alert_delay.observe(sent_at - alert["queued_at"])
+                self._count("emails")
+                self._count("alerts_sent", len(batch))
+                logger.info(f"Alerta enviada por correo electrónico: {subject}")
+                return
+            except Exception as e:
+                monitor_metrics.alert_send.observe(time.monotonic() - start, "fallido")
+                monitor_metrics.failures.inc("correo")
+                self._count("failures")
+                self._session.close()
+                if attempt >= ALERT_MAX_ATTEMPTS or self._stop.is_set():
+                    monitor_metrics.alerts.inc("descartada", amount=len(batch))
+                    self._count("dropped", len(batch))
+                    logger.error(f"Error al enviar alerta por correo electrónico (se descarta tras {attempt} intentos): {str(e)}")
+                    return
+                delay = min(ALERT_RETRY_BASE * 2 ** (attempt - 1), ALERT_RETRY_MAX) * random.uniform(0.8, 1.2)
+                logger.warning(f"Error al enviar alerta por correo electrónico (intento {attempt}, reintento en {delay:.1f} s): {str(e)}")
+                # stop() interrumpe la espera y se hace un último intento
+                self._stop.wait(delay)
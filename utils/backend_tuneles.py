@@ -0,0 +1,102 @@
+import os
+import asyncio
+import logging
+import threading
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Implementación de los túneles: "cli" (cloudflared y systemd) o "simulador" (flota en memoria)
+TUNNEL_BACKEND = os.environ.get('TUNNEL_BACKEND', 'cli')
+
+
+class TunnelBackend:
+    """
+    Operaciones sobre túneles que la web, el recolector y el monitor delegan
+    Los resultados de start/stop/create/delete son diccionarios {"success": ..., "error": ...}
+    como los que devuelve utils.cloudflare; las consultas no lanzan excepciones salvo
+    list_tunnels, que falla para que la caché conserve el último inventario válido
+    """
+
+    name = None
+
+    def is_installed(self):
+        """cloudflared disponible en el sistema"""
+        raise NotImplementedError
+
+    def version(self):
+        """Versión de cloudflared o None"""
+        raise NotImplementedError
+
+    def list_tunnels(self):
+        """Inventario de túneles (lista de diccionarios con al menos 'id' y 'name')"""
+        raise NotImplementedError
+
+    def refresh(self):
+        """Descartar el estado local en caché (al inicio de cada ciclo del monitor)"""
+
+    def is_running(self, tunnel_name):
+        raise NotImplementedError
+
+    def find_process(self, tunnel_name):
+        """Proceso del conector ({'pid', 'uptime', ...}) o None"""
+        raise NotImplementedError
+
+    def get_status(self, tunnel_name):
+        """Estado con running, pid, uptime, connectivity y last_updated"""
+        raise NotImplementedError
+
+    def get_metrics(self, tunnel_name):
+        """Métricas del túnel con el formato de utils.monitorizacion.get_tunnel_metrics"""
+        raise NotImplementedError
+
+    def check(self, tunnel_name):
+        """Vista del monitor: service_active, process_running e info del conector"""
+        raise NotImplementedError
+
+    async def check_async(self, tunnel_name):
+        """Versión para asyncio de check; por defecto se ejecuta en un hilo"""
+        return await asyncio.to_thread(self.check, tunnel_name)
+
+    def quick_states(self, tunnel_names):
+        """
+        Estado local barato de varios túneles: {nombre: (service_active, process_running)}
+        None si la implementación no lo ofrece (el monitor no hace la revisión rápida)
+        """
+        return None
+
+    def start(self, tunnel_name):
+        raise NotImplementedError
+
+    def stop(self, tunnel_name):
+        raise NotImplementedError
+
+    def create(self, tunnel_name):
+        raise NotImplementedError
+
+    def delete(self, tunnel_name):
+        raise NotImplementedError
+
+
+_backend = None
+_lock = threading.Lock()
+
+
+def get_backend():
+    """Implementación elegida con TUNNEL_BACKEND (una por proceso)"""
+    global _backend
+    if _backend is not None:
+        return _backend
+
+    with _lock:
+        if _backend is None:
+            if TUNNEL_BACKEND == "simulador":
+                from utils.simulador import FleetSimulator
+                _backend = FleetSimulator()
+            else:
+                if TUNNEL_BACKEND != "cli":
+                    logger.warning(f"TUNNEL_BACKEND desconocido '{TUNNEL_BACKEND}', se usa 'cli'")
+                from utils.cloudflare import CliBackend
+                _backend = CliBackend()
+            logger.info(f"Backend de túneles: {_backend.name}")
+        return _backend
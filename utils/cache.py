@@ -0,0 +1,100 @@
+import time
+import logging
+import threading
+from utils.rendimiento import count_cache
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class StaleWhileRevalidateCache:
+    """
+    Caché de proceso para un único valor costoso de obtener.
+    Mientras el valor está fresco se sirve directamente; cuando caduca se
+    sigue sirviendo el último valor válido y se refresca en segundo plano.
+    Solo la primera carga (o la siguiente a una invalidación) es síncrona.
+    """
+
+    def __init__(self, loader, ttl, name="cache", default=None):
+        self._loader = loader
+        self._name = name
+        self._default = default
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._value = default
+        self._loaded_at = None
+        self._valid = False
+        self._refreshing = False
+        self._generation = 0
+
+    def get(self):
+        """Obtener el valor, cargándolo o refrescándolo si es necesario"""
+        with self._lock:
+            if self._valid:
+                if time.monotonic() - self._loaded_at >= self.ttl:
+                    self._start_refresh_locked()
+                count_cache(True)
+                return self._value
+        count_cache(False)
+        return self._load_sync()
+
+    def invalidate(self):
+        """Forzar que la próxima lectura recargue el valor de forma síncrona"""
+        with self._lock:
+            self._valid = False
+            self._generation += 1
+
+    def age(self):
+        """Segundos desde la última carga correcta (None si nunca se cargó)"""
+        with self._lock:
+            if self._loaded_at is None:
+                return None
+            return time.monotonic() - self._loaded_at
+
+    def _load_sync(self):
+        with self._load_lock:
+            # Otro hilo puede haber completado la carga mientras esperábamos
+            with self._lock:
+                if self._valid:
+                    return self._value
+                generation = self._generation
+            self._load(generation)
+            with self._lock:
+                return self._value
+
+    def _start_refresh_locked(self):
+        if self._refreshing:
+            return
+        self._refreshing = True
+        thread = threading.Thread(
+            target=self._refresh,
+            args=(self._generation,),
+            name=f"refresco-{self._name}",
+            daemon=True
+        )
+        thread.start()
+
+    def _refresh(self, generation):
+        try:
+            self._load(generation)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _load(self, generation):
+        try:
+            value = self._loader()
+        except Exception as e:
+            # Conservar el último valor válido si la recarga falla
+            logger.error(f"Error al refrescar la caché {self._name}: {str(e)}")
+            return False
+
+        with self._lock:
+            # Descartar resultados obtenidos antes de una invalidación
+            if generation != self._generation:
+                return False
+            self._value = value
+            self._loaded_at = time.monotonic()
+            self._valid = True
+        return True
@@ -0,0 +1,117 @@
+import os
+import shutil
+import logging
+import threading
+import subprocess
+from utils.ejecucion import run_command
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Binarios que se comprueban al arrancar cada proceso
+STARTUP_BINARIES = ("cloudflared", "systemctl", "curl", "sudo", "python3")
+
+
+def _file_identity(path):
+    """Identidad de un archivo: cambia si se reinstala, se sustituye o se modifica"""
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _path_identity():
+    """Estado de los directorios del PATH: cambia cuando se añade o elimina un binario"""
+    identity = []
+    for directory in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        try:
+            identity.append((directory, os.stat(directory).st_mtime_ns))
+        except OSError:
+            identity.append((directory, None))
+    return tuple(identity)
+
+
+class CapabilityRegistry:
+    """
+    Memoriza la ubicación y la versión de los binarios del sistema
+    Las comprobaciones posteriores solo hacen stat(), sin lanzar procesos:
+    se vuelve a sondear cuando el binario (o el PATH, si no existía) cambia
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._versions = {}
+
+    def which(self, name):
+        """Ruta del binario o None si no está instalado"""
+        with self._lock:
+            cached = self._paths.get(name)
+            if cached is not None:
+                path, identity = cached
+                try:
+                    if path is None:
+                        if identity == _path_identity():
+                            return None
+                    elif _file_identity(path) == identity:
+                        return path
+                except OSError:
+                    pass
+
+            path = shutil.which(name)
+            try:
+                identity = _file_identity(path) if path else _path_identity()
+            except OSError:
+                path, identity = None, _path_identity()
+            self._paths[name] = (path, identity)
+            return path
+
+    def version(self, name, args=("--version",)):
+        """
+        Salida de `<binario> --version` (u otros argumentos)
+        Retorna None si el binario no existe o el comando falla
+        """
+        path = self.which(name)
+        if path is None:
+            return None
+
+        try:
+            identity = _file_identity(os.path.realpath(path))
+        except OSError:
+            return None
+        key = (name, tuple(args))
+        with self._lock:
+            cached = self._versions.get(key)
+            if cached is not None and cached[0] == identity:
+                return cached[1]
+
+        try:
+            result = run_command([path, *args], capture_output=True, text=True, timeout=10)
+            output = result.stdout if result.returncode == 0 else None
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"No se pudo obtener la versión de {name}: {str(e)}")
+            output = None
+
+        with self._lock:
+            self._versions[key] = (identity, output)
+        return output
+
+    def invalidate(self, name=None):
+        """Olvidar lo que se sabe de un binario (o de todos), p. ej. tras instalarlo"""
+        with self._lock:
+            if name is None:
+                self._paths.clear()
+                self._versions.clear()
+                return
+            self._paths.pop(name, None)
+            for key in [key for key in self._versions if key[0] == name]:
+                del self._versions[key]
+
+    def warm_up(self, names=STARTUP_BINARIES):
+        """Sondear al arrancar los binarios habituales para que las peticiones no lo hagan"""
+        for name in names:
+            self.which(name)
+        self.version("cloudflared")
+        self.version("systemctl")
+
+
+# Registro compartido por todo el proceso
+capabilities = CapabilityRegistry()
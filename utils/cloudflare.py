@@ -1,11 +1,18 @@
 import os
 import json
+import asyncio
 import subprocess
 import re
+import signal
 import logging
 from datetime import datetime
 import yaml
-import shutil
+from utils.cache import StaleWhileRevalidateCache
+from utils.capacidades import capabilities
+from utils.ejecucion import run_command, run_command_async, start_background
+from utils.systemd import get_unit_state, get_cloudflared_units_state, invalidate_units_state, units_state_is_stale
+from utils.procesos import get_process_index, find_tunnel_process, invalidate_process_index
+from utils.backend_tuneles import TunnelBackend, get_backend
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -14,20 +21,32 @@ logger = logging.getLogger(__name__)
 CLOUDFLARED_CONFIG_DIR = "/etc/cloudflared"
 SYSTEMD_DIR = "/etc/systemd/system"
 
+# Segundos durante los que el inventario de túneles se considera fresco
+TUNNELS_CACHE_TTL = float(os.environ.get('TUNNELS_CACHE_TTL', 30))
+# Tiempo máximo (segundos) de `cloudflared tunnel info`
+TUNNEL_INFO_TIMEOUT = float(os.environ.get('TUNNEL_INFO_TIMEOUT', 10))
+# Tiempo máximo (segundos) para completar la autenticación de `cloudflared tunnel login`
+LOGIN_TIMEOUT = float(os.environ.get('CLOUDFLARED_LOGIN_TIMEOUT', 300))
+
 def check_cloudflared_installed():
     """Verificar si cloudflared está instalado"""
     try:
-        result = subprocess.run(["which", "cloudflared"], capture_output=True, text=True)
-        return result.returncode == 0
+        return get_backend().is_installed()
     except Exception as e:
         logger.error(f"Error al verificar instalación de cloudflared: {str(e)}")
         return False
 
 def get_cloudflared_version():
     """Obtener la versión de cloudflared instalada"""
+    return get_backend().version()
+
+def _cli_cloudflared_version():
+    """Versión según `cloudflared --version` (memorizada por el registro de capacidades)"""
     try:
-        result = subprocess.run(["cloudflared", "--version"], capture_output=True, text=True)
-        match = re.search(r"version\s+(\S+)", result.stdout)
+        output = capabilities.version("cloudflared")
+        if output is None:
+            return None
+        match = re.search(r"version\s+(\S+)", output)
         if match:
             return match.group(1)
         return "Versión desconocida"
@@ -44,12 +63,14 @@ def install_cloudflared():
     # Intentar primero el método principal (paquete DEB)
     if _install_cloudflared_deb():
         logger.info("Cloudflared instalado correctamente mediante paquete DEB.")
+        capabilities.invalidate("cloudflared")
         return True
     
     # Si falla el método principal, intentar el binario directo
     logger.warning("Instalación mediante paquete DEB falló, intentando método alternativo...")
     if _install_cloudflared_binary():
         logger.info("Cloudflared instalado correctamente mediante binario directo.")
+        capabilities.invalidate("cloudflared")
         return True
     
     # Si todo falla, devolver error
@@ -68,14 +89,12 @@ def _install_cloudflared_deb():
         ]
         
         # Ejecutar con timeout
-        curl_process = subprocess.Popen(curl_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         try:
-            stdout, stderr = curl_process.communicate(timeout=180)  # 3 minutos como máximo
+            curl_process = run_command(curl_cmd, timeout=180, text=False)  # 3 minutos como máximo
             if curl_process.returncode != 0:
-                logger.error(f"Error al descargar: {stderr.decode() if stderr else 'Desconocido'}")
+                logger.error(f"Error al descargar: {curl_process.stderr.decode() if curl_process.stderr else 'Desconocido'}")
                 return False
         except subprocess.TimeoutExpired:
-            curl_process.kill()
             logger.error("Timeout al descargar cloudflared.")
             return False
         
@@ -88,33 +107,30 @@ def _install_cloudflared_deb():
         logger.info("Instalando cloudflared mediante dpkg...")
         dpkg_cmd = ["sudo", "dpkg", "-i", "/tmp/cloudflared.deb"]
         
-        dpkg_process = subprocess.Popen(dpkg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         try:
-            stdout, stderr = dpkg_process.communicate(timeout=120)  # 2 minutos como máximo
+            dpkg_process = run_command(dpkg_cmd, timeout=120, text=False)  # 2 minutos como máximo
             if dpkg_process.returncode != 0:
-                logger.error(f"Error al instalar: {stderr.decode() if stderr else 'Desconocido'}")
+                logger.error(f"Error al instalar: {dpkg_process.stderr.decode() if dpkg_process.stderr else 'Desconocido'}")
                 
                 # Intentar solucionar dependencias
                 logger.info("Intentando solucionar dependencias...")
-                fix_process = subprocess.run(["sudo", "apt-get", "install", "-f", "-y"], 
-                                             capture_output=True, timeout=120)
+                fix_process = run_command(["sudo", "apt-get", "install", "-f", "-y"], timeout=120, text=False)
                 if fix_process.returncode != 0:
                     logger.error("No se pudieron solucionar las dependencias.")
                     return False
                 
                 # Volver a intentar la instalación
-                retry_process = subprocess.run(dpkg_cmd, capture_output=True, timeout=120)
+                retry_process = run_command(dpkg_cmd, timeout=120, text=False)
                 if retry_process.returncode != 0:
                     logger.error("Falló el segundo intento de instalación.")
                     return False
         except subprocess.TimeoutExpired:
-            dpkg_process.kill()
             logger.error("Timeout al instalar cloudflared.")
             return False
         
         # Verificar que cloudflared se instaló correctamente
         verify_cmd = ["which", "cloudflared"]
-        verify_process = subprocess.run(verify_cmd, capture_output=True, timeout=10)
+        verify_process = run_command(verify_cmd, capture_output=True, timeout=10)
         if verify_process.returncode != 0:
             logger.error("No se pudo verificar la instalación de cloudflared.")
             return False
@@ -138,28 +154,26 @@ def _install_cloudflared_binary():
         ]
         
         # Ejecutar con timeout
-        curl_process = subprocess.Popen(curl_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         try:
-            stdout, stderr = curl_process.communicate(timeout=180)
+            curl_process = run_command(curl_cmd, timeout=180, text=False)
             if curl_process.returncode != 0:
-                logger.error(f"Error al descargar binario: {stderr.decode() if stderr else 'Desconocido'}")
+                logger.error(f"Error al descargar binario: {curl_process.stderr.decode() if curl_process.stderr else 'Desconocido'}")
                 return False
         except subprocess.TimeoutExpired:
-            curl_process.kill()
             logger.error("Timeout al descargar binario cloudflared.")
             return False
         
         # Dar permisos de ejecución
         logger.info("Dando permisos de ejecución...")
         chmod_cmd = ["sudo", "chmod", "+x", "/usr/local/bin/cloudflared"]
-        chmod_process = subprocess.run(chmod_cmd, capture_output=True, timeout=10)
+        chmod_process = run_command(chmod_cmd, capture_output=True, timeout=10)
         if chmod_process.returncode != 0:
             logger.error("Error al dar permisos de ejecución.")
             return False
         
         # Verificar que cloudflared se instaló correctamente
         verify_cmd = ["which", "cloudflared"]
-        verify_process = subprocess.run(verify_cmd, capture_output=True, timeout=10)
+        verify_process = run_command(verify_cmd, capture_output=True, timeout=10)
         if verify_process.returncode != 0:
             logger.error("No se pudo verificar la instalación binaria de cloudflared.")
             return False
@@ -178,15 +192,38 @@ def _install_cloudflared_binary():
         logger.error(f"Error durante la instalación de cloudflared (método binario): {str(e)}")
         return False
 
+def _cli_list_tunnels():
+    """Consultar a Cloudflare el inventario de túneles con `cloudflared tunnel list`"""
+    result = run_command(["cloudflared", "tunnel", "list", "--output", "json"], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or "cloudflared tunnel list falló")
+    
+    return json.loads(result.stdout) or []
+
+def _fetch_tunnels_inventory():
+    """
+    Consultar el inventario de túneles al backend
+    Lanza una excepción si falla para conservar el último inventario válido
+    """
+    return tuple(get_backend().list_tunnels())
+
+# Inventario compartido por todo el proceso
+_tunnels_cache = StaleWhileRevalidateCache(
+    _fetch_tunnels_inventory,
+    ttl=TUNNELS_CACHE_TTL,
+    name="inventario-tuneles",
+    default=()
+)
+
+def invalidate_tunnels_cache():
+    """Descartar el inventario en caché tras crear o eliminar túneles"""
+    _tunnels_cache.invalidate()
+
 def get_tunnels_list():
     """Obtener lista de túneles configurados"""
     try:
-        result = subprocess.run(["cloudflared", "tunnel", "list", "--output", "json"], capture_output=True, text=True)
-        if result.returncode != 0:
-            logger.error(f"Error al obtener lista de túneles: {result.stderr}")
-            return []
-        
-        tunnels_data = json.loads(result.stdout)
+        # Copiar cada entrada para no alterar el inventario compartido
+        tunnels_data = [dict(tunnel) for tunnel in _tunnels_cache.get()]
         
         # Añadir información de estado (running o no)
         for tunnel in tunnels_data:
@@ -199,15 +236,22 @@ def get_tunnels_list():
 
 def is_tunnel_running(tunnel_name):
     """Verificar si un túnel está en ejecución"""
+    return get_backend().is_running(tunnel_name)
+
+def _cli_is_tunnel_running(tunnel_name):
+    """Estado según la unidad systemd o, si no la hay, el índice de procesos"""
     try:
-        # Comprobar si el servicio systemd está activo
+        # Comprobar si el servicio systemd está activo (consulta compartida para todos los túneles)
+        unit_state = get_unit_state(tunnel_name)
+        if unit_state is not None:
+            return unit_state["active_state"] == "active"
+        
+        # Unidad instalada pero no cargada en systemd: está inactiva
         if os.path.exists(f"{SYSTEMD_DIR}/cloudflared-{tunnel_name}.service"):
-            result = subprocess.run(["systemctl", "is-active", f"cloudflared-{tunnel_name}"], capture_output=True, text=True)
-            return result.stdout.strip() == "active"
+            return False
         
-        # Alternativa: buscar el proceso
-        ps_result = subprocess.run(["pgrep", "-f", f"cloudflared.*{tunnel_name}"], capture_output=True, text=True)
-        return ps_result.returncode == 0
+        # Alternativa: buscar el proceso en el índice de /proc
+        return find_tunnel_process(tunnel_name) is not None
     except Exception as e:
         logger.error(f"Error al verificar estado del túnel {tunnel_name}: {str(e)}")
         return False
@@ -260,9 +304,9 @@ def ensure_origin_certificate():
                 return {"success": False, "error": "Credenciales no válidas"}
             
             # Ejecutar login
-            login_result = subprocess.run(
+            login_result = run_command(
                 ["cloudflared", "tunnel", "login", "--credentials-file", temp_config],
-                capture_output=True, text=True
+                timeout=LOGIN_TIMEOUT
             )
             
             # Limpiar archivo temporal
@@ -273,9 +317,9 @@ def ensure_origin_certificate():
                 logger.error(f"Error al autenticar con Cloudflare: {login_result.stderr}")
                 # Intentar método interactivo como respaldo
                 logger.info("Intentando método de autenticación interactivo...")
-                interactive_result = subprocess.run(
+                interactive_result = run_command(
                     ["cloudflared", "tunnel", "login"],
-                    capture_output=True, text=True
+                    timeout=LOGIN_TIMEOUT
                 )
                 if interactive_result.returncode != 0:
                     logger.error(f"Error en autenticación interactiva: {interactive_result.stderr}")
@@ -283,9 +327,9 @@ def ensure_origin_certificate():
         else:
             # Sin configuración, intentar método interactivo
             logger.info("No hay credenciales configuradas. Intentando autenticación interactiva...")
-            interactive_result = subprocess.run(
+            interactive_result = run_command(
                 ["cloudflared", "tunnel", "login"],
-                capture_output=True, text=True
+                timeout=LOGIN_TIMEOUT
             )
             if interactive_result.returncode != 0:
                 logger.error(f"Error en autenticación interactiva: {interactive_result.stderr}")
@@ -306,6 +350,13 @@ def ensure_origin_certificate():
 
 def create_tunnel(tunnel_name):
     """Crear un nuevo túnel"""
+    result = get_backend().create(tunnel_name)
+    # El inventario puede haber cambiado aunque falle algún paso posterior
+    invalidate_tunnels_cache()
+    return result
+
+def _cli_create_tunnel(tunnel_name):
+    """Crear el túnel con `cloudflared tunnel create` y obtener su token"""
     try:
         # Primero verificamos/generamos el certificado de origen
         cert_result = ensure_origin_certificate()
@@ -319,7 +370,7 @@ def create_tunnel(tunnel_name):
             env["TUNNEL_ORIGIN_CERT"] = cert_result.get("cert_path")
         
         # Crear el túnel
-        result = subprocess.run(
+        result = run_command(
             ["cloudflared", "tunnel", "create", tunnel_name],
             capture_output=True, text=True, env=env
         )
@@ -337,7 +388,7 @@ def create_tunnel(tunnel_name):
         tunnel_id = tunnel_id_match.group(2)
         
         # Obtener el token del túnel
-        token_result = subprocess.run(
+        token_result = run_command(
             ["cloudflared", "tunnel", "token", "--id", tunnel_id],
             capture_output=True, text=True, env=env
         )
@@ -357,8 +408,12 @@ def create_tunnel(tunnel_name):
 
 def get_tunnel_status(tunnel_name):
     """Obtener el estado de un túnel"""
+    return get_backend().get_status(tunnel_name)
+
+def _cli_get_tunnel_status(tunnel_name):
+    """Estado a partir de systemd, el índice de procesos y `cloudflared tunnel info`"""
     try:
-        tunnel_running = is_tunnel_running(tunnel_name)
+        tunnel_running = _cli_is_tunnel_running(tunnel_name)
         status = {
             "running": tunnel_running,
             "pid": None,
@@ -368,22 +423,11 @@ def get_tunnel_status(tunnel_name):
         }
         
         if tunnel_running:
-            # Obtener PID
-            ps_result = subprocess.run(
-                ["pgrep", "-f", f"cloudflared.*{tunnel_name}"], 
-                capture_output=True, text=True
-            )
-            if ps_result.returncode == 0:
-                status["pid"] = ps_result.stdout.strip()
-                
-                # Obtener uptime
-                if status["pid"]:
-                    uptime_result = subprocess.run(
-                        ["ps", "-p", status["pid"], "-o", "etime="], 
-                        capture_output=True, text=True
-                    )
-                    if uptime_result.returncode == 0:
-                        status["uptime"] = uptime_result.stdout.strip()
+            # Obtener PID y uptime del índice de procesos
+            process = find_tunnel_process(tunnel_name)
+            if process:
+                status["pid"] = process["pid"]
+                status["uptime"] = process["uptime"]
             
             # Verificar conectividad
             status["connectivity"] = check_tunnel_connectivity(tunnel_name)
@@ -402,6 +446,10 @@ def get_tunnel_status(tunnel_name):
 
 def start_tunnel(tunnel_name):
     """Iniciar un túnel"""
+    return get_backend().start(tunnel_name)
+
+def _cli_start_tunnel(tunnel_name):
+    """Iniciar la unidad systemd del túnel o, si no existe, el conector en segundo plano"""
     try:
         # Primero verificamos/generamos el certificado de origen
         cert_result = ensure_origin_certificate()
@@ -418,24 +466,30 @@ def start_tunnel(tunnel_name):
         service_path = f"{SYSTEMD_DIR}/cloudflared-{tunnel_name}.service"
         if os.path.exists(service_path):
             # Iniciar el servicio (systemd maneja las variables de entorno en el .service)
-            result = subprocess.run(
+            result = run_command(
                 ["sudo", "systemctl", "start", f"cloudflared-{tunnel_name}"],
                 capture_output=True, text=True
             )
             
+            invalidate_units_state()
+            invalidate_process_index()
+            
             if result.returncode != 0:
                 logger.error(f"Error al iniciar servicio del túnel: {result.stderr}")
                 return {"success": False, "error": result.stderr}
         else:
-            # Ejecutar en segundo plano
-            result = subprocess.run(
-                ["cloudflared", "tunnel", "run", tunnel_name],
-                capture_output=True, text=True, env=env
-            )
+            # Ejecutar en segundo plano (el conector no termina: no puede esperarse como un comando)
+            process = start_background(["cloudflared", "tunnel", "run", tunnel_name], env=env)
+            invalidate_process_index()
             
-            if result.returncode != 0:
-                logger.error(f"Error al iniciar túnel: {result.stderr}")
-                return {"success": False, "error": result.stderr}
+            # Detectar los fallos inmediatos (credenciales, configuración...)
+            try:
+                returncode = process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                returncode = None
+            if returncode is not None:
+                logger.error(f"Error al iniciar túnel: cloudflared terminó con código {returncode}")
+                return {"success": False, "error": f"cloudflared terminó con código {returncode}"}
         
         return {"success": True}
     except Exception as e:
@@ -444,36 +498,50 @@ def start_tunnel(tunnel_name):
 
 def stop_tunnel(tunnel_name):
     """Detener un túnel"""
+    return get_backend().stop(tunnel_name)
+
+def _cli_stop_tunnel(tunnel_name):
+    """Detener la unidad systemd del túnel o, si no existe, sus procesos"""
     try:
         # Comprobar si existe un servicio systemd para este túnel
         service_path = f"{SYSTEMD_DIR}/cloudflared-{tunnel_name}.service"
         if os.path.exists(service_path):
             # Detener el servicio
-            result = subprocess.run(
+            result = run_command(
                 ["sudo", "systemctl", "stop", f"cloudflared-{tunnel_name}"],
                 capture_output=True, text=True
             )
             
+            invalidate_units_state()
+            invalidate_process_index()
+            
             if result.returncode != 0:
                 logger.error(f"Error al detener servicio del túnel: {result.stderr}")
                 return {"success": False, "error": result.stderr}
         else:
             # Matar el proceso
-            ps_result = subprocess.run(
-                ["pgrep", "-f", f"cloudflared.*{tunnel_name}"], 
-                capture_output=True, text=True
-            )
+            pids = get_process_index(max_age=0).pids(tunnel_name)
             
-            if ps_result.returncode == 0:
-                pid = ps_result.stdout.strip()
-                kill_result = subprocess.run(
-                    ["sudo", "kill", pid],
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                    continue
+                except ProcessLookupError:
+                    continue
+                except PermissionError:
+                    pass
+                
+                # Sin permisos suficientes: recurrir a sudo
+                kill_result = run_command(
+                    ["sudo", "kill", str(pid)],
                     capture_output=True, text=True
                 )
                 
                 if kill_result.returncode != 0:
                     logger.error(f"Error al matar proceso del túnel: {kill_result.stderr}")
                     return {"success": False, "error": kill_result.stderr}
+            
+            invalidate_process_index()
         
         return {"success": True}
     except Exception as e:
@@ -482,16 +550,22 @@ def stop_tunnel(tunnel_name):
 
 def delete_tunnel(tunnel_name):
     """Eliminar un túnel"""
+    result = get_backend().delete(tunnel_name)
+    invalidate_tunnels_cache()
+    return result
+
+def _cli_delete_tunnel(tunnel_name):
+    """Eliminar el túnel con `cloudflared tunnel delete`, su unidad systemd y sus archivos"""
     try:
         # Primero detener el túnel si está en ejecución
-        if is_tunnel_running(tunnel_name):
-            stop_result = stop_tunnel(tunnel_name)
+        if _cli_is_tunnel_running(tunnel_name):
+            stop_result = _cli_stop_tunnel(tunnel_name)
             if not stop_result["success"]:
                 logger.error(f"Error al detener túnel antes de eliminarlo: {stop_result['error']}")
                 return {"success": False, "error": f"No se pudo detener el túnel: {stop_result['error']}"}
         
         # Eliminar el túnel
-        result = subprocess.run(
+        result = run_command(
             ["cloudflared", "tunnel", "delete", tunnel_name],
             capture_output=True, text=True
         )
@@ -506,7 +580,8 @@ def delete_tunnel(tunnel_name):
             try:
                 os.remove(service_path)
                 # Recargar systemd
-                subprocess.run(["sudo", "systemctl", "daemon-reload"], check=True)
+                run_command(["sudo", "systemctl", "daemon-reload"], check=True)
+                invalidate_units_state()
             except Exception as e:
                 logger.warning(f"No se pudo eliminar el archivo de servicio: {str(e)}")
         
@@ -541,7 +616,7 @@ def configure_tunnel_service(tunnel_name):
             return {"success": False, "error": f"No se encontró el túnel {tunnel_name}"}
         
         # Verificar si systemd está disponible
-        systemd_available = shutil.which('systemctl') is not None
+        systemd_available = capabilities.which('systemctl') is not None
         
         if systemd_available:
             # Crear el archivo de servicio systemd
@@ -566,8 +641,9 @@ WantedBy=multi-user.target
                 f.write(service_content)
             
             # Recargar systemd y habilitar el servicio
-            subprocess.run(["sudo", "systemctl", "daemon-reload"], check=True)
-            subprocess.run(["sudo", "systemctl", "enable", f"cloudflared-{tunnel_name}"], check=True)
+            run_command(["sudo", "systemctl", "daemon-reload"], check=True)
+            run_command(["sudo", "systemctl", "enable", f"cloudflared-{tunnel_name}"], check=True)
+            invalidate_units_state()
             
             return {"success": True, "method": "systemd"}
         else:
@@ -668,13 +744,13 @@ exit 0
 def check_tunnel_connectivity(tunnel_name):
     """Verificar la conectividad del túnel"""
     try:
-        if not is_tunnel_running(tunnel_name):
+        if not _cli_is_tunnel_running(tunnel_name):
             return False
         
         # Verificar la salida de cloudflared status
-        result = subprocess.run(
+        result = run_command(
             ["cloudflared", "tunnel", "info", tunnel_name],
-            capture_output=True, text=True
+            timeout=TUNNEL_INFO_TIMEOUT
         )
         
         if result.returncode != 0:
@@ -689,3 +765,103 @@ def check_tunnel_connectivity(tunnel_name):
     except Exception as e:
         logger.error(f"Error al verificar conectividad del túnel {tunnel_name}: {str(e)}")
         return False
+
+
+class CliBackend(TunnelBackend):
+    """Túneles reales: `cloudflared` para el inventario y la conectividad, systemd y /proc para el estado"""
+
+    name = "cli"
+
+    def is_installed(self):
+        return capabilities.which("cloudflared") is not None
+
+    def version(self):
+        return _cli_cloudflared_version()
+
+    def list_tunnels(self):
+        return _cli_list_tunnels()
+
+    def refresh(self):
+        # Estado de todas las unidades cloudflared-* en una única llamada a systemctl
+        get_cloudflared_units_state(max_age=0)
+        get_process_index(max_age=0)
+
+    def is_running(self, tunnel_name):
+        return _cli_is_tunnel_running(tunnel_name)
+
+    def find_process(self, tunnel_name):
+        return find_tunnel_process(tunnel_name)
+
+    def get_status(self, tunnel_name):
+        return _cli_get_tunnel_status(tunnel_name)
+
+    def get_metrics(self, tunnel_name):
+        from utils.monitorizacion import get_connector_metrics
+        return get_connector_metrics(tunnel_name)
+
+    def _local_state(self, tunnel_name):
+        """Unidad activa y proceso en ejecución (de las cachés de systemd y /proc)"""
+        unit_state = get_cloudflared_units_state().get(tunnel_name)
+        service_active = unit_state is not None and unit_state["active_state"] == "active"
+        return service_active, get_process_index().find(tunnel_name) is not None
+
+    def check(self, tunnel_name):
+        service_active, process_running = self._local_state(tunnel_name)
+        
+        # Información del conector (se incluye en las alertas) solo si está en ejecución
+        info = None
+        if process_running:
+            try:
+                result = run_command(
+                    ["cloudflared", "tunnel", "info", tunnel_name],
+                    capture_output=True, text=True, timeout=5
+                )
+                if result.returncode == 0:
+                    info = result.stdout
+            except Exception as e:
+                logger.warning(f"No se pudo obtener la información del túnel {tunnel_name}: {str(e)}")
+        
+        return {
+            "service_active": service_active,
+            "process_running": process_running,
+            "info": info
+        }
+
+    async def check_async(self, tunnel_name):
+        # El estado local sale de cachés compartidas (como mucho un systemctl y un recorrido de /proc por TTL)
+        service_active, process_running = await asyncio.to_thread(self._local_state, tunnel_name)
+        
+        info = None
+        if process_running:
+            try:
+                result = await run_command_async(["cloudflared", "tunnel", "info", tunnel_name], timeout=5)
+                if result.returncode == 0:
+                    info = result.stdout
+            except (OSError, subprocess.TimeoutExpired) as e:
+                logger.warning(f"No se pudo obtener la información del túnel {tunnel_name}: {str(e)}")
+        
+        return {
+            "service_active": service_active,
+            "process_running": process_running,
+            "info": info
+        }
+
+    def quick_states(self, tunnel_names):
+        # Una llamada a systemctl y un recorrido de /proc para toda la flota
+        self.refresh()
+        if units_state_is_stale():
+            # Con el último estado bueno no se detectan cambios: no adelantar comprobaciones
+            return None
+        return {name: self._local_state(name) for name in tunnel_names}
+
+    def start(self, tunnel_name):
+        return _cli_start_tunnel(tunnel_name)
+
+    def stop(self, tunnel_name):
+        return _cli_stop_tunnel(tunnel_name)
+
+    def create(self, tunnel_name):
+        return _cli_create_tunnel(tunnel_name)
+
+    def delete(self, tunnel_name):
+        return _cli_delete_tunnel(tunnel_name)
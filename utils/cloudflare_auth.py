@@ -3,6 +3,7 @@ import json
 import logging
 import requests
 from pathlib import Path
+from utils.rendimiento import timed
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -12,6 +13,7 @@ CONFIG_DIR = "/opt/gestor-tuneles-cloudflare/config"
 CF_CONFIG_FILE = os.path.join(CONFIG_DIR, "cloudflare.json")
 
 
+@timed("io")
 def load_cloudflare_config():
     """Cargar la configuración de Cloudflare"""
     try:
@@ -78,6 +80,7 @@ def test_cloudflare_auth():
         return False, f"Error al conectar con Cloudflare: {str(e)}"
 
 
+@timed("io")
 def save_cloudflare_config(api_key, email):
     """Guardar la configuración de Cloudflare"""
     try:
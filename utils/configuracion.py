@@ -2,9 +2,12 @@ import os
 import json
 import yaml
 import logging
-import subprocess
-import shutil
 from pathlib import Path
+from utils.systemd import is_unit_active, invalidate_units_state
+from utils.sockets_escucha import get_listener_index
+from utils.capacidades import capabilities
+from utils.ejecucion import run_command
+from utils.rendimiento import timed
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -23,6 +26,24 @@ def ensure_config_dirs():
         logger.error(f"Error al crear directorios de configuración: {str(e)}")
         return False
 
+# Solo las lecturas y escrituras de archivos cuentan como "io" en Server-Timing; las funciones
+# que además ejecutan comandos ya los atribuyen a "subprocess" a través de run_command
+
+@timed("io")
+def _read_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+@timed("io")
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+@timed("io")
+def _write_yaml(path, data):
+    with open(path, 'w') as f:
+        yaml.dump(data, f, default_flow_style=False)
+
 def read_tunnel_config(tunnel_name):
     """
     Leer la configuración de un túnel
@@ -33,8 +54,7 @@ def read_tunnel_config(tunnel_name):
     
     try:
         if os.path.exists(config_path):
-            with open(config_path, 'r') as f:
-                return json.load(f)
+            return _read_json(config_path)
         else:
             # Intentar buscar el archivo de configuración del túnel
             # que puede estar en la raíz del directorio de configuración
@@ -43,25 +63,24 @@ def read_tunnel_config(tunnel_name):
             
             for file in tunnel_files:
                 try:
-                    with open(os.path.join(CLOUDFLARED_CONFIG_DIR, file), 'r') as f:
-                        data = json.load(f)
-                        if 'TunnelID' in data:
-                            # Verificar si es este túnel
-                            result = subprocess.run(
-                                ["cloudflared", "tunnel", "info", tunnel_name, "--output", "json"],
-                                capture_output=True, text=True
-                            )
-                            if result.returncode == 0:
-                                tunnel_info = json.loads(result.stdout)
-                                if 'id' in tunnel_info and tunnel_info['id'] == data['TunnelID']:
-                                    # Es este túnel, copiar la configuración
-                                    config = {
-                                        'tunnel_id': data['TunnelID'],
-                                        'credentials_file': os.path.join(CLOUDFLARED_CONFIG_DIR, file),
-                                        'services': []
-                                    }
-                                    save_tunnel_config(tunnel_name, config)
-                                    return config
+                    data = _read_json(os.path.join(CLOUDFLARED_CONFIG_DIR, file))
+                    if 'TunnelID' in data:
+                        # Verificar si es este túnel
+                        result = run_command(
+                            ["cloudflared", "tunnel", "info", tunnel_name, "--output", "json"],
+                            capture_output=True, text=True
+                        )
+                        if result.returncode == 0:
+                            tunnel_info = json.loads(result.stdout)
+                            if 'id' in tunnel_info and tunnel_info['id'] == data['TunnelID']:
+                                # Es este túnel, copiar la configuración
+                                config = {
+                                    'tunnel_id': data['TunnelID'],
+                                    'credentials_file': os.path.join(CLOUDFLARED_CONFIG_DIR, file),
+                                    'services': []
+                                }
+                                save_tunnel_config(tunnel_name, config)
+                                return config
                 except Exception as e:
                     logger.error(f"Error al leer archivo de configuración {file}: {str(e)}")
                     continue
@@ -81,8 +100,7 @@ def save_tunnel_config(tunnel_name, config):
     config_path = os.path.join(CONFIG_DIR, f"{tunnel_name}.json")
     
     try:
-        with open(config_path, 'w') as f:
-            json.dump(config, f, indent=2)
+        _write_json(config_path, config)
             
         # Verificar si necesitamos generar un archivo config.yml para el túnel
         if 'services' in config and config['services']:
@@ -119,101 +137,90 @@ def generate_tunnel_config_yaml(tunnel_name, config):
         
         # Guardar el archivo YAML
         yaml_path = os.path.join(CLOUDFLARED_CONFIG_DIR, f"{tunnel_name}.yml")
-        with open(yaml_path, 'w') as f:
-            yaml.dump(yaml_config, f, default_flow_style=False)
+        _write_yaml(yaml_path, yaml_config)
             
         return True
     except Exception as e:
         logger.error(f"Error al generar config.yml para túnel {tunnel_name}: {str(e)}")
         return False
 
+# Puertos conocidos y nombre con el que se muestran
+KNOWN_PORTS = {
+    80: "HTTP",
+    443: "HTTPS",
+    22: "SSH",
+    21: "FTP",
+    3306: "MySQL",
+    5432: "PostgreSQL",
+    6379: "Redis",
+    27017: "MongoDB",
+    25: "SMTP",
+    110: "POP3",
+    143: "IMAP"
+}
+
+# Unidades de systemd conocidas y nombre con el que se muestran
+KNOWN_UNITS = {
+    "nginx.service": "Nginx",
+    "apache2.service": "Apache",
+    "httpd.service": "Apache",
+    "mysql.service": "MySQL",
+    "mariadb.service": "MySQL",
+    "postgresql.service": "PostgreSQL",
+    "redis-server.service": "Redis",
+    "mongod.service": "MongoDB",
+    "mongodb.service": "MongoDB",
+    "ssh.service": "SSH",
+    "sshd.service": "SSH",
+    "vsftpd.service": "FTP",
+    "postfix.service": "SMTP"
+}
+
 def get_available_services():
     """
     Detectar servicios disponibles en el sistema
     Retorna una lista de servicios con su información
     """
-    services = []
-    
-    # Servicios comunes y sus puertos por defecto
-    common_services = [
-        {"name": "HTTP", "port": 80, "running": False},
-        {"name": "HTTPS", "port": 443, "running": False},
-        {"name": "SSH", "port": 22, "running": False},
-        {"name": "FTP", "port": 21, "running": False},
-        {"name": "MySQL", "port": 3306, "running": False},
-        {"name": "PostgreSQL", "port": 5432, "running": False},
-        {"name": "Redis", "port": 6379, "running": False},
-        {"name": "MongoDB", "port": 27017, "running": False},
-        {"name": "SMTP", "port": 25, "running": False},
-        {"name": "POP3", "port": 110, "running": False},
-        {"name": "IMAP", "port": 143, "running": False}
-    ]
-    
     try:
-        # Verificar qué servicios están escuchando en los puertos
-        netstat_result = subprocess.run(
-            ["ss", "-tulpn"],
-            capture_output=True,
-            text=True
-        )
+        index = get_listener_index()
         
-        if netstat_result.returncode == 0:
-            output = netstat_result.stdout
-            
-            # Verificar cada servicio
-            for service in common_services:
-                # Buscar puerto en el output de netstat
-                port_str = f":{service['port']}"
-                service["running"] = port_str in output
-                services.append(service)
+        # Un servicio por protocolo y puerto (IPv4 e IPv6 se agrupan)
+        services = {}
+        for listener in index.listeners:
+            key = (listener["protocol"], listener["port"])
+            if key in services:
+                continue
+            unit = listener["unit"]
+            name = KNOWN_UNITS.get(unit) or KNOWN_PORTS.get(listener["port"]) or listener["process"] or "Desconocido"
+            services[key] = {
+                "name": name,
+                "port": listener["port"],
+                "protocol": listener["protocol"],
+                "address": listener["address"],
+                "process": listener["process"],
+                "pid": listener["pid"],
+                "unit": unit,
+                "running": True
+            }
         
-        # Verificar si systemd está disponible
-        systemd_available = shutil.which('systemctl') is not None
+        # Los servicios habituales se muestran aunque no estén escuchando
+        for port, name in KNOWN_PORTS.items():
+            if not index.is_listening(port, "tcp"):
+                services[("tcp", port)] = {
+                    "name": name,
+                    "port": port,
+                    "protocol": "tcp",
+                    "address": None,
+                    "process": None,
+                    "pid": None,
+                    "unit": None,
+                    "running": False
+                }
         
-        if systemd_available:
-            # Detectar servicios específicos mediante systemctl
-            systemctl_services = {
-                "nginx": {"name": "Nginx", "port": 80},
-                "apache2": {"name": "Apache", "port": 80},
-                "mysql": {"name": "MySQL", "port": 3306},
-                "postgresql": {"name": "PostgreSQL", "port": 5432},
-                "redis-server": {"name": "Redis", "port": 6379},
-                "mongodb": {"name": "MongoDB", "port": 27017},
-                "sshd": {"name": "SSH", "port": 22},
-                "vsftpd": {"name": "FTP", "port": 21},
-                "postfix": {"name": "SMTP", "port": 25}
-            }
-            
-            for service_name, service_info in systemctl_services.items():
-                try:
-                    result = subprocess.run(
-                        ["systemctl", "is-active", service_name],
-                        capture_output=True,
-                        text=True
-                    )
-                    
-                    if result.stdout.strip() == "active":
-                        # Evitar duplicados
-                        if not any(s["name"] == service_info["name"] for s in services):
-                            services.append({
-                                "name": service_info["name"],
-                                "port": service_info["port"],
-                                "running": True
-                            })
-                        # Actualizar estado si ya existe
-                        else:
-                            for i, s in enumerate(services):
-                                if s["name"] == service_info["name"]:
-                                    services[i]["running"] = True
-                except Exception as e:
-                    # Ignorar errores individuales de servicios
-                    logger.debug(f"Error al verificar servicio {service_name}: {str(e)}")
-                    continue
-                            
-        return services
+        return sorted(services.values(), key=lambda s: (not s["running"], s["port"], s["protocol"]))
     except Exception as e:
         logger.error(f"Error al detectar servicios disponibles: {str(e)}")
-        return common_services
+        return [{"name": name, "port": port, "running": False} for port, name in KNOWN_PORTS.items()]
 
 def add_service_to_tunnel(tunnel_name, service_name, service_port, domain):
     """
@@ -254,23 +261,18 @@ def add_service_to_tunnel(tunnel_name, service_name, service_port, domain):
             service_name = f"cloudflared-{tunnel_name}"
             
             # Verificar si systemd está disponible
-            systemd_available = shutil.which('systemctl') is not None
+            systemd_available = capabilities.which('systemctl') is not None
             
             if systemd_available:
                 # Intenta reiniciar el servicio via systemd si está activo
                 try:
-                    restart_result = subprocess.run(
-                        ["systemctl", "is-active", service_name],
-                        capture_output=True,
-                        text=True
-                    )
-                    
-                    if restart_result.stdout.strip() == "active":
-                        subprocess.run(
+                    if is_unit_active(tunnel_name):
+                        run_command(
                             ["sudo", "systemctl", "restart", service_name],
                             capture_output=True,
                             text=True
                         )
+                        invalidate_units_state()
                         logger.info(f"Servicio {service_name} reiniciado mediante systemd")
                 except Exception as e:
                     logger.warning(f"No se pudo reiniciar el servicio systemd: {str(e)}")
@@ -280,7 +282,7 @@ def add_service_to_tunnel(tunnel_name, service_name, service_port, domain):
                 if os.path.exists(script_path) and os.access(script_path, os.X_OK):
                     try:
                         # Reiniciar el túnel usando el script
-                        subprocess.run(
+                        run_command(
                             ["sudo", script_path, "restart"],
                             capture_output=True,
                             text=True
@@ -331,23 +333,18 @@ def remove_service_from_tunnel(tunnel_name, service_name):
             service_name = f"cloudflared-{tunnel_name}"
             
             # Verificar si systemd está disponible
-            systemd_available = shutil.which('systemctl') is not None
+            systemd_available = capabilities.which('systemctl') is not None
             
             if systemd_available:
                 # Intenta reiniciar el servicio via systemd si está activo
                 try:
-                    restart_result = subprocess.run(
-                        ["systemctl", "is-active", service_name],
-                        capture_output=True,
-                        text=True
-                    )
-                    
-                    if restart_result.stdout.strip() == "active":
-                        subprocess.run(
+                    if is_unit_active(tunnel_name):
+                        run_command(
                             ["sudo", "systemctl", "restart", service_name],
                             capture_output=True,
                             text=True
                         )
+                        invalidate_units_state()
                         logger.info(f"Servicio {service_name} reiniciado mediante systemd")
                 except Exception as e:
                     logger.warning(f"No se pudo reiniciar el servicio systemd: {str(e)}")
@@ -357,7 +354,7 @@ def remove_service_from_tunnel(tunnel_name, service_name):
                 if os.path.exists(script_path) and os.access(script_path, os.X_OK):
                     try:
                         # Reiniciar el túnel usando el script
-                        subprocess.run(
+                        run_command(
                             ["sudo", script_path, "restart"],
                             capture_output=True,
                             text=True
@@ -0,0 +1,327 @@
+import os
+import time
+import asyncio
+import signal
+import bisect
+import logging
+import threading
+import subprocess
+from utils.rendimiento import add_timing
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Tiempo máximo (segundos) por defecto para cualquier comando
+COMMAND_DEFAULT_TIMEOUT = float(os.environ.get('COMMAND_DEFAULT_TIMEOUT', 30))
+# Comandos externos simultáneos en todo el proceso
+COMMAND_MAX_CONCURRENCY = int(os.environ.get('COMMAND_MAX_CONCURRENCY', 16))
+# Comandos simultáneos de un mismo binario (p. ej. cloudflared)
+COMMAND_MAX_PER_BINARY = int(os.environ.get('COMMAND_MAX_PER_BINARY', 6))
+
+# Tiempos máximos por binario cuando la llamada no indica uno
+COMMAND_TIMEOUTS = {
+    "cloudflared": 30,
+    "systemctl": 15,
+    "kill": 5,
+    "chmod": 10,
+    "mkdir": 10,
+    "cp": 10,
+    "rm": 10,
+    "tee": 10,
+    "curl": 180,
+    "dpkg": 300,
+    "apt-get": 600
+}
+
+# Palabras de la orden que forman la etiqueta de las estadísticas (sin argumentos variables)
+_LABEL_DEPTH = {
+    "cloudflared": 2,
+    "systemctl": 1,
+    "apt-get": 1
+}
+
+# Límites superiores (ms) de las cubetas del histograma de latencia
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+_global_semaphore = threading.BoundedSemaphore(COMMAND_MAX_CONCURRENCY)
+_binary_semaphores = {}
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _binary(cmd):
+    """Binario que realmente se ejecuta (se ignora sudo y sus opciones)"""
+    args = list(cmd)
+    if args and os.path.basename(args[0]) == "sudo":
+        args = args[1:]
+        while args and args[0].startswith("-"):
+            args = args[1:]
+    return os.path.basename(args[0]) if args else "", args
+
+
+def command_label(cmd):
+    """Etiqueta estable de un comando, p. ej. 'cloudflared tunnel info' o 'sudo systemctl start'"""
+    binary, args = _binary(cmd)
+    words = [binary]
+    for arg in args[1:]:
+        if len(words) > _LABEL_DEPTH.get(binary, 0):
+            break
+        if not arg.startswith("-"):
+            words.append(arg)
+    label = " ".join(words)
+    if cmd and os.path.basename(cmd[0]) == "sudo":
+        label = f"sudo {label}"
+    return label
+
+
+def _semaphore_for(binary):
+    with _stats_lock:
+        semaphore = _binary_semaphores.get(binary)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(COMMAND_MAX_PER_BINARY)
+            _binary_semaphores[binary] = semaphore
+        return semaphore
+
+
+def _record(label, elapsed, outcome):
+    """Acumular latencia y resultado de una ejecución"""
+    elapsed_ms = elapsed * 1000
+    with _stats_lock:
+        entry = _stats.get(label)
+        if entry is None:
+            entry = {
+                "count": 0,
+                "failures": 0,
+                "timeouts": 0,
+                "errors": 0,
+                "rejected": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1)
+            }
+            _stats[label] = entry
+        if outcome == "rejected":
+            entry["rejected"] += 1
+            return
+        entry["count"] += 1
+        entry["total_ms"] += elapsed_ms
+        entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+        entry["buckets"][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        if outcome == "failure":
+            entry["failures"] += 1
+        elif outcome == "timeout":
+            entry["timeouts"] += 1
+        elif outcome == "error":
+            entry["errors"] += 1
+
+
+def _percentile(buckets, count, fraction):
+    """Percentil aproximado: límite superior de la cubeta que lo contiene"""
+    if not count:
+        return None
+    target = fraction * count
+    seen = 0
+    for i, bucket in enumerate(buckets):
+        seen += bucket
+        if seen >= target:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+
+def get_command_stats():
+    """Estadísticas por comando: ejecuciones, fallos, tiempos y percentiles aproximados"""
+    with _stats_lock:
+        snapshot = {label: dict(entry, buckets=list(entry["buckets"])) for label, entry in _stats.items()}
+
+    stats = {}
+    for label, entry in snapshot.items():
+        count = entry["count"]
+        stats[label] = {
+            "count": count,
+            "failures": entry["failures"],
+            "timeouts": entry["timeouts"],
+            "errors": entry["errors"],
+            "rejected": entry["rejected"],
+            "total_ms": round(entry["total_ms"], 1),
+            "avg_ms": round(entry["total_ms"] / count, 1) if count else None,
+            "max_ms": round(entry["max_ms"], 1),
+            "p50_ms": _percentile(entry["buckets"], count, 0.50),
+            "p95_ms": _percentile(entry["buckets"], count, 0.95),
+            "p99_ms": _percentile(entry["buckets"], count, 0.99),
+            "histogram": {
+                (f"<={bound}" if i < len(LATENCY_BUCKETS_MS) else f">{LATENCY_BUCKETS_MS[-1]}"): n
+                for i, (bound, n) in enumerate(zip(LATENCY_BUCKETS_MS + (None,), entry["buckets"]))
+            }
+        }
+    # Primero los comandos que más tiempo acumulan
+    return dict(sorted(stats.items(), key=lambda item: item[1]["total_ms"], reverse=True))
+
+
+def reset_command_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _kill_group(process):
+    """Terminar el proceso y todos sus hijos (se lanzó en su propio grupo)"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # Hijos de sudo que pertenecen a root: al menos terminar el proceso directo
+        try:
+            process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def run_command(cmd, timeout=None, check=False, capture_output=True, text=True, input=None, **kwargs):
+    """
+    Ejecutar un comando externo como subprocess.run (retorna un CompletedProcess), salvo que
+    por defecto captura la salida y la decodifica como texto (capture_output=True, text=True);
+    pase capture_output=False o text=False para el comportamiento de subprocess.run
+    Aplica un tiempo máximo por defecto, limita la concurrencia global y por binario,
+    mata el grupo de procesos completo si se agota el tiempo y registra la latencia
+    Lanza subprocess.TimeoutExpired si el comando (o la espera de turno) supera el tiempo
+    """
+    binary, _ = _binary(cmd)
+    label = command_label(cmd)
+    if timeout is None:
+        timeout = COMMAND_TIMEOUTS.get(binary, COMMAND_DEFAULT_TIMEOUT)
+
+    start = time.monotonic()
+    deadline = start + timeout
+    try:
+        return _run_limited(cmd, binary, label, deadline, timeout, check, capture_output, text, input, kwargs)
+    finally:
+        # Tiempo atribuido a la petición en curso, incluida la espera de turno
+        add_timing("subprocess", time.monotonic() - start)
+
+
+def _run_limited(cmd, binary, label, deadline, timeout, check, capture_output, text, input, kwargs):
+    binary_semaphore = _semaphore_for(binary)
+    if not binary_semaphore.acquire(timeout=timeout):
+        _record(label, 0, "rejected")
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    try:
+        if not _global_semaphore.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            _record(label, 0, "rejected")
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        try:
+            return _execute(cmd, label, deadline, timeout, check, capture_output, text, input, kwargs)
+        finally:
+            _global_semaphore.release()
+    finally:
+        binary_semaphore.release()
+
+
+def _execute(cmd, label, deadline, timeout, check, capture_output, text, input, kwargs):
+    if capture_output:
+        kwargs.setdefault("stdout", subprocess.PIPE)
+        kwargs.setdefault("stderr", subprocess.PIPE)
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+
+    start = time.monotonic()
+    try:
+        process = subprocess.Popen(cmd, text=text, start_new_session=True, **kwargs)
+    except OSError:
+        _record(label, time.monotonic() - start, "error")
+        raise
+
+    try:
+        stdout, stderr = process.communicate(input=input, timeout=max(0.0, deadline - time.monotonic()))
+    except subprocess.TimeoutExpired:
+        _kill_group(process)
+        stdout, stderr = process.communicate()
+        _record(label, time.monotonic() - start, "timeout")
+        logger.warning(f"El comando '{label}' superó {timeout:g} s y se ha terminado")
+        raise subprocess.TimeoutExpired(cmd, timeout, output=stdout, stderr=stderr)
+    except BaseException:
+        _kill_group(process)
+        process.wait()
+        _record(label, time.monotonic() - start, "error")
+        raise
+
+    returncode = process.poll()
+    _record(label, time.monotonic() - start, "ok" if returncode == 0 else "failure")
+    result = subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+    if check:
+        result.check_returncode()
+    return result
+
+
+async def run_command_async(cmd, timeout=None, input=None, **kwargs):
+    """
+    Versión para asyncio de run_command (asyncio.create_subprocess_exec)
+    Aplica el mismo tiempo máximo por binario, mata el grupo de procesos si se agota
+    o si se cancela la tarea y registra la latencia en las mismas estadísticas
+    La concurrencia la limita quien llama (p. ej. con un asyncio.Semaphore)
+    Retorna un CompletedProcess con la salida como texto
+    """
+    binary, _ = _binary(cmd)
+    label = command_label(cmd)
+    if timeout is None:
+        timeout = COMMAND_TIMEOUTS.get(binary, COMMAND_DEFAULT_TIMEOUT)
+
+    start = time.monotonic()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+            **kwargs
+        )
+    except OSError:
+        _record(label, time.monotonic() - start, "error")
+        raise
+
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            process.communicate(input.encode() if input is not None else None),
+            timeout
+        )
+    except asyncio.TimeoutError:
+        _kill_group(process)
+        await process.wait()
+        _record(label, time.monotonic() - start, "timeout")
+        logger.warning(f"El comando '{label}' superó {timeout:g} s y se ha terminado")
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    except BaseException:
+        # Tarea cancelada (p. ej. por el plazo de quien llama): no dejar el proceso huérfano
+        _kill_group(process)
+        await process.wait()
+        _record(label, time.monotonic() - start, "error")
+        raise
+
+    _record(label, time.monotonic() - start, "ok" if process.returncode == 0 else "failure")
+    return subprocess.CompletedProcess(
+        cmd,
+        process.returncode,
+        stdout.decode("utf-8", "replace"),
+        stderr.decode("utf-8", "replace")
+    )
+
+
+def start_background(cmd, **kwargs):
+    """
+    Lanzar un proceso de larga duración desvinculado de la petición (p. ej. un conector)
+    La salida se descarta para que no se bloquee al llenarse un pipe que nadie lee
+    """
+    label = command_label(cmd)
+    start = time.monotonic()
+    try:
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+            **kwargs
+        )
+    except OSError:
+        _record(label, time.monotonic() - start, "error")
+        raise
+    _record(label, time.monotonic() - start, "ok")
+    return process
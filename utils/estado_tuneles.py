@@ -0,0 +1,138 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.cloudflare import get_tunnel_status
+from utils.monitorizacion import get_tunnel_metrics
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Hilos máximos para consultar túneles en paralelo (compartidos por todas las peticiones)
+ESTADO_MAX_WORKERS = int(os.environ.get('ESTADO_MAX_WORKERS', 8))
+# Tiempo total máximo (segundos) que una petición espera por el estado de los túneles
+ESTADO_TOTAL_BUDGET = float(os.environ.get('ESTADO_TOTAL_BUDGET', 10))
+# Tiempo máximo (segundos) para el estado de un túnel desde que empieza a consultarse
+ESTADO_TUNNEL_DEADLINE = float(os.environ.get('ESTADO_TUNNEL_DEADLINE', 6))
+
+_executor = ThreadPoolExecutor(max_workers=ESTADO_MAX_WORKERS, thread_name_prefix="estado-tunel")
+
+# Último resultado completo de cada túnel y su momento (epoch), para mostrarlo si una consulta se retrasa
+_last_known = {}
+_last_known_lock = threading.Lock()
+
+
+def _collect_one(tunnel_name, started):
+    """Obtener estado y métricas de un túnel"""
+    started[tunnel_name] = time.monotonic()
+    status = get_tunnel_status(tunnel_name)
+    metrics = get_tunnel_metrics(tunnel_name) if status['running'] else None
+    return status, metrics
+
+
+def _remember(tunnel_name):
+    def callback(future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with _last_known_lock:
+            _last_known[tunnel_name] = (time.time(), future.result())
+    return callback
+
+
+def _stale_result(tunnel_name):
+    """Resultado para un túnel que no respondió a tiempo"""
+    with _last_known_lock:
+        previous = _last_known.get(tunnel_name)
+
+    if previous:
+        sampled_at, (status, metrics) = previous
+        status = dict(status, stale=True, sampled_at=sampled_at, stale_age=round(time.time() - sampled_at, 1))
+        return status, metrics
+
+    return {
+        "running": False,
+        "pid": None,
+        "uptime": None,
+        "connectivity": False,
+        "last_updated": None,
+        "stale": True,
+        "unknown": True
+    }, None
+
+
+def collect_tunnels_status(tunnel_names, total_budget=None, tunnel_deadline=None):
+    """
+    Obtener en paralelo el estado y las métricas de varios túneles
+    Los túneles que superan su plazo se devuelven marcados como 'stale'
+    Retorna una tupla (estados, métricas) indexada por nombre de túnel
+    """
+    if total_budget is None:
+        total_budget = ESTADO_TOTAL_BUDGET
+    if tunnel_deadline is None:
+        tunnel_deadline = ESTADO_TUNNEL_DEADLINE
+
+    statuses = {}
+    metrics = {}
+    begin = time.monotonic()
+    started = {}
+
+    futures = {}
+    for tunnel_name in tunnel_names:
+        future = _executor.submit(_collect_one, tunnel_name, started)
+        future.add_done_callback(_remember(tunnel_name))
+        futures[future] = tunnel_name
+
+    pending = set(futures)
+    while pending:
+        now = time.monotonic()
+        remaining = begin + total_budget - now
+        if remaining <= 0:
+            break
+
+        # Abandonar los túneles que ya han agotado su plazo individual
+        next_deadline = begin + total_budget
+        for future in list(pending):
+            start = started.get(futures[future])
+            if start is None:
+                continue
+            if now - start >= tunnel_deadline:
+                pending.discard(future)
+            else:
+                next_deadline = min(next_deadline, start + tunnel_deadline)
+        if not pending:
+            break
+
+        done, pending = wait(pending, timeout=max(0.01, next_deadline - now), return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                statuses[futures[future]], metrics[futures[future]] = future.result()
+
+    for future, tunnel_name in futures.items():
+        if tunnel_name in statuses:
+            continue
+        if future.done() and not future.cancelled():
+            error = future.exception()
+            if error is None:
+                statuses[tunnel_name], metrics[tunnel_name] = future.result()
+                continue
+            # Un fallo de la consulta no es un retraso: registrarlo con su causa
+            logger.error(f"Error al obtener el estado del túnel {tunnel_name}, se muestra el último conocido: {str(error)}")
+        else:
+            # Las consultas que aún no han empezado ya no son necesarias
+            future.cancel()
+            logger.warning(f"El estado del túnel {tunnel_name} no llegó a tiempo, se muestra como desactualizado")
+        statuses[tunnel_name], metrics[tunnel_name] = _stale_result(tunnel_name)
+
+    return statuses, metrics
+
+
+def refresh_tunnels_status(tunnel_names, total_budget=None, tunnel_deadline=None):
+    """
+    Variante para el recolector en segundo plano: consulta primero los túneles sin resultado
+    o con el resultado más antiguo. Si la flota no cabe en el tiempo total, cada pasada avanza
+    sobre los que la anterior no llegó a consultar y todos se acaban actualizando
+    """
+    with _last_known_lock:
+        order = sorted(tunnel_names, key=lambda name: _last_known[name][0] if name in _last_known else 0)
+    return collect_tunnels_status(order, total_budget, tunnel_deadline)
@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from utils.rendimiento import timed
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "/opt/gestor-tuneles-cloudflare/data"
+INCIDENTS_DB = os.environ.get('INCIDENTS_DB', os.path.join(DATA_DIR, "incidencias.db"))
+# Días que se conservan las incidencias resueltas
+INCIDENTS_RETENTION_DAYS = float(os.environ.get('INCIDENTS_RETENTION_DAYS', 365))
+
+_SCHEMA_VERSION = 1
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS incidents (
+    id INTEGER PRIMARY KEY,
+    tunnel TEXT NOT NULL,
+    tunnel_id TEXT,
+    description TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    resolved_at REAL,
+    notified INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS incidents_tunnel_started ON incidents (tunnel, started_at);
+CREATE INDEX IF NOT EXISTS incidents_started ON incidents (started_at);
+CREATE INDEX IF NOT EXISTS incidents_resolved ON incidents (resolved_at);
+CREATE UNIQUE INDEX IF NOT EXISTS incidents_open ON incidents (tunnel) WHERE resolved_at IS NULL;
+"""
+
+_COLUMNS = ("id", "tunnel", "tunnel_id", "description", "started_at", "resolved_at", "notified")
+
+
+def _row(values):
+    incident = dict(zip(_COLUMNS, values))
+    incident["notified"] = bool(incident["notified"])
+    return incident
+
+
+class IncidentStore:
+    """
+    Histórico de incidencias de los túneles en SQLite (modo WAL)
+    Una incidencia se abre cuando un túnel pasa a tener un problema y se cierra cuando se
+    recupera; solo esas transiciones escriben en la base de datos. El monitor es el único
+    que escribe; la web abre la base de datos en solo lectura y, gracias al WAL, lee sin
+    bloquear al monitor.
+    """
+
+    def __init__(self, path=None, readonly=False):
+        self.path = path or INCIDENTS_DB
+        self.readonly = readonly
+        self._local = threading.local()
+        if not readonly:
+            self._connection()
+
+    def _connection(self):
+        """Conexión del hilo actual (sqlite3 no comparte conexiones entre hilos); None si no existe la base de datos"""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            return connection
+
+        if self.readonly:
+            if not os.path.exists(self.path):
+                return None
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=5)
+        else:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Con WAL, NORMAL solo puede perder las últimas transacciones ante un corte de luz, nunca corromper
+            connection.execute("PRAGMA synchronous=NORMAL")
+            if connection.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                connection.executescript(_SCHEMA)
+                connection.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
+
+        self._local.connection = connection
+        return connection
+
+    def _query(self, sql, params=()):
+        connection = self._connection()
+        if connection is None:
+            return []
+        try:
+            return connection.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            # Base de datos recién creada por el monitor y aún sin tablas
+            if "no such table" in str(e):
+                return []
+            raise
+
+    # Escritura (monitor)
+
+    def open_incident(self, tunnel, tunnel_id, description, started_at=None, notified=False):
+        """Abrir una incidencia; retorna False si el túnel ya tenía una abierta"""
+        cursor = self._connection().execute(
+            "INSERT OR IGNORE INTO incidents (tunnel, tunnel_id, description, started_at, notified) VALUES (?, ?, ?, ?, ?)",
+            (tunnel, tunnel_id, description, started_at or time.time(), int(notified))
+        )
+        return cursor.rowcount == 1
+
+    def resolve_incident(self, tunnel, resolved_at=None):
+        """Cerrar la incidencia abierta de un túnel; retorna la incidencia cerrada o None"""
+        connection = self._connection()
+        row = connection.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM incidents WHERE tunnel = ? AND resolved_at IS NULL",
+            (tunnel,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        # Sin UPDATE ... RETURNING (SQLite 3.35) para funcionar con el SQLite de versiones antiguas de Ubuntu
+        incident = _row(row)
+        incident["resolved_at"] = resolved_at or time.time()
+        connection.execute(
+            "UPDATE incidents SET resolved_at = ? WHERE id = ?",
+            (incident["resolved_at"], incident["id"])
+        )
+        return incident
+
+    def prune(self, retention_days=None):
+        """Eliminar las incidencias resueltas más antiguas que la retención; retorna cuántas"""
+        days = INCIDENTS_RETENTION_DAYS if retention_days is None else retention_days
+        cursor = self._connection().execute(
+            "DELETE FROM incidents WHERE resolved_at IS NOT NULL AND resolved_at < ?",
+            (time.time() - days * 86400,)
+        )
+        return cursor.rowcount
+
+    def migrate_known_issues(self, path):
+        """
+        Importar el antiguo archivo JSON de problemas conocidos del monitor
+        El archivo se renombra a <archivo>.migrado para no importarlo dos veces
+        """
+        if not os.path.exists(path):
+            return 0
+
+        try:
+            with open(path, 'r') as f:
+                issues = json.load(f)
+        except Exception as e:
+            logger.error(f"Error al leer los problemas conocidos de {path}: {str(e)}")
+            return 0
+
+        connection = self._connection()
+        imported = 0
+        connection.execute("BEGIN")
+        try:
+            for tunnel, issue in issues.items():
+                if issue.get("resolved"):
+                    connection.execute(
+                        "INSERT INTO incidents (tunnel, description, started_at, resolved_at, notified) VALUES (?, ?, ?, ?, 1)",
+                        (tunnel, issue.get("description", ""), issue["first_detected"],
+                         issue.get("resolved_at", issue["first_detected"]))
+                    )
+                else:
+                    connection.execute(
+                        "INSERT OR IGNORE INTO incidents (tunnel, description, started_at, notified) VALUES (?, ?, ?, 1)",
+                        (tunnel, issue.get("description", ""), issue["first_detected"])
+                    )
+                imported += 1
+            connection.execute("COMMIT")
+        except Exception as e:
+            connection.execute("ROLLBACK")
+            logger.error(f"Error al importar los problemas conocidos de {path}: {str(e)}")
+            return 0
+
+        os.replace(path, path + ".migrado")
+        logger.info(f"Importados {imported} problemas conocidos de {path}")
+        return imported
+
+    # Lectura (monitor y web)
+
+    def open_incidents(self):
+        """Incidencias abiertas por túnel"""
+        rows = self._query(f"SELECT {', '.join(_COLUMNS)} FROM incidents WHERE resolved_at IS NULL")
+        return {row[1]: _row(row) for row in rows}
+
+    def last_resolved(self, since):
+        """Momento de la última recuperación de cada túnel recuperado después de `since`"""
+        rows = self._query(
+            "SELECT tunnel, MAX(resolved_at) FROM incidents WHERE resolved_at >= ? GROUP BY tunnel",
+            (since,)
+        )
+        return dict(rows)
+
+    @timed("io")
+    def list_incidents(self, tunnel=None, since=None, until=None, limit=100):
+        """Incidencias (las más recientes primero) que se solapan con la ventana [since, until]"""
+        conditions = []
+        params = []
+        if tunnel:
+            conditions.append("tunnel = ?")
+            params.append(tunnel)
+        if until is not None:
+            conditions.append("started_at < ?")
+            params.append(until)
+        if since is not None:
+            conditions.append("(resolved_at IS NULL OR resolved_at > ?)")
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._query(
+            f"SELECT {', '.join(_COLUMNS)} FROM incidents {where} ORDER BY started_at DESC LIMIT ?",
+            params + [int(limit)]
+        )
+        return [_row(row) for row in rows]
+
+    @timed("io")
+    def summary(self, since, until=None, tunnels=None, tunnel=None):
+        """
+        Incidencias, tiempo caído, MTTR y disponibilidad por túnel en la ventana [since, until]
+        Solo cuenta el tiempo de cada incidencia que cae dentro de la ventana; una incidencia
+        abierta cuenta hasta `until`. Los túneles de `tunnels` sin incidencias aparecen con
+        disponibilidad 1.0; con `tunnel` solo se resume ese túnel
+        """
+        until = time.time() if until is None else until
+        window = until - since
+        if window <= 0:
+            raise ValueError("La ventana debe terminar después de empezar")
+
+        rows = self._query(
+            """
+            SELECT tunnel,
+                   COUNT(*),
+                   SUM(MIN(COALESCE(resolved_at, :until), :until) - MAX(started_at, :since)),
+                   AVG(CASE WHEN resolved_at IS NOT NULL AND resolved_at <= :until THEN resolved_at - started_at END),
+                   SUM(resolved_at IS NULL)
+            FROM incidents
+            WHERE started_at < :until AND (resolved_at IS NULL OR resolved_at > :since)
+              AND (:tunnel IS NULL OR tunnel = :tunnel)
+            GROUP BY tunnel
+            """,
+            {"since": since, "until": until, "tunnel": tunnel}
+        )
+
+        result = {}
+        for name in ([tunnel] if tunnel else tunnels or ()):
+            result[name] = {"incidents": 0, "open": 0, "downtime": 0.0, "mttr": None, "availability": 1.0}
+        for tunnel, count, downtime, mttr, open_count in rows:
+            downtime = max(0.0, downtime or 0.0)
+            result[tunnel] = {
+                "incidents": count,
+                "open": open_count,
+                "downtime": downtime,
+                "mttr": mttr,
+                "availability": max(0.0, 1 - downtime / window)
+            }
+        return result
+
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def get_incident_reader():
+    """Almacén en solo lectura para la web (uno por proceso)"""
+    global _reader
+    with _reader_lock:
+        if _reader is None:
+            _reader = IncidentStore(readonly=True)
+        return _reader
@@ -0,0 +1,237 @@
+import os
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from utils.sockets_escucha import get_listener_index
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Tiempo máximo (segundos) para leer /metrics de un conector
+METRICS_TIMEOUT = float(os.environ.get('CLOUDFLARED_METRICS_TIMEOUT', 2))
+
+# Direcciones fijas por túnel, p. ej. "web=127.0.0.1:20241,api=127.0.0.1:20242"
+# (útil para conectores en otra máquina o para sustituirlos por un servidor de pruebas)
+METRICS_ADDRESS_OVERRIDES = dict(
+    item.split("=", 1)
+    for item in os.environ.get('CLOUDFLARED_METRICS_ADDRESSES', '').split(",")
+    if "=" in item
+)
+
+# Series de cloudflared que se procesan; el resto se descarta al leerlas
+COUNTERS = {
+    "cloudflared_tunnel_total_requests": "requests",
+    "cloudflared_tunnel_request_errors": "errors",
+    "quic_client_sent_bytes": "sent_bytes",
+    "quic_client_receive_bytes": "received_bytes"
+}
+GAUGES = {
+    "cloudflared_tunnel_concurrent_requests_per_tunnel": "concurrent_requests",
+    "cloudflared_tunnel_ha_connections": "ha_connections"
+}
+RTT_GAUGES = {
+    "quic_client_smoothed_rtt": "rtt_ms",
+    "quic_client_min_rtt": "min_rtt_ms",
+    "quic_client_latest_rtt": "latest_rtt_ms"
+}
+RESPONSE_BY_CODE = "cloudflared_tunnel_response_by_code"
+WANTED = set(COUNTERS) | set(GAUGES) | set(RTT_GAUGES) | {RESPONSE_BY_CODE}
+
+
+def _parse_labels(text):
+    """Interpretar el bloque de etiquetas {a="1",b="2"} de una muestra Prometheus"""
+    labels = {}
+    i = 0
+    length = len(text)
+    while i < length:
+        equals = text.find("=", i)
+        if equals < 0:
+            break
+        key = text[i:equals].strip().lstrip(",").strip()
+        i = equals + 2  # saltar ="
+        value = []
+        while i < length and text[i] != '"':
+            if text[i] == "\\" and i + 1 < length:
+                i += 1
+                value.append("\n" if text[i] == "n" else text[i])
+            else:
+                value.append(text[i])
+            i += 1
+        labels[key] = "".join(value)
+        i += 1  # saltar la comilla de cierre
+    return labels
+
+
+def parse_prometheus_lines(lines, wanted=None):
+    """
+    Analizar en streaming el formato de texto de Prometheus
+    Genera tuplas (nombre, etiquetas, valor) sin cargar la respuesta completa
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "replace")
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        brace = line.find("{")
+        space = line.find(" ")
+        if brace >= 0 and (space < 0 or brace < space):
+            name = line[:brace]
+            if wanted is not None and name not in wanted:
+                continue
+            closing = line.rfind("}")
+            labels = _parse_labels(line[brace + 1:closing])
+            rest = line[closing + 1:].split()
+        else:
+            name = line[:space]
+            if wanted is not None and name not in wanted:
+                continue
+            labels = {}
+            rest = line[space + 1:].split()
+
+        if not rest:
+            continue
+        try:
+            yield name, labels, float(rest[0])
+        except ValueError:
+            continue
+
+
+def get_metrics_address(process):
+    """
+    Obtener la dirección del endpoint /metrics de un conector:
+    --metrics de la línea de órdenes o, si no existe, sus sockets en escucha
+    """
+    if process is None:
+        return None
+
+    override = METRICS_ADDRESS_OVERRIDES.get(process.get("tunnel"))
+    if override:
+        return [override]
+
+    argv = process["argv"]
+    for i, arg in enumerate(argv):
+        address = None
+        if arg.startswith("--metrics="):
+            address = arg.split("=", 1)[1]
+        elif arg == "--metrics" and i + 1 < len(argv):
+            address = argv[i + 1]
+        # Con puerto 0 cloudflared elige uno libre: hay que buscarlo en sus sockets
+        if address and not address.endswith(":0"):
+            return [address]
+
+    return get_listener_index().tcp_addresses(process["pid"])
+
+
+class MetricsClient:
+    """
+    Cliente de /metrics de cloudflared con conexiones HTTP reutilizadas
+    Convierte los contadores en tasas comparando con la lectura anterior
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = METRICS_TIMEOUT if timeout is None else timeout
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+        self._lock = threading.Lock()
+        self._previous = {}
+        self._working_address = {}
+
+    def scrape(self, address):
+        """Leer /metrics de una dirección host:puerto y agregar las series conocidas"""
+        url = address if address.startswith("http") else f"http://{address}/metrics"
+        sample = {
+            "counters": {},
+            "gauges": {},
+            "rtt": {},
+            "responses_by_code": {}
+        }
+        with self._session.get(url, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for name, labels, value in parse_prometheus_lines(response.iter_lines(), WANTED):
+                if name in COUNTERS:
+                    key = COUNTERS[name]
+                    sample["counters"][key] = sample["counters"].get(key, 0.0) + value
+                elif name in GAUGES:
+                    key = GAUGES[name]
+                    sample["gauges"][key] = sample["gauges"].get(key, 0.0) + value
+                elif name in RTT_GAUGES:
+                    # Una serie por conexión con el edge: se promedia
+                    sample["rtt"].setdefault(RTT_GAUGES[name], []).append(value)
+                elif name == RESPONSE_BY_CODE:
+                    code = labels.get("status_code", "desconocido")
+                    sample["responses_by_code"][code] = sample["responses_by_code"].get(code, 0.0) + value
+        sample["timestamp"] = time.monotonic()
+        return sample
+
+    def _rates(self, tunnel_name, sample):
+        """Tasas por segundo de los contadores respecto a la lectura anterior del túnel"""
+        with self._lock:
+            previous = self._previous.get(tunnel_name)
+            self._previous[tunnel_name] = sample
+
+        rates = {}
+        codes = {}
+        # Un conector reiniciado (otro PID) empieza sus contadores de cero
+        if previous and previous["pid"] == sample["pid"]:
+            elapsed = sample["timestamp"] - previous["timestamp"]
+            if elapsed > 0:
+                for name, value in sample["counters"].items():
+                    delta = value - previous["counters"].get(name, 0.0)
+                    # Un contador menor que el anterior indica que el conector se reinició
+                    rates[name] = max(0.0, delta) / elapsed
+                for code, value in sample["responses_by_code"].items():
+                    delta = value - previous["responses_by_code"].get(code, 0.0)
+                    codes[code] = round(max(0.0, delta) / elapsed, 3)
+        return rates, codes
+
+    def collect(self, tunnel_name, process):
+        """
+        Obtener métricas de un túnel a partir de su proceso
+        Retorna None si el conector no expone /metrics
+        """
+        addresses = get_metrics_address(process)
+        if not addresses:
+            return None
+
+        # Probar primero la última dirección que respondió para este túnel
+        known = self._working_address.get(tunnel_name)
+        if known in addresses:
+            addresses = [known] + [a for a in addresses if a != known]
+
+        sample = None
+        for address in addresses:
+            try:
+                sample = self.scrape(address)
+                self._working_address[tunnel_name] = address
+                break
+            except Exception as e:
+                logger.debug(f"No se pudo leer /metrics en {address} para el túnel {tunnel_name}: {str(e)}")
+        if sample is None:
+            return None
+
+        sample["pid"] = process.get("pid")
+        rates, codes = self._rates(tunnel_name, sample)
+        rtt = {name: round(sum(values) / len(values), 2) for name, values in sample["rtt"].items() if values}
+
+        return {
+            "ha_connections": int(sample["gauges"].get("ha_connections", 0)),
+            "concurrent_requests": int(sample["gauges"].get("concurrent_requests", 0)),
+            "total_requests": int(sample["counters"].get("requests", 0)),
+            "request_errors": int(sample["counters"].get("errors", 0)),
+            "requests_per_second": round(rates.get("requests", 0.0), 3),
+            "errors_per_second": round(rates.get("errors", 0.0), 3),
+            "upload": rates.get("sent_bytes", 0.0),
+            "download": rates.get("received_bytes", 0.0),
+            "responses_by_code": codes,
+            "rtt_ms": rtt.get("rtt_ms"),
+            "min_rtt_ms": rtt.get("min_rtt_ms"),
+            "latest_rtt_ms": rtt.get("latest_rtt_ms")
+        }
+
+
+# Cliente compartido por todo el proceso (mantiene las conexiones abiertas)
+metrics_client = MetricsClient()
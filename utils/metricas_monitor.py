@@ -0,0 +1,291 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Dirección y puerto del endpoint /metrics del monitor (puerto 0 para desactivarlo)
+MONITOR_METRICS_ADDRESS = os.environ.get('MONITOR_METRICS_ADDRESS', '127.0.0.1')
+MONITOR_METRICS_PORT = int(os.environ.get('MONITOR_METRICS_PORT', 9469))
+# Archivo para el textfile collector de node-exporter (vacío para desactivarlo)
+MONITOR_METRICS_TEXTFILE = os.environ.get('MONITOR_METRICS_TEXTFILE', '')
+# Cada cuántos segundos se reescribe el archivo de métricas
+MONITOR_METRICS_INTERVAL = float(os.environ.get('MONITOR_METRICS_INTERVAL', 15))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Límites de los histogramas (segundos)
+CHECK_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SEND_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        # Cerrojo del registro (se asigna al añadir la métrica)
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), callback=None):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        lines = self._header()
+        values = self._values
+        if self.callback is not None:
+            # La función retorna un valor o un diccionario {etiquetas: valor}
+            try:
+                result = self.callback()
+                values = result if isinstance(result, dict) else {(): result}
+            except Exception as e:
+                logger.warning(f"Error al calcular la métrica {self.name}: {str(e)}")
+                return lines
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # Recuento por cubeta (sin acumular), suma y total
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def render(self):
+        lines = self._header()
+        for labels, (buckets, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), buckets):
+                cumulative += bucket_count
+                bucket_labels = _labels(self.labels + ("le",), labels + (_number(bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class MonitorMetrics:
+    """
+    Métricas del propio monitor en formato de texto de Prometheus
+    El planificador y el envío de alertas las actualizan desde hilos distintos; todas las
+    métricas comparten un cerrojo con la lectura del endpoint HTTP y del archivo para node-exporter
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._server = None
+        self._writer = None
+        self._stop = threading.Event()
+
+        self.checks = self._add(Histogram(
+            "cloudflare_monitor_check_duration_seconds",
+            "Duración de las comprobaciones de túneles por resultado",
+            CHECK_BUCKETS, ("resultado",)
+        ))
+        self.lag = self._add(Histogram(
+            "cloudflare_monitor_scheduler_lag_seconds",
+            "Retraso del inicio de cada comprobación respecto a su calendario",
+            LAG_BUCKETS
+        ))
+        self.operations = self._add(Histogram(
+            "cloudflare_monitor_operation_duration_seconds",
+            "Duración de las operaciones periódicas del planificador (inventario y revisión local)",
+            CHECK_BUCKETS, ("tipo",)
+        ))
+        self.failures = self._add(Counter(
+            "cloudflare_monitor_failures_total",
+            "Operaciones fallidas por tipo (comprobacion, revision_local, inventario, correo)",
+            ("tipo",)
+        ))
+        self.transitions = self._add(Counter(
+            "cloudflare_monitor_transitions_total",
+            "Caídas y recuperaciones confirmadas por la histéresis",
+            ("estado",)
+        ))
+        self.alert_send = self._add(Histogram(
+            "cloudflare_monitor_alert_send_duration_seconds",
+            "Duración de cada intento de envío de un correo de alerta",
+            SEND_BUCKETS, ("resultado",)
+        ))
+        self.alert_delay = self._add(Histogram(
+            "cloudflare_monitor_alert_delay_seconds",
+            "Tiempo desde que se genera una alerta hasta que se envía (incluye la ventana de agrupación)",
+            LAG_BUCKETS
+        ))
+        self.alerts = self._add(Counter(
+            "cloudflare_monitor_alerts_total",
+            "Alertas por destino (enviada, descartada)",
+            ("resultado",)
+        ))
+        self.tunnels = self._add(Gauge(
+            "cloudflare_monitor_tunnels",
+            "Túneles en el calendario por estado (total, caidos, pendientes, en_curso)",
+            ("estado",)
+        ))
+        self.queue_depth = self._add(Gauge(
+            "cloudflare_monitor_queue_depth",
+            "Comprobaciones que ya deberían haber empezado y esperan una plaza"
+        ))
+        self.alerts_pending = self._add(Gauge(
+            "cloudflare_monitor_alerts_pending",
+            "Alertas en cola pendientes de envío"
+        ))
+        self.last_check = self._add(Gauge(
+            "cloudflare_monitor_last_check_timestamp_seconds",
+            "Momento de la última comprobación terminada"
+        ))
+        self._add(Gauge(
+            "cloudflare_monitor_start_time_seconds",
+            "Momento de arranque del monitor"
+        )).set(time.time())
+
+    def _add(self, metric):
+        metric._lock = self._lock
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Todas las métricas en formato de texto de Prometheus"""
+        lines = []
+        with self._lock:
+            for metric in self._metrics:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    # Exposición
+
+    def serve(self, port=None, address=None):
+        """Servir /metrics en un hilo; retorna False si no se pudo abrir el puerto"""
+        port = MONITOR_METRICS_PORT if port is None else port
+        address = address or MONITOR_METRICS_ADDRESS
+        if not port or self._server is not None:
+            return False
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((address, port), Handler)
+        except OSError as e:
+            logger.warning(f"No se pudo abrir el endpoint de métricas en {address}:{port}: {str(e)}")
+            return False
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metricas-monitor", daemon=True).start()
+        logger.info(f"Métricas del monitor en http://{address}:{port}/metrics")
+        return True
+
+    def write_textfile(self, path):
+        """Escribir las métricas para el textfile collector de node-exporter (reemplazo atómico)"""
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "w") as f:
+                f.write(self.render())
+            os.replace(temporary, path)
+        except Exception as e:
+            logger.error(f"Error al escribir las métricas en {path}: {str(e)}")
+
+    def start_textfile(self, path=None, interval=None):
+        """Reescribir el archivo de métricas periódicamente en un hilo"""
+        path = path if path is not None else MONITOR_METRICS_TEXTFILE
+        interval = interval or MONITOR_METRICS_INTERVAL
+        if not path or self._writer is not None:
+            return False
+
+        def loop():
+            while not self._stop.wait(interval):
+                self.write_textfile(path)
+
+        self._writer = threading.Thread(target=loop, name="metricas-archivo", daemon=True)
+        self._writer.start()
+        return True
+
+    def stop(self, textfile=None):
+        """Detener la exposición; escribe una última vez el archivo si se indica"""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if textfile:
+            self.write_textfile(textfile)
+
+
+# Instancia única del proceso del monitor
+monitor_metrics = MonitorMetrics()
@@ -1,10 +1,15 @@
-import subprocess
 import json
 import re
 import logging
 import time
 import requests
 from datetime import datetime
+from utils.procesos import find_tunnel_process
+from utils.metricas_cloudflared import metrics_client
+from utils.sock_diag import socket_stats
+from utils.ejecucion import run_command
+from utils.cloudflare import TUNNEL_INFO_TIMEOUT
+from utils.backend_tuneles import get_backend
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -14,107 +19,59 @@ def get_tunnel_metrics(tunnel_name):
     Obtener métricas del túnel
     Retorna un diccionario con las métricas o None si hay error
     """
+    return get_backend().get_metrics(tunnel_name)
+
+def get_connector_metrics(tunnel_name):
+    """Métricas del conector local: /proc, sockets del kernel y su endpoint /metrics"""
     metrics = {
         "connections": 0,
         "upload": 0,
         "download": 0,
         "upload_formatted": "0 B/s",
         "download_formatted": "0 B/s",
+        "metrics_available": False,
+        "socket_metrics_available": False,
         "timestamp": datetime.now().strftime("%H:%M:%S")
     }
     
     try:
-        # Intentar obtener métricas desde cloudflared metrics
-        # Esta funcionalidad puede variar según la versión de cloudflared
-        result = subprocess.run(
-            ["pgrep", "-f", f"cloudflared.*{tunnel_name}"],
-            capture_output=True,
-            text=True
-        )
+        # Localizar el proceso del túnel en el índice de /proc
+        process = find_tunnel_process(tunnel_name)
         
-        if result.returncode != 0:
+        if process is None:
             logger.info(f"No se encontró proceso para el túnel {tunnel_name}")
             return metrics
-            
-        pid = result.stdout.strip()
-        
-        # Verificar el uso de CPU y memoria del proceso
-        ps_result = subprocess.run(
-            ["ps", "-p", pid, "-o", "%cpu,%mem"],
-            capture_output=True,
-            text=True
-        )
-        
-        if ps_result.returncode == 0:
-            lines = ps_result.stdout.strip().split('\n')
-            if len(lines) > 1:
-                values = lines[1].strip().split()
-                if len(values) >= 2:
-                    metrics["cpu_usage"] = float(values[0].replace(',', '.'))
-                    metrics["memory_usage"] = float(values[1].replace(',', '.'))
         
-        # Intentar obtener estadísticas de red
-        # Esto es aproximado y puede no ser preciso para el túnel específico
-        nethogs_available = subprocess.run(
-            ["which", "nethogs"],
-            capture_output=True,
-            text=True
-        ).returncode == 0
+        # Uso de CPU (entre recorridos del índice) y memoria del proceso
+        metrics["cpu_usage"] = process["cpu_percent"]
+        metrics["memory_usage"] = process["memory_percent"]
         
-        if nethogs_available:
-            try:
-                # Ejecutar nethogs por un breve período
-                nethogs_result = subprocess.run(
-                    ["sudo", "nethogs", "-t", "-c", "2"],
-                    capture_output=True,
-                    text=True,
-                    timeout=5  # Limitar a 5 segundos
-                )
-                
-                if nethogs_result.returncode == 0:
-                    # Buscar líneas que contengan cloudflared
-                    for line in nethogs_result.stdout.strip().split('\n'):
-                        if 'cloudflared' in line:
-                            parts = line.split()
-                            if len(parts) >= 3:
-                                try:
-                                    # Ejemplo de formato: "PID PROGRAM SENT RECEIVED"
-                                    metrics["upload"] = parse_network_value(parts[-2])
-                                    metrics["download"] = parse_network_value(parts[-1])
-                                    metrics["upload_formatted"] = format_bytes_per_second(metrics["upload"])
-                                    metrics["download_formatted"] = format_bytes_per_second(metrics["download"])
-                                    break
-                                except Exception as e:
-                                    logger.error(f"Error al procesar línea de nethogs: {str(e)}")
-            except subprocess.TimeoutExpired:
-                logger.warning("Timeout al ejecutar nethogs")
-            except Exception as e:
-                logger.error(f"Error al ejecutar nethogs: {str(e)}")
+        # Conexiones con el edge, RTT y retransmisiones leídas del kernel (sock_diag)
+        link_metrics = socket_stats.collect(tunnel_name, process)
+        if link_metrics is not None:
+            metrics.update(link_metrics)
+            metrics["socket_metrics_available"] = True
         
-        # Intentar obtener número de conexiones
-        ss_result = subprocess.run(
-            ["ss", "-tn", "state", "established", "sport", ":https"],
-            capture_output=True,
-            text=True
-        )
+        # Métricas Prometheus expuestas por el propio conector en /metrics
+        connector_metrics = metrics_client.collect(tunnel_name, process)
+        if connector_metrics is None:
+            # Sin endpoint de métricas no se inventan valores: se informa de que no hay datos
+            logger.info(f"El túnel {tunnel_name} no expone métricas (--metrics)")
+            if link_metrics is not None:
+                # El tráfico TCP con el edge es lo más aproximado (QUIC no tiene contadores en el kernel)
+                metrics["connections"] = link_metrics["edge_connections"]
+                metrics["upload"] = link_metrics["edge_upload"]
+                metrics["download"] = link_metrics["edge_download"]
+                metrics["upload_formatted"] = format_bytes_per_second(metrics["upload"])
+                metrics["download_formatted"] = format_bytes_per_second(metrics["download"])
+            return metrics
         
-        if ss_result.returncode == 0:
-            connections = len(ss_result.stdout.strip().split('\n')) - 1  # Restar la línea de cabecera
-            metrics["connections"] = max(0, connections)  # Asegurar que no sea negativo
+        metrics.update(connector_metrics)
+        metrics["metrics_available"] = True
+        metrics["connections"] = connector_metrics["ha_connections"]
+        metrics["upload_formatted"] = format_bytes_per_second(metrics["upload"])
+        metrics["download_formatted"] = format_bytes_per_second(metrics["download"])
         
-        # Generar valores aleatorios si no se pudieron obtener métricas reales
-        # (esto es para demo y debe eliminarse en producción)
-        if metrics["connections"] == 0:
-            metrics["connections"] = 2  # Valor de ejemplo
-            
-        if metrics["upload"] == 0:
-            metrics["upload"] = 1024 * 10  # 10 KB/s como ejemplo
-            metrics["upload_formatted"] = format_bytes_per_second(metrics["upload"])
-            
-        if metrics["download"] == 0:
-            metrics["download"] = 1024 * 20  # 20 KB/s como ejemplo
-            metrics["download_formatted"] = format_bytes_per_second(metrics["download"])
-            
         return metrics
     except Exception as e:
         logger.error(f"Error al obtener métricas del túnel {tunnel_name}: {str(e)}")
@@ -127,20 +84,15 @@ def check_tunnel_connectivity(tunnel_name):
     """
     try:
         # Verificar si el túnel está en ejecución
-        process_result = subprocess.run(
-            ["pgrep", "-f", f"cloudflared.*{tunnel_name}"],
-            capture_output=True,
-            text=True
-        )
-        
-        if process_result.returncode != 0:
+        if find_tunnel_process(tunnel_name) is None:
             return False
         
         # Intentar obtener información del túnel
-        info_result = subprocess.run(
+        info_result = run_command(
             ["cloudflared", "tunnel", "info", tunnel_name],
             capture_output=True,
-            text=True
+            text=True,
+            timeout=TUNNEL_INFO_TIMEOUT
         )
         
         if info_result.returncode != 0:
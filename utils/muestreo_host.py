@@ -0,0 +1,146 @@
+import os
+import copy
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+import psutil
+from utils.procesos import get_process_index
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Cada cuántos segundos se muestrea el host
+HOST_SAMPLE_INTERVAL = float(os.environ.get('HOST_SAMPLE_INTERVAL', 5))
+# Muestras que se promedian (por defecto, el último minuto)
+HOST_SAMPLE_WINDOW = int(os.environ.get('HOST_SAMPLE_WINDOW', 12))
+
+
+def _cpu_busy_percent(previous, current):
+    """
+    Porcentaje de CPU ocupada entre dos lecturas de psutil.cpu_times()
+    Sin lectura anterior se calcula la media desde el arranque del sistema
+    """
+    idle = current.idle + getattr(current, "iowait", 0)
+    total = sum(current)
+    if previous is not None:
+        idle -= previous.idle + getattr(previous, "iowait", 0)
+        total -= sum(previous)
+    if total <= 0:
+        return 0.0
+    return round(max(0.0, 100.0 * (1 - idle / total)), 1)
+
+
+def _average(values):
+    values = [value for value in values if value is not None]
+    return round(sum(values) / len(values), 1) if values else None
+
+
+class HostSampler:
+    """
+    Muestrea CPU, memoria, disco y procesos cloudflared en su propio hilo
+    La ruta /system-stats solo copia la última muestra, sin esperas
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._history = deque(maxlen=HOST_SAMPLE_WINDOW)
+        self._latest = None
+        # Lecturas propias de cpu_times: psutil.cpu_percent() comparte estado entre llamadas
+        self._cpu_times = None
+
+    def start(self):
+        """Arrancar el hilo de muestreo (una vez por proceso)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="muestreo-host", daemon=True)
+                self._thread.start()
+
+    def _sample(self):
+        cpu_times = psutil.cpu_times()
+        cpu_percent = _cpu_busy_percent(self._cpu_times, cpu_times)
+        self._cpu_times = cpu_times
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+
+        processes = [
+            {
+                'pid': process['pid'],
+                'tunnel': process['tunnel'],
+                'cpu_percent': process['cpu_percent'],
+                'memory_percent': process['memory_percent'],
+                'rss_mb': round(process['rss_bytes'] / (1024**2), 1),
+                'uptime': process['uptime'],
+                'cmdline': ' '.join(process['argv'])
+            }
+            for process in get_process_index().processes
+        ]
+
+        sample = {
+            'timestamp': time.time(),
+            'cpu_percent': cpu_percent,
+            'memory_percent': memory.percent,
+            'cloudflared_cpu_percent': round(sum(p['cpu_percent'] for p in processes), 1),
+            'cloudflared_memory_percent': round(sum(p['memory_percent'] for p in processes), 1)
+        }
+
+        with self._lock:
+            self._history.append(sample)
+            history = list(self._history)
+
+        latest = {
+            'system': {
+                'cpu_percent': cpu_percent,
+                'memory': {
+                    'total_gb': round(memory.total / (1024**3), 2),
+                    'used_gb': round(memory.used / (1024**3), 2),
+                    'percent': memory.percent
+                },
+                'disk': {
+                    'total_gb': round(disk.total / (1024**3), 2),
+                    'used_gb': round(disk.used / (1024**3), 2),
+                    'percent': disk.percent
+                },
+                'load_average': [round(load, 2) for load in os.getloadavg()]
+            },
+            'averages': {
+                'window_seconds': round(history[-1]['timestamp'] - history[0]['timestamp'], 1),
+                'samples': len(history),
+                'cpu_percent': _average(s['cpu_percent'] for s in history),
+                'memory_percent': _average(s['memory_percent'] for s in history),
+                'cloudflared_cpu_percent': _average(s['cloudflared_cpu_percent'] for s in history),
+                'cloudflared_memory_percent': _average(s['cloudflared_memory_percent'] for s in history)
+            },
+            'cloudflared_processes': processes,
+            'sampled_at': datetime.fromtimestamp(sample['timestamp']).isoformat()
+        }
+
+        with self._lock:
+            self._latest = (sample['timestamp'], latest)
+
+    def _run(self):
+        while True:
+            time.sleep(HOST_SAMPLE_INTERVAL)
+            try:
+                self._sample()
+            except Exception as e:
+                logger.error(f"Error en el muestreo del host: {str(e)}")
+
+    def get_stats(self):
+        """
+        Copia de la última muestra con sus medias
+        La primera llamada de cada proceso muestrea en el momento (sin esperar un intervalo de CPU)
+        """
+        if self._latest is None:
+            self._sample()
+            self.start()
+        with self._lock:
+            sampled_at, latest = self._latest
+            stats = copy.deepcopy(latest)
+        stats['sample_age'] = round(time.time() - sampled_at, 1)
+        return stats
+
+
+host_sampler = HostSampler()
@@ -0,0 +1,241 @@
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Intervalo (segundos) entre muestras de pila: 10 ms ≈ 100 muestras por segundo
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.01))
+# Duración máxima de un perfilado a demanda
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
+# Duración del perfilado que se lanza con SIGUSR1 en el demonio
+PROFILE_SIGNAL_SECONDS = float(os.environ.get('PROFILE_SIGNAL_SECONDS', 30))
+# Marcos de pila que tracemalloc guarda por asignación
+TRACEMALLOC_FRAMES = int(os.environ.get('TRACEMALLOC_FRAMES', 10))
+
+# Un único perfilado a la vez por proceso: dos muestreadores se medirían entre sí
+_profile_lock = threading.Lock()
+_memory_lock = threading.Lock()
+_memory_baseline = None
+
+# Asignaciones del propio intérprete que no interesan en un diff
+_MEMORY_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>")
+)
+
+
+class ProfilerBusy(Exception):
+    """Ya hay un perfilado en curso en este proceso"""
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame, thread_name):
+    """Pila de un hilo en formato plegado: raíz primero, marcos separados por ';'"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    labels.reverse()
+    return ";".join(labels)
+
+
+def sample_stacks(duration, interval=PROFILE_SAMPLE_INTERVAL, idle=False):
+    """
+    Muestrear las pilas de todos los hilos durante `duration` segundos
+    Se ejecuta en el hilo que llama (que se excluye de las muestras) y no necesita
+    reiniciar el proceso ni instalar nada. Con idle=False se descartan las muestras
+    de hilos bloqueados en esperas (sleep, select, locks), que suelen ser mayoría
+    Retorna (Counter de pilas plegadas, número de muestras)
+    """
+    duration = min(max(float(duration), interval), PROFILE_MAX_SECONDS)
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("Ya hay un perfilado en curso en este proceso")
+
+    try:
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if not idle and _is_idle(frame):
+                    continue
+                stacks[_collapse(frame, names.get(ident, f"hilo-{ident}"))] += 1
+            samples += 1
+            time.sleep(interval)
+        return stacks, samples
+    finally:
+        _profile_lock.release()
+
+
+# Funciones en las que un hilo está esperando, no trabajando
+_IDLE_FUNCTIONS = {
+    "wait", "sleep", "select", "poll", "accept", "_wait_for_tstate_lock",
+    "readinto", "recv", "recv_into", "get", "serve_forever", "acquire"
+}
+
+
+def _is_idle(frame):
+    """El marco más profundo en Python es una espera (el tiempo real está en C)"""
+    return frame.f_code.co_name in _IDLE_FUNCTIONS
+
+
+def format_collapsed(stacks):
+    """Texto listo para flamegraph.pl, speedscope o inferno: '<pila> <muestras>' por línea"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def profile(duration, interval=PROFILE_SAMPLE_INTERVAL, idle=False):
+    """Perfilar y devolver directamente el texto plegado"""
+    stacks, samples = sample_stacks(duration, interval, idle)
+    logger.info(f"Perfilado completado: {samples} muestras, {len(stacks)} pilas distintas")
+    return format_collapsed(stacks)
+
+
+def memory_start(frames=TRACEMALLOC_FRAMES):
+    """Activar tracemalloc (si no lo estaba) y fijar la instantánea de referencia"""
+    global _memory_baseline
+    with _memory_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        _memory_baseline = tracemalloc.take_snapshot().filter_traces(_MEMORY_FILTERS)
+    return memory_status()
+
+
+def memory_stop():
+    """Desactivar tracemalloc y liberar la memoria que usa para el seguimiento"""
+    global _memory_baseline
+    with _memory_lock:
+        _memory_baseline = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+    return memory_status()
+
+
+def memory_status():
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    return {
+        "tracing": tracemalloc.is_tracing(),
+        "has_baseline": _memory_baseline is not None,
+        "traced_kb": round(current / 1024, 1),
+        "peak_kb": round(peak / 1024, 1),
+        "overhead_kb": round(tracemalloc.get_tracemalloc_memory() / 1024, 1)
+    }
+
+
+def memory_diff(limit=25, group_by="lineno", reset=False):
+    """
+    Crecimiento de memoria desde la instantánea de referencia, agrupado por línea
+    (o por 'traceback' para ver la pila completa de cada asignación)
+    Con reset=True la instantánea actual pasa a ser la nueva referencia
+    Lanza RuntimeError si tracemalloc no está activo
+    """
+    global _memory_baseline
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise ValueError(f"Agrupación no válida: {group_by}")
+
+    with _memory_lock:
+        if not tracemalloc.is_tracing() or _memory_baseline is None:
+            raise RuntimeError("El seguimiento de memoria no está activo")
+        snapshot = tracemalloc.take_snapshot().filter_traces(_MEMORY_FILTERS)
+        baseline = _memory_baseline
+        if reset:
+            _memory_baseline = snapshot
+
+    differences = snapshot.compare_to(baseline, group_by)
+    top = []
+    for stat in differences[:limit]:
+        frames = stat.traceback if group_by == "traceback" else stat.traceback[:1]
+        top.append({
+            "location": [f"{frame.filename}:{frame.lineno}" for frame in frames],
+            "size_diff_kb": round(stat.size_diff / 1024, 1),
+            "size_kb": round(stat.size / 1024, 1),
+            "count_diff": stat.count_diff,
+            "count": stat.count
+        })
+
+    return dict(
+        memory_status(),
+        total_diff_kb=round(sum(stat.size_diff for stat in differences) / 1024, 1),
+        top=top
+    )
+
+
+def format_memory_diff(diff):
+    """Versión en texto del diff para los archivos que escribe el demonio"""
+    lines = [
+        f"Memoria seguida: {diff['traced_kb']} KiB (pico {diff['peak_kb']} KiB), "
+        f"variación total {diff['total_diff_kb']:+} KiB"
+    ]
+    for entry in diff["top"]:
+        lines.append(
+            f"{entry['size_diff_kb']:+10.1f} KiB {entry['count_diff']:+8d} bloques  "
+            + " <- ".join(entry["location"])
+        )
+    return "\n".join(lines) + "\n"
+
+
+def install_signal_handlers(output_dir):
+    """
+    Perfilado a demanda en procesos sin interfaz web (p. ej. monitor.py --daemon):
+    - SIGUSR1: muestrea las pilas durante PROFILE_SIGNAL_SECONDS en segundo plano
+    - SIGUSR2: la primera vez activa tracemalloc; las siguientes escriben el diff
+      respecto a la señal anterior
+    Los resultados se escriben en output_dir con la fecha en el nombre
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    def _output_path(kind, extension):
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        return os.path.join(output_dir, f"{kind}-{os.getpid()}-{stamp}.{extension}")
+
+    def _write_profile():
+        try:
+            text = profile(PROFILE_SIGNAL_SECONDS)
+            path = _output_path("pilas", "txt")
+            with open(path, "w") as f:
+                f.write(text)
+            logger.info(f"Perfil de pilas guardado en {path}")
+        except ProfilerBusy:
+            logger.warning("Se ignoró SIGUSR1: ya hay un perfilado en curso")
+        except Exception as e:
+            logger.error(f"Error al perfilar el proceso: {str(e)}")
+
+    def _on_profile(signum, frame):
+        # El manejador solo lanza el hilo: muestrear aquí bloquearía el hilo principal
+        threading.Thread(target=_write_profile, name="perfilado", daemon=True).start()
+
+    def _on_memory(signum, frame):
+        try:
+            if _memory_baseline is None:
+                memory_start()
+                logger.info("Seguimiento de memoria activado; envíe SIGUSR2 de nuevo para obtener el diff")
+                return
+            path = _output_path("memoria", "txt")
+            with open(path, "w") as f:
+                f.write(format_memory_diff(memory_diff(reset=True)))
+            logger.info(f"Diff de memoria guardado en {path}")
+        except Exception as e:
+            logger.error(f"Error al comparar la memoria: {str(e)}")
+
+    signal.signal(signal.SIGUSR1, _on_profile)
+    signal.signal(signal.SIGUSR2, _on_memory)
+    logger.info(f"Perfilado por señales activo (SIGUSR1 pilas, SIGUSR2 memoria) en {output_dir}")
@@ -0,0 +1,431 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from utils.backend_tuneles import get_backend
+from utils.metricas_monitor import monitor_metrics
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Número máximo de comprobaciones de túneles en curso a la vez
+MONITOR_CONCURRENCY = int(os.environ.get('MONITOR_CONCURRENCY', 32))
+# Tiempo máximo (segundos) de la comprobación de un túnel antes de darla por fallida
+MONITOR_CHECK_TIMEOUT = float(os.environ.get('MONITOR_CHECK_TIMEOUT', 10))
+# Variación aleatoria del intervalo de cada túnel (fracción del intervalo, 0.1 = ±10 %)
+MONITOR_JITTER = float(os.environ.get('MONITOR_JITTER', 0.1))
+# Cada cuántos segundos se vuelve a leer el inventario de túneles (altas y bajas)
+MONITOR_INVENTORY_INTERVAL = float(os.environ.get('MONITOR_INVENTORY_INTERVAL', 60))
+# Cada cuántos segundos se registra un resumen del planificador en el log
+MONITOR_REPORT_INTERVAL = float(os.environ.get('MONITOR_REPORT_INTERVAL', 300))
+
+# Intervalo máximo (segundos) al que se alarga la comprobación de un túnel que sigue sano
+MONITOR_MAX_INTERVAL = float(os.environ.get('MONITOR_MAX_INTERVAL', 900))
+# Factor por el que se alarga el intervalo tras cada comprobación sana
+MONITOR_BACKOFF = float(os.environ.get('MONITOR_BACKOFF', 1.5))
+# Intervalo (segundos) del carril rápido: sospechas pendientes de confirmar y resultados dudosos
+MONITOR_FAST_INTERVAL = float(os.environ.get('MONITOR_FAST_INTERVAL', 15))
+# Intervalo (segundos) de los túneles con una caída confirmada (para detectar pronto la recuperación)
+MONITOR_FAILED_INTERVAL = float(os.environ.get('MONITOR_FAILED_INTERVAL', 60))
+# Resultados consecutivos necesarios para confirmar una caída y una recuperación
+MONITOR_FAIL_THRESHOLD = int(os.environ.get('MONITOR_FAIL_THRESHOLD', 2))
+MONITOR_RECOVER_THRESHOLD = int(os.environ.get('MONITOR_RECOVER_THRESHOLD', 2))
+# Fracción del plazo a partir de la que una comprobación lenta se considera dudosa
+MONITOR_SLOW_FRACTION = float(os.environ.get('MONITOR_SLOW_FRACTION', 0.5))
+# Cada cuántos segundos se revisa el estado local de toda la flota (una llamada a systemctl y un recorrido de /proc)
+MONITOR_SWEEP_INTERVAL = float(os.environ.get('MONITOR_SWEEP_INTERVAL', 15))
+
+# Retrasos recientes que se conservan para calcular percentiles
+_LATENESS_SAMPLES = 2000
+
+# Resultado de una comprobación
+OK = "ok"
+BORDERLINE = "dudoso"
+FAILED = "caido"
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class MonitorScheduler:
+    """
+    Planificador asíncrono y adaptativo de comprobaciones de túneles
+    Cada túnel tiene su propio calendario. Las primeras comprobaciones se reparten a lo
+    largo del primer intervalo y, mientras el túnel sigue sano, su intervalo se alarga
+    (×`backoff`) hasta `max_interval`. Un fallo o un resultado dudoso (comprobación lenta o
+    sin información del conector) lo pasa al carril rápido, y hacen falta
+    MONITOR_FAIL_THRESHOLD resultados seguidos para confirmar una caída (y
+    MONITOR_RECOVER_THRESHOLD para la recuperación). El manejador solo recibe los resultados
+    que coinciden con el estado confirmado, así que un fallo aislado no abre incidencia.
+    Cada MONITOR_SWEEP_INTERVAL se revisa además el estado local de toda la flota, que es
+    barato, y los túneles cuyo estado ha cambiado se comprueban en el momento.
+
+    Como mucho `concurrency` comprobaciones están en curso a la vez y cada una tiene un
+    plazo de `timeout` segundos. `handler(tunnel_name, tunnel_id, status)` es una corrutina
+    que recibe el resultado con el formato de monitor.check_tunnel_status; `on_inventory()`
+    (opcional) se llama en un hilo tras cada lectura del inventario.
+    """
+
+    def __init__(self, interval, handler, concurrency=None, timeout=None, jitter=None,
+                 backend=None, on_inventory=None, max_interval=None, fast_interval=None):
+        self.interval = float(interval)
+        self.handler = handler
+        self.concurrency = max(1, int(concurrency or MONITOR_CONCURRENCY))
+        self.timeout = float(timeout or MONITOR_CHECK_TIMEOUT)
+        self.jitter = min(max(MONITOR_JITTER if jitter is None else float(jitter), 0.0), 0.5)
+        self.max_interval = max(self.interval, float(max_interval or MONITOR_MAX_INTERVAL))
+        self.fast_interval = min(self.interval, float(fast_interval or MONITOR_FAST_INTERVAL))
+        self.failed_interval = min(max(MONITOR_FAILED_INTERVAL, self.fast_interval), self.interval)
+        self.backend = backend or get_backend()
+        self.on_inventory = on_inventory
+
+        self._tunnels = {}
+        self._state = {}
+        self._queue = []
+        self._sequence = 0
+        self._in_flight = set()
+        self._random = random.Random()
+        self._stats = {
+            "checks": 0, "timeouts": 0, "errors": 0, "borderline": 0, "suppressed": 0,
+            "failures_confirmed": 0, "recoveries_confirmed": 0, "sweeps": 0, "sweep_promotions": 0
+        }
+        self._lateness = deque(maxlen=_LATENESS_SAMPLES)
+        self._durations = deque(maxlen=_LATENESS_SAMPLES)
+
+    # Inventario
+
+    async def _load_inventory(self):
+        """Leer el inventario; retorna la lista de túneles o None si falla"""
+        start = time.monotonic()
+        try:
+            return list(await asyncio.to_thread(self.backend.list_tunnels))
+        except Exception as e:
+            monitor_metrics.failures.inc("inventario")
+            logger.error(f"Error al obtener túneles: {str(e)}")
+            return None
+        finally:
+            monitor_metrics.operations.observe(time.monotonic() - start, "inventario")
+
+    def _apply_inventory(self, tunnels, now, spread=True):
+        """Añadir los túneles nuevos al calendario y olvidar los eliminados; retorna los añadidos"""
+        current = {}
+        for tunnel in tunnels:
+            if tunnel.get("name"):
+                current[tunnel["name"]] = tunnel.get("id")
+
+        added = [name for name in current if name not in self._tunnels]
+        removed = [name for name in self._tunnels if name not in current]
+        for name in removed:
+            # Su entrada en la cola se descarta cuando llegue su turno
+            del self._tunnels[name]
+            self._state.pop(name, None)
+
+        for name in added:
+            self._tunnels[name] = current[name]
+            # Estado confirmado (None hasta el primer resultado), resultados seguidos en contra e intervalo actual
+            self._state[name] = {
+                "confirmed": None, "streak": 0, "interval": self.interval, "borderline": 0,
+                "entry": None, "due": None
+            }
+            offset = self._random.uniform(0, self.interval) if spread else 0
+            self._schedule(name, now + offset)
+
+        for name, tunnel_id in current.items():
+            self._tunnels[name] = tunnel_id
+
+        if added or removed:
+            logger.info(f"Inventario del monitor: {len(current)} túneles (+{len(added)} -{len(removed)})")
+        return added
+
+    def _schedule(self, name, due):
+        """Programar la siguiente comprobación de un túnel (sustituye a la que tuviera)"""
+        self._sequence += 1
+        state = self._state[name]
+        state["entry"] = self._sequence
+        state["due"] = due
+        heapq.heappush(self._queue, (due, self._sequence, name))
+
+    def _jittered(self, delay):
+        return delay * (1 + self._random.uniform(-self.jitter, self.jitter))
+
+    # Comprobaciones
+
+    def classify(self, status, duration):
+        """Resultado de una comprobación: caído, dudoso (lento o sin información del conector) o sano"""
+        if status.get("error") or not status.get("service_active") or not status.get("process_running"):
+            return FAILED
+        if duration > self.timeout * MONITOR_SLOW_FRACTION or not status.get("metrics"):
+            return BORDERLINE
+        return OK
+
+    def _observe(self, name, status, duration):
+        """
+        Aplicar la histéresis y calcular el siguiente intervalo del túnel
+        Retorna (pasar_al_manejador, segundos_hasta_la_siguiente_comprobación)
+        """
+        state = self._state[name]
+        outcome = self.classify(status, duration)
+        failed = outcome == FAILED
+        if outcome == BORDERLINE:
+            self._stats["borderline"] += 1
+
+        if state["confirmed"] is None and not failed:
+            # Primer resultado sano: no hace falta confirmarlo
+            state["confirmed"] = OK
+            state["streak"] = 0
+        elif failed != (state["confirmed"] == FAILED):
+            # Resultado contrario al estado confirmado
+            state["streak"] += 1
+            threshold = MONITOR_FAIL_THRESHOLD if failed else MONITOR_RECOVER_THRESHOLD
+            if state["streak"] >= threshold:
+                state["confirmed"] = FAILED if failed else OK
+                state["streak"] = 0
+                state["interval"] = self.interval
+                self._stats["failures_confirmed" if failed else "recoveries_confirmed"] += 1
+                monitor_metrics.transitions.inc("caido" if failed else "recuperado")
+        else:
+            state["streak"] = 0
+
+        if state["streak"]:
+            # Cambio pendiente de confirmar: carril rápido
+            self._stats["suppressed"] += 1
+            return False, self.fast_interval
+        if state["confirmed"] == FAILED:
+            return True, self.failed_interval
+        if outcome == BORDERLINE:
+            # Dudas repetidas (p. ej. sin información del conector de forma persistente): salir poco a poco del carril rápido
+            delay = state["borderline"] = min(state["borderline"] * 2, self.interval) if state["borderline"] else self.fast_interval
+            state["interval"] = self.interval
+            return True, delay
+
+        state["borderline"] = 0
+        delay = state["interval"]
+        state["interval"] = min(state["interval"] * MONITOR_BACKOFF, self.max_interval)
+        return True, delay
+
+    async def _check(self, name):
+        """Resultado de la comprobación de un túnel, con plazo máximo; retorna (estado, fallo o None)"""
+        timestamp = datetime.now().isoformat()
+        try:
+            check = await asyncio.wait_for(self.backend.check_async(name), self.timeout)
+            return {
+                "tunnel_name": name,
+                "service_active": check["service_active"],
+                "process_running": check["process_running"],
+                "metrics": check["info"],
+                "timestamp": timestamp
+            }, None
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            logger.warning(f"La comprobación del túnel {name} superó {self.timeout:g} s")
+            return {"tunnel_name": name, "error": f"la comprobación superó {self.timeout:g} s", "timestamp": timestamp}, "fuera_de_plazo"
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Error al verificar el estado del túnel {name}: {str(e)}")
+            return {"tunnel_name": name, "error": str(e), "timestamp": timestamp}, "error"
+
+    async def _run_check(self, name, semaphore, adaptive=True):
+        """Comprobar un túnel, programar la siguiente comprobación y pasar el resultado al manejador"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            status, failure = await self._check(name)
+            duration = loop.time() - start
+            self._stats["checks"] += 1
+            self._durations.append(duration)
+            if failure:
+                monitor_metrics.failures.inc("comprobacion")
+            monitor_metrics.checks.observe(duration, failure or self.classify(status, duration))
+            monitor_metrics.last_check.set(time.time())
+
+            report = True
+            if adaptive and name in self._state:
+                report, delay = self._observe(name, status, duration)
+                self._schedule(name, loop.time() + self._jittered(delay))
+
+            if report and name in self._tunnels:
+                await self.handler(name, self._tunnels[name], status)
+        except Exception as e:
+            logger.error(f"Error al procesar el resultado del túnel {name}: {str(e)}")
+        finally:
+            self._in_flight.discard(name)
+            semaphore.release()
+
+    async def _sweep(self):
+        """
+        Adelantar la comprobación de los túneles cuyo estado local no coincide con el confirmado
+        Los que aún no tienen estado confirmado se tratan como sanos: si ya parecen caídos al
+        arrancar, se comprueban en el momento en lugar de esperar a su primer turno repartido
+        """
+        names = list(self._tunnels)
+        start = time.monotonic()
+        try:
+            states = await asyncio.to_thread(self.backend.quick_states, names)
+        except Exception as e:
+            monitor_metrics.failures.inc("revision_local")
+            logger.warning(f"Error al revisar el estado local de los túneles: {str(e)}")
+            return
+        if states is None:
+            return
+        monitor_metrics.operations.observe(time.monotonic() - start, "revision_local")
+
+        self._stats["sweeps"] += 1
+        now = asyncio.get_running_loop().time()
+        for name, (service_active, process_running) in states.items():
+            state = self._state.get(name)
+            if state is None or name in self._in_flight:
+                continue
+            looks_failed = not (service_active and process_running)
+            if looks_failed != (state["confirmed"] == FAILED) and state["due"] > now + self.fast_interval:
+                self._stats["sweep_promotions"] += 1
+                self._schedule(name, now)
+
+    # Bucles
+
+    async def run(self, stop_event=None):
+        """Comprobar los túneles indefinidamente (hasta que se active stop_event)"""
+        loop = asyncio.get_running_loop()
+        stop_event = stop_event or asyncio.Event()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+
+        monitor_metrics.tunnels.callback = self._tunnel_gauges
+        monitor_metrics.queue_depth.callback = self._queue_depth
+
+        next_inventory = loop.time()
+        next_sweep = loop.time() + MONITOR_SWEEP_INTERVAL
+        next_report = loop.time() + MONITOR_REPORT_INTERVAL
+        logger.info(
+            f"Planificador del monitor: intervalo {self.interval:g} s (hasta {self.max_interval:g} s si el túnel "
+            f"sigue sano, {self.fast_interval:g} s en el carril rápido) ±{self.jitter:.0%}, "
+            f"{self.concurrency} comprobaciones simultáneas, plazo {self.timeout:g} s"
+        )
+
+        while not stop_event.is_set():
+            now = loop.time()
+
+            if now >= next_inventory:
+                tunnels = await self._load_inventory()
+                if tunnels is not None:
+                    if self._apply_inventory(tunnels, loop.time()):
+                        # Revisar en seguida el estado local de los túneles nuevos (las primeras comprobaciones se reparten)
+                        next_sweep = loop.time()
+                    if self.on_inventory:
+                        await asyncio.to_thread(self.on_inventory)
+                next_inventory = loop.time() + MONITOR_INVENTORY_INTERVAL
+
+            if now >= next_sweep:
+                await self._sweep()
+                next_sweep = loop.time() + MONITOR_SWEEP_INTERVAL
+
+            if now >= next_report:
+                self._report()
+                next_report = now + MONITOR_REPORT_INTERVAL
+
+            while self._queue and self._queue[0][0] <= loop.time() and not stop_event.is_set():
+                due, entry, name = heapq.heappop(self._queue)
+                state = self._state.get(name)
+                if state is None or state["entry"] != entry or name in self._in_flight:
+                    # Túnel eliminado, comprobación reprogramada o en curso (se reprograma al terminar)
+                    continue
+
+                # Con todas las plazas ocupadas la cola espera aquí y el retraso queda registrado
+                await semaphore.acquire()
+                lateness = max(0.0, loop.time() - due)
+                self._lateness.append(lateness)
+                monitor_metrics.lag.observe(lateness)
+                self._in_flight.add(name)
+                task = asyncio.create_task(self._run_check(name, semaphore))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            wake = min(next_inventory, next_sweep, next_report)
+            if self._queue:
+                wake = min(wake, self._queue[0][0])
+            try:
+                await asyncio.wait_for(stop_event.wait(), max(0.0, wake - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+
+        if tasks:
+            logger.info(f"Esperando a {len(tasks)} comprobaciones en curso")
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._report()
+
+    async def run_once(self):
+        """Comprobar cada túnel una vez (concurrentemente, sin histéresis); retorna el número de túneles"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tunnels = await self._load_inventory()
+        if not tunnels:
+            return 0
+
+        self._apply_inventory(tunnels, 0, spread=False)
+        # Estado local actualizado una vez por pasada (una única llamada a systemctl con el backend real)
+        await asyncio.to_thread(self.backend.refresh)
+
+        tasks = []
+        for name in self._tunnels:
+            await semaphore.acquire()
+            self._in_flight.add(name)
+            tasks.append(asyncio.create_task(self._run_check(name, semaphore, adaptive=False)))
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._queue.clear()
+        return len(self._tunnels)
+
+    # Estadísticas
+
+    def _tunnel_gauges(self):
+        """Túneles por estado para las métricas (se llama desde el hilo del endpoint)"""
+        states = list(self._state.values())
+        return {
+            ("total",): len(states),
+            ("caidos",): sum(1 for state in states if state["confirmed"] == FAILED),
+            ("pendientes",): sum(1 for state in states if state["streak"]),
+            ("en_curso",): len(self._in_flight)
+        }
+
+    def _queue_depth(self):
+        """Comprobaciones vencidas que aún no han empezado (el reloj del bucle es time.monotonic)"""
+        now = time.monotonic()
+        depth = 0
+        for due, entry, name in list(self._queue):
+            state = self._state.get(name)
+            if due <= now and state is not None and state["entry"] == entry and name not in self._in_flight:
+                depth += 1
+        return depth
+
+    def stats(self):
+        """Resumen del planificador (contadores, carriles, retraso sobre el calendario y duración de las comprobaciones)"""
+        lateness = list(self._lateness)
+        durations = list(self._durations)
+        states = list(self._state.values())
+        return dict(self._stats, **{
+            "tunnels": len(self._tunnels),
+            "in_flight": len(self._in_flight),
+            "failed": sum(1 for state in states if state["confirmed"] == FAILED),
+            "fast_lane": sum(1 for state in states if state["streak"]),
+            "lateness_p95": _percentile(lateness, 0.95),
+            "lateness_max": max(lateness) if lateness else 0.0,
+            "duration_p50": _percentile(durations, 0.5),
+            "duration_p95": _percentile(durations, 0.95)
+        })
+
+    def _report(self):
+        stats = self.stats()
+        logger.info(
+            f"Planificador: {stats['tunnels']} túneles ({stats['failed']} caídos, {stats['fast_lane']} pendientes "
+            f"de confirmar), {stats['checks']} comprobaciones ({stats['timeouts']} fuera de plazo, "
+            f"{stats['errors']} errores, {stats['borderline']} dudosas), {stats['failures_confirmed']} caídas y "
+            f"{stats['recoveries_confirmed']} recuperaciones confirmadas, {stats['sweep_promotions']} adelantadas "
+            f"por la revisión local, {stats['in_flight']} en curso, retraso p95 {stats['lateness_p95']:.2f} s "
+            f"(máx. {stats['lateness_max']:.2f} s), duración p50 {stats['duration_p50']:.2f} s "
+            f"p95 {stats['duration_p95']:.2f} s"
+        )
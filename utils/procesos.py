@@ -0,0 +1,228 @@
+import os
+import time
+import logging
+import threading
+from utils.rendimiento import count_cache
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+PROC_DIR = "/proc"
+
+# Segundos durante los que se reutiliza el último recorrido de /proc
+PROCESS_INDEX_TTL = float(os.environ.get('PROCESS_INDEX_TTL', 1))
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+TOTAL_MEMORY = os.sysconf('SC_PHYS_PAGES') * PAGE_SIZE
+
+# Opciones de cloudflared que consumen el argumento siguiente; el resto son booleanas
+_VALUE_FLAGS = {
+    "config", "credentials-file", "credentials-contents", "token", "token-file",
+    "origincert", "url", "unix-socket", "metrics", "pidfile", "logfile",
+    "log-directory", "loglevel", "transport-loglevel", "protocol",
+    "edge-ip-version", "edge-bind-address", "region", "tag", "grace-period",
+    "retries", "ha-connections", "label", "name", "hostname", "lb-pool",
+    "service-op-ip", "features", "edge", "cacert", "autoupdate-freq",
+    "heartbeat-interval", "heartbeat-count", "max-edge-addr-retries",
+    "rpc-timeout", "write-stream-timeout", "origin-server-name",
+    "origin-ca-pool", "http-host-header", "connect-timeout", "tls-timeout",
+    "tcp-keepalive", "keepalive-timeout", "keepalive-connections",
+    "proxy-address", "proxy-port", "compression-quality", "max-fetch-size",
+    "dns-resolver-addrs", "icmpv4-src", "icmpv6-src", "management-hostname",
+    "trace-output", "quick-service"
+}
+
+_lock = threading.Lock()
+_index = None
+_previous_cpu = {}
+_boot_time = None
+
+
+def parse_tunnel_name(argv):
+    """
+    Extraer el nombre del túnel de la línea de órdenes de `cloudflared tunnel run <nombre>`
+    Retorna None si el proceso no es un conector con nombre
+    """
+    if not argv or os.path.basename(argv[0]) != "cloudflared":
+        return None
+
+    positionals = []
+    skip_next = False
+    for arg in argv[1:]:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg.startswith("-"):
+            flag = arg.lstrip("-")
+            if "=" not in flag and flag in _VALUE_FLAGS:
+                skip_next = True
+            continue
+        positionals.append(arg)
+
+    if len(positionals) >= 3 and positionals[0] == "tunnel" and positionals[1] == "run":
+        return positionals[2]
+    return None
+
+
+def format_elapsed(seconds):
+    """Formatear segundos como `ps -o etime` ([[dd-]hh:]mm:ss)"""
+    seconds = max(0, int(seconds))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return f"{days}-{hours:02d}:{minutes:02d}:{seconds:02d}"
+    if hours:
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def _read_boot_time():
+    global _boot_time
+    if _boot_time is None:
+        with open(os.path.join(PROC_DIR, "stat"), "r") as f:
+            for line in f:
+                if line.startswith("btime "):
+                    _boot_time = int(line.split()[1])
+                    break
+    return _boot_time
+
+
+def _read_process(pid):
+    """Leer cmdline, stat y statm de un proceso cloudflared (None si no lo es)"""
+    base = os.path.join(PROC_DIR, pid)
+    with open(os.path.join(base, "cmdline"), "rb") as f:
+        raw = f.read()
+    if b"cloudflared" not in raw:
+        return None
+
+    argv = [arg.decode("utf-8", "replace") for arg in raw.split(b"\0") if arg]
+    if not argv or os.path.basename(argv[0]) != "cloudflared":
+        return None
+
+    with open(os.path.join(base, "stat"), "r") as f:
+        stat = f.read()
+    # El nombre del ejecutable puede contener espacios: los campos empiezan tras el último ')'
+    fields = stat[stat.rfind(")") + 2:].split()
+    cpu_ticks = int(fields[11]) + int(fields[12])
+    start_ticks = int(fields[19])
+
+    with open(os.path.join(base, "statm"), "r") as f:
+        rss_pages = int(f.read().split()[1])
+
+    return {
+        "pid": int(pid),
+        "tunnel": parse_tunnel_name(argv),
+        "argv": argv,
+        "start_ticks": start_ticks,
+        "cpu_ticks": cpu_ticks,
+        "rss_bytes": rss_pages * PAGE_SIZE
+    }
+
+
+class ProcessIndex:
+    """Instantánea de los procesos cloudflared obtenida en un único recorrido de /proc"""
+
+    def __init__(self, processes, scanned_at):
+        self.processes = processes
+        self.scanned_at = scanned_at
+        self.by_tunnel = {}
+        for process in processes:
+            if process["tunnel"]:
+                self.by_tunnel.setdefault(process["tunnel"], []).append(process)
+
+    def find(self, tunnel_name):
+        """Proceso principal (PID más bajo) de un túnel o None"""
+        processes = self.by_tunnel.get(tunnel_name)
+        return processes[0] if processes else None
+
+    def pids(self, tunnel_name):
+        """Todos los PID asociados a un túnel"""
+        return [process["pid"] for process in self.by_tunnel.get(tunnel_name, [])]
+
+
+def scan_processes():
+    """
+    Recorrer /proc una vez y construir el índice túnel → procesos
+    El uso de CPU se calcula a partir de la diferencia con el recorrido anterior
+    """
+    global _previous_cpu
+
+    processes = []
+    now = time.time()
+    monotonic_now = time.monotonic()
+
+    try:
+        boot_time = _read_boot_time()
+        entries = os.listdir(PROC_DIR)
+    except Exception as e:
+        logger.error(f"Error al leer {PROC_DIR}: {str(e)}")
+        return ProcessIndex([], now)
+
+    current_cpu = {}
+    for pid in entries:
+        if not pid.isdigit():
+            continue
+        try:
+            process = _read_process(pid)
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            # El proceso terminó durante el recorrido o no es accesible
+            continue
+        except Exception as e:
+            logger.debug(f"Error al leer el proceso {pid}: {str(e)}")
+            continue
+        if process is None:
+            continue
+
+        start_time = boot_time + process["start_ticks"] / CLK_TCK
+        process["start_time"] = start_time
+        process["uptime_seconds"] = max(0.0, now - start_time)
+        process["uptime"] = format_elapsed(process["uptime_seconds"])
+        process["memory_percent"] = round(process["rss_bytes"] * 100.0 / TOTAL_MEMORY, 1) if TOTAL_MEMORY else 0.0
+
+        # La clave incluye el instante de arranque para no mezclar PID reutilizados
+        key = (process["pid"], process["start_ticks"])
+        previous = _previous_cpu.get(key)
+        if previous:
+            elapsed = monotonic_now - previous[1]
+            ticks = process["cpu_ticks"] - previous[0]
+        else:
+            # Primer recorrido: media desde el arranque, como `ps -o %cpu`
+            elapsed = process["uptime_seconds"]
+            ticks = process["cpu_ticks"]
+        process["cpu_percent"] = round(ticks * 100.0 / (elapsed * CLK_TCK), 1) if elapsed > 0 else 0.0
+        current_cpu[key] = (process["cpu_ticks"], monotonic_now)
+
+        processes.append(process)
+
+    _previous_cpu = current_cpu
+    processes.sort(key=lambda p: p["pid"])
+    return ProcessIndex(processes, now)
+
+
+def get_process_index(max_age=None):
+    """Obtener el índice de procesos cloudflared, reutilizando el último si es reciente"""
+    global _index
+
+    if max_age is None:
+        max_age = PROCESS_INDEX_TTL
+
+    with _lock:
+        fresh = _index is not None and time.time() - _index.scanned_at < max_age
+        count_cache(fresh)
+        if not fresh:
+            _index = scan_processes()
+        return _index
+
+
+def find_tunnel_process(tunnel_name):
+    """Obtener el proceso de un túnel (coincidencia exacta del nombre) o None"""
+    return get_process_index().find(tunnel_name)
+
+
+def invalidate_process_index():
+    """Forzar un nuevo recorrido de /proc tras iniciar o detener túneles"""
+    global _index
+    with _lock:
+        _index = None
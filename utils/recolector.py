@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from types import MappingProxyType
+from datetime import datetime
+from utils.cloudflare import (
+    check_cloudflared_installed,
+    get_cloudflared_version,
+    get_tunnels_list
+)
+from utils.sistema import get_system_info
+from utils.capacidades import capabilities
+from utils.rendimiento import count_cache
+from utils.backend_tuneles import get_backend
+from utils.estado_tuneles import refresh_tunnels_status
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Cada cuántos segundos se muestrea el estado local (inventario en caché, systemd y /proc)
+COLLECTOR_INTERVAL = float(os.environ.get('COLLECTOR_INTERVAL', 1))
+# Cada cuántos segundos se consulta conectividad y métricas de los túneles
+COLLECTOR_FULL_INTERVAL = float(os.environ.get('COLLECTOR_FULL_INTERVAL', 15))
+# Cada cuántos segundos se actualiza la información del host y de cloudflared
+COLLECTOR_HOST_INTERVAL = float(os.environ.get('COLLECTOR_HOST_INTERVAL', 60))
+# Segundos que una petición espera la primera instantánea tras arrancar el worker
+COLLECTOR_WARMUP_WAIT = float(os.environ.get('COLLECTOR_WARMUP_WAIT', 10))
+
+DATA_DIR = "/opt/gestor-tuneles-cloudflare/data"
+# Instantánea compartida entre los workers del host: solo el que tiene el cerrojo muestrea
+# los túneles y el resto la lee de este archivo (vacío para que cada worker muestree por su cuenta)
+COLLECTOR_SHARED_PATH = os.environ.get('COLLECTOR_SHARED_PATH', os.path.join(DATA_DIR, "recolector.json"))
+
+
+def freeze(value):
+    """Convertir diccionarios y listas en estructuras de solo lectura"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Copia mutable (serializable con jsonify) de una estructura congelada"""
+    if isinstance(value, MappingProxyType):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+class Snapshot:
+    """Instantánea inmutable y versionada del estado del sistema y de los túneles"""
+
+    __slots__ = (
+        "version", "generated_at", "full_generated_at", "cloudflared_installed",
+        "cloudflared_version", "system_info", "tunnels", "statuses", "metrics"
+    )
+
+    def __init__(self, version, generated_at, full_generated_at, cloudflared_installed,
+                 cloudflared_version, system_info, tunnels, statuses, metrics):
+        values = {
+            "version": version,
+            "generated_at": generated_at,
+            "full_generated_at": full_generated_at,
+            "cloudflared_installed": cloudflared_installed,
+            "cloudflared_version": cloudflared_version,
+            "system_info": freeze(system_info),
+            "tunnels": freeze(tunnels),
+            "statuses": freeze(statuses),
+            "metrics": freeze(metrics)
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Las instantáneas del recolector son inmutables")
+
+    def age(self):
+        """Segundos desde que se generó la instantánea"""
+        return time.time() - self.generated_at
+
+    def tunnel_names(self):
+        return [tunnel["name"] for tunnel in self.tunnels]
+
+    def tunnel_payload(self, tunnel_name):
+        """Estado de un túnel con el formato de las rutas /api/estado-tunel(es)"""
+        status = self.statuses.get(tunnel_name)
+        if status is None:
+            return None
+        running = status["running"]
+        return {
+            "status": thaw(status),
+            "metrics": thaw(self.metrics.get(tunnel_name)) if running else None,
+            "connectivity": status.get("connectivity", False) if running else False
+        }
+
+
+class StatusCollector:
+    """
+    Muestrea inventario, unidades, procesos y conectividad en su propio hilo
+    y publica instantáneas inmutables que las rutas leen sin bloquearse
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._wakeup = threading.Event()
+        self._snapshot = None
+        self._version = 0
+        self._thread = None
+        self._listeners = []
+        self._full = {}
+        self._full_generated_at = None
+        self._host = None
+        self._force_full = True
+        self._shared = bool(COLLECTOR_SHARED_PATH)
+        self._leader = False
+        self._lock_fd = None
+        self._shared_stamp = None
+        self._refresh_stamp = None
+
+    def start(self):
+        """Arrancar el hilo de muestreo (una vez por proceso, tras el fork de gunicorn)"""
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="recolector-estado", daemon=True)
+                self._thread.start()
+
+    def add_listener(self, callback):
+        """Registrar una función que recibe cada nueva instantánea"""
+        with self._condition:
+            self._listeners.append(callback)
+
+    def request_refresh(self):
+        """Adelantar el siguiente muestreo completo (tras iniciar, detener o crear túneles)"""
+        self._force_full = True
+        self._wakeup.set()
+        if self._shared and not self._leader:
+            # Muestrea otro worker del host: se le avisa tocando el archivo de peticiones
+            refresh_path = f"{COLLECTOR_SHARED_PATH}.refresh"
+            try:
+                with open(refresh_path, "a"):
+                    pass
+                os.utime(refresh_path)
+            except OSError as e:
+                logger.warning(f"No se pudo pedir un muestreo al recolector del host: {str(e)}")
+
+    def peek(self):
+        """Última instantánea sin esperar; None si aún no hay ninguna"""
+        if self._snapshot is None:
+            self.start()
+        return self._snapshot
+
+    def get_snapshot(self, wait=None):
+        """
+        Obtener la última instantánea publicada
+        Solo la primera petición de cada worker espera (como mucho COLLECTOR_WARMUP_WAIT segundos)
+        """
+        if wait is None:
+            wait = COLLECTOR_WARMUP_WAIT
+        snapshot = self._snapshot
+        count_cache(snapshot is not None)
+        if snapshot is not None:
+            return snapshot
+
+        self.start()
+        with self._condition:
+            self._condition.wait_for(lambda: self._snapshot is not None, timeout=wait)
+            if self._snapshot is None:
+                logger.warning("El recolector aún no ha publicado ninguna instantánea")
+                return Snapshot(0, time.time(), None, False, None, {}, [], {}, {})
+            return self._snapshot
+
+    def _sample_host(self):
+        installed = check_cloudflared_installed()
+        self._host = {
+            "sampled_at": time.monotonic(),
+            "cloudflared_installed": installed,
+            "cloudflared_version": get_cloudflared_version() if installed else None,
+            "system_info": get_system_info()
+        }
+
+    def _sample(self, full):
+        """Construir una instantánea; retorna True si algún túnel cambió de estado"""
+        if self._host is None or time.monotonic() - self._host["sampled_at"] >= COLLECTOR_HOST_INTERVAL:
+            self._sample_host()
+
+        tunnels = get_tunnels_list() if self._host["cloudflared_installed"] else []
+        tunnel_names = [tunnel["name"] for tunnel in tunnels]
+
+        if full:
+            statuses, metrics = refresh_tunnels_status(tunnel_names)
+            self._full = {name: (statuses[name], metrics[name]) for name in tunnel_names}
+            self._full_generated_at = time.time()
+
+        # Superponer al último muestreo completo el estado local, que se obtiene sin coste
+        backend = get_backend()
+        statuses = {}
+        metrics = {}
+        running_changed = False
+        for tunnel in tunnels:
+            name = tunnel["name"]
+            status, tunnel_metrics = self._full.get(name, ({"connectivity": False}, None))
+            status = dict(status)
+            if tunnel["running"] != status.get("running", False) and not status.get("unknown"):
+                running_changed = True
+            process = backend.find_process(name)
+            status["running"] = tunnel["running"]
+            status["pid"] = process["pid"] if process else None
+            status["uptime"] = process["uptime"] if process else None
+            status["last_updated"] = datetime.now().strftime("%H:%M:%S")
+            if status.get("sampled_at"):
+                # Resultado servido desde el último conocido: antigüedad respecto a esta instantánea
+                status["stale_age"] = round(time.time() - status["sampled_at"], 1)
+            if not tunnel["running"]:
+                status["connectivity"] = False
+            statuses[name] = status
+            metrics[name] = tunnel_metrics if tunnel["running"] else None
+
+        self._version += 1
+        snapshot = Snapshot(
+            self._version,
+            time.time(),
+            self._full_generated_at,
+            self._host["cloudflared_installed"],
+            self._host["cloudflared_version"],
+            self._host["system_info"],
+            tunnels,
+            statuses,
+            metrics
+        )
+        self._publish(snapshot)
+        if self._shared:
+            self._write_shared(snapshot)
+
+        return running_changed
+
+    def _publish(self, snapshot):
+        with self._condition:
+            self._snapshot = snapshot
+            listeners = list(self._listeners)
+            self._condition.notify_all()
+
+        for listener in listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"Error al notificar una instantánea del recolector: {str(e)}")
+
+    # --- Recolector compartido por los workers del host ---
+
+    def _is_leader(self):
+        """Intentar ser el único worker del host que muestrea los túneles"""
+        if self._leader or not self._shared:
+            return True
+        try:
+            if self._lock_fd is None:
+                os.makedirs(os.path.dirname(COLLECTOR_SHARED_PATH), exist_ok=True)
+                self._lock_fd = os.open(f"{COLLECTOR_SHARED_PATH}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        except OSError as e:
+            logger.warning(f"No se puede compartir el recolector, este worker muestreará por su cuenta: {str(e)}")
+            self._shared = False
+            return True
+
+        logger.info(f"El worker {os.getpid()} pasa a ser el recolector de estado del host")
+        self._leader = True
+        self._force_full = True
+        self._refresh_stamp = self._refresh_requested_at()
+        return True
+
+    def _write_shared(self, snapshot):
+        """Publicar la instantánea para los demás workers (reemplazo atómico del archivo)"""
+        data = {name: thaw(getattr(snapshot, name)) for name in Snapshot.__slots__ if name != "version"}
+        tmp_path = f"{COLLECTOR_SHARED_PATH}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, default=str)
+            os.replace(tmp_path, COLLECTOR_SHARED_PATH)
+        except Exception as e:
+            logger.error(f"Error al compartir la instantánea del recolector: {str(e)}")
+
+    def _read_shared(self):
+        """Publicar en este worker la última instantánea del recolector del host, si es nueva"""
+        try:
+            stat = os.stat(COLLECTOR_SHARED_PATH)
+        except FileNotFoundError:
+            return
+        # Cada publicación reemplaza el archivo, así que cambia el inodo aunque no el mtime
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if stamp == self._shared_stamp:
+            return
+        with open(COLLECTOR_SHARED_PATH) as f:
+            data = json.load(f)
+        self._shared_stamp = stamp
+        # La versión es local: debe crecer en cada worker aunque cambie el recolector del host
+        self._version += 1
+        self._publish(Snapshot(self._version, **data))
+
+    def _refresh_requested_at(self):
+        try:
+            return os.stat(f"{COLLECTOR_SHARED_PATH}.refresh").st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _run(self):
+        try:
+            # Localizar binarios y versiones una sola vez; después solo se comprueba si cambian
+            capabilities.warm_up()
+        except Exception as e:
+            logger.error(f"Error al sondear los binarios del sistema: {str(e)}")
+
+        last_full = 0
+        while True:
+            try:
+                if not self._is_leader():
+                    self._read_shared()
+                    self._wakeup.wait(COLLECTOR_INTERVAL)
+                    self._wakeup.clear()
+                    continue
+
+                if self._shared:
+                    refresh_stamp = self._refresh_requested_at()
+                    if refresh_stamp != self._refresh_stamp:
+                        # Otro worker inició o detuvo túneles
+                        self._refresh_stamp = refresh_stamp
+                        self._force_full = True
+
+                full = self._force_full or time.monotonic() - last_full >= COLLECTOR_FULL_INTERVAL
+                self._force_full = False
+                running_changed = self._sample(full)
+                if full:
+                    last_full = time.monotonic()
+                elif running_changed:
+                    # Un túnel que arranca o se detiene necesita conectividad y métricas nuevas
+                    self._force_full = True
+            except Exception as e:
+                logger.error(f"Error en el recolector de estado: {str(e)}")
+
+            self._wakeup.wait(COLLECTOR_INTERVAL)
+            self._wakeup.clear()
+
+
+collector = StatusCollector()
+
+
+def get_snapshot():
+    """Última instantánea del recolector compartido por el proceso"""
+    return collector.get_snapshot()
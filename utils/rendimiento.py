@@ -0,0 +1,193 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from functools import wraps
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Peticiones por ruta que se conservan para calcular percentiles
+PERF_ROUTE_WINDOW = int(os.environ.get('PERF_ROUTE_WINDOW', 1000))
+
+# Categorías del desglose de cada petición (las tres primeras con duración)
+TIMED_CATEGORIES = ("subprocess", "render", "io")
+CATEGORIES = TIMED_CATEGORIES + ("cache",)
+
+_local = threading.local()
+_routes_lock = threading.Lock()
+_routes = {}
+
+
+def _timings():
+    """Desglose de la petición en curso en este hilo (None fuera de una petición)"""
+    return getattr(_local, "timings", None)
+
+
+def add_timing(category, seconds, count=1):
+    """Sumar tiempo a una categoría de la petición en curso (sin efecto fuera de una petición)"""
+    timings = _timings()
+    if timings is None:
+        return
+    entry = timings.setdefault(category, [0.0, 0])
+    entry[0] += seconds
+    entry[1] += count
+
+
+def count_cache(hit):
+    """Registrar un acierto o un fallo de caché en la petición en curso"""
+    timings = _timings()
+    if timings is None:
+        return
+    entry = timings.setdefault("cache", [0.0, 0])
+    entry[1] += 1
+    if not hit:
+        timings["cache_misses"] = timings.get("cache_misses", 0) + 1
+
+
+def timed(category):
+    """Decorador que atribuye la duración de la función a una categoría"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _timings() is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add_timing(category, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return round(ordered[index], 1)
+
+
+def _server_timing(total_ms, timings):
+    """Cabecera Server-Timing con el desglose de la petición"""
+    parts = []
+    for category in CATEGORIES:
+        entry = timings.get(category)
+        if not entry:
+            continue
+        seconds, count = entry
+        if category == "cache":
+            misses = timings.get("cache_misses", 0)
+            parts.append(f'cache;desc="{count - misses} aciertos, {misses} fallos"')
+        else:
+            parts.append(f'{category};dur={seconds * 1000:.1f};desc="{count}"')
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+def _record_route(route, total_ms, timings):
+    with _routes_lock:
+        entry = _routes.get(route)
+        if entry is None:
+            entry = {
+                "count": 0,
+                "errors": 0,
+                "durations": deque(maxlen=PERF_ROUTE_WINDOW),
+                "categories": {category: deque(maxlen=PERF_ROUTE_WINDOW) for category in TIMED_CATEGORIES},
+                "cache_hits": 0,
+                "cache_misses": 0
+            }
+            _routes[route] = entry
+        entry["count"] += 1
+        entry["durations"].append(total_ms)
+        for category in TIMED_CATEGORIES:
+            entry["categories"][category].append(timings.get(category, (0.0, 0))[0] * 1000)
+        cache_lookups = timings.get("cache", (0.0, 0))[1]
+        misses = timings.get("cache_misses", 0)
+        entry["cache_hits"] += cache_lookups - misses
+        entry["cache_misses"] += misses
+    return entry
+
+
+def get_route_stats():
+    """Percentiles por ruta de la ventana reciente y desglose medio por categoría"""
+    with _routes_lock:
+        snapshot = {
+            route: {
+                "count": entry["count"],
+                "errors": entry["errors"],
+                "durations": list(entry["durations"]),
+                "categories": {c: list(v) for c, v in entry["categories"].items()},
+                "cache_hits": entry["cache_hits"],
+                "cache_misses": entry["cache_misses"]
+            }
+            for route, entry in _routes.items()
+        }
+
+    stats = {}
+    for route, entry in snapshot.items():
+        durations = entry["durations"]
+        stats[route] = {
+            "count": entry["count"],
+            "errors": entry["errors"],
+            "window": len(durations),
+            "p50_ms": _percentile(durations, 0.50),
+            "p95_ms": _percentile(durations, 0.95),
+            "p99_ms": _percentile(durations, 0.99),
+            "max_ms": round(max(durations), 1) if durations else None,
+            "avg_ms": {
+                category: round(sum(values) / len(values), 1) if values else None
+                for category, values in dict(entry["categories"], total=durations).items()
+            },
+            "cache_hits": entry["cache_hits"],
+            "cache_misses": entry["cache_misses"]
+        }
+    # Primero las rutas más lentas
+    return dict(sorted(stats.items(), key=lambda item: item[1]["p95_ms"] or 0, reverse=True))
+
+
+def reset_route_stats():
+    with _routes_lock:
+        _routes.clear()
+
+
+def register_timing(app):
+    """Instalar en la aplicación los hooks de medición y la cabecera Server-Timing"""
+    from flask import request, before_render_template, template_rendered
+
+    @app.before_request
+    def _start_timing():
+        _local.timings = {}
+        _local.started = time.perf_counter()
+        _local.render_started = []
+
+    @app.after_request
+    def _finish_timing(response):
+        timings = _timings()
+        if timings is None:
+            return response
+        total_ms = (time.perf_counter() - _local.started) * 1000
+        route = f"{request.method} {request.url_rule.rule if request.url_rule else '(sin ruta)'}"
+        entry = _record_route(route, total_ms, timings)
+        if response.status_code >= 500:
+            with _routes_lock:
+                entry["errors"] += 1
+        response.headers["Server-Timing"] = _server_timing(total_ms, timings)
+        return response
+
+    @app.teardown_request
+    def _clear_timing(exc):
+        _local.timings = None
+
+    def _render_started(sender, template, context, **extra):
+        if _timings() is not None:
+            _local.render_started.append(time.perf_counter())
+
+    def _render_finished(sender, template, context, **extra):
+        if _timings() is not None and _local.render_started:
+            add_timing("render", time.perf_counter() - _local.render_started.pop())
+
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_finished, app, weak=False)
@@ -0,0 +1,105 @@
+import os
+import time
+import logging
+import threading
+import psutil
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Antigüedad máxima (segundos) de la última instantánea del recolector para estar listo
+HEALTH_MAX_SNAPSHOT_AGE = float(os.environ.get('HEALTH_MAX_SNAPSHOT_AGE', 10))
+# Antigüedad máxima (segundos) del último muestreo completo (conectividad y métricas)
+HEALTH_MAX_FULL_AGE = float(os.environ.get('HEALTH_MAX_FULL_AGE', 120))
+# Espacio libre mínimo en disco (GB)
+HEALTH_MIN_FREE_GB = float(os.environ.get('HEALTH_MIN_FREE_GB', 0.1))
+# Cada cuántos segundos se vuelve a consultar el espacio libre
+HEALTH_DISK_INTERVAL = float(os.environ.get('HEALTH_DISK_INTERVAL', 30))
+
+# Momentos de referencia, calculados una sola vez por proceso
+_STARTED = time.monotonic()
+_BOOT_TIME = psutil.boot_time()
+
+_disk_lock = threading.Lock()
+_disk = None
+
+
+def process_uptime():
+    """Segundos desde que arrancó este proceso"""
+    return time.monotonic() - _STARTED
+
+
+def system_uptime():
+    """Segundos desde que arrancó el sistema"""
+    return time.time() - _BOOT_TIME
+
+
+def disk_headroom(path='.'):
+    """
+    Espacio libre en disco, consultado como mucho cada HEALTH_DISK_INTERVAL segundos
+    Retorna un diccionario {free_gb, status, age}
+    """
+    global _disk
+    now = time.monotonic()
+    disk = _disk
+    if disk is None or now - disk["checked_at"] >= HEALTH_DISK_INTERVAL:
+        # Solo un hilo refresca el valor; el resto usa el anterior si lo hay
+        if _disk_lock.acquire(blocking=disk is None):
+            try:
+                usage = os.statvfs(path)
+                free_gb = (usage.f_bavail * usage.f_frsize) / (1024**3)
+                disk = {
+                    "free_gb": round(free_gb, 2),
+                    "status": "ok" if free_gb > HEALTH_MIN_FREE_GB else "low",
+                    "checked_at": now
+                }
+                _disk = disk
+            finally:
+                _disk_lock.release()
+        disk = _disk
+    return {
+        "free_gb": disk["free_gb"],
+        "status": disk["status"],
+        "age": round(now - disk["checked_at"], 1)
+    }
+
+
+def readiness(snapshot):
+    """
+    Estado de los componentes a partir de datos ya calculados
+    Retorna una tupla (componentes, listo)
+    """
+    components = {}
+
+    if snapshot is None:
+        components["collector"] = {"status": "starting"}
+    else:
+        age = snapshot.age()
+        components["collector"] = {
+            "status": "ok" if age <= HEALTH_MAX_SNAPSHOT_AGE else "stale",
+            "age": round(age, 1),
+            "version": snapshot.version
+        }
+        if snapshot.full_generated_at is None:
+            components["tunnels"] = {"status": "starting"}
+        else:
+            full_age = time.time() - snapshot.full_generated_at
+            components["tunnels"] = {
+                "status": "ok" if full_age <= HEALTH_MAX_FULL_AGE else "stale",
+                "age": round(full_age, 1),
+                "count": len(snapshot.tunnels)
+            }
+        # Informativo: sin cloudflared la aplicación sigue sirviendo (p. ej. para instalarlo)
+        components["cloudflared"] = {
+            "status": "ok" if snapshot.cloudflared_installed else "missing",
+            "version": snapshot.cloudflared_version
+        }
+
+    components["disk"] = disk_headroom()
+
+    ready = (
+        components["collector"]["status"] == "ok"
+        and components.get("tunnels", {}).get("status") != "stale"
+        and components["disk"]["status"] == "ok"
+    )
+    return components, ready
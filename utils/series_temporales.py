@@ -0,0 +1,466 @@
+import os
+import json
+import mmap
+import time
+import fcntl
+import heapq
+import struct
+import logging
+import threading
+from utils.recolector import collector, COLLECTOR_FULL_INTERVAL
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+DATA_DIR = "/opt/gestor-tuneles-cloudflare/data"
+TSDB_PATH = os.environ.get('TSDB_PATH', os.path.join(DATA_DIR, "metricas.tsdb"))
+# Número máximo de series (túnel × métrica); fija el tamaño del archivo. Con 0 se usa el del
+# archivo existente o, al crearlo, el que corresponde a la flota (ver default_max_series)
+TSDB_MAX_SERIES = int(os.environ.get('TSDB_MAX_SERIES', 0))
+# Mínimo de series al calcular el tamaño a partir de la flota
+TSDB_MIN_SERIES = int(os.environ.get('TSDB_MIN_SERIES', 1024))
+# Margen de crecimiento de la flota al calcular el tamaño (2 = el doble de los túneles actuales)
+TSDB_HEADROOM = float(os.environ.get('TSDB_HEADROOM', 2))
+# Segundos que un túnel debe faltar del inventario para liberar sus series (y reutilizar su espacio)
+TSDB_RECLAIM_AFTER = float(os.environ.get('TSDB_RECLAIM_AFTER', 3600))
+# Segundos que se espera a que otro proceso termine de crear el archivo
+TSDB_INIT_WAIT = float(os.environ.get('TSDB_INIT_WAIT', 2))
+
+# Las muestras llegan con cada muestreo completo del recolector: un nivel más fino quedaría casi vacío
+FINEST_RESOLUTION = max(1, int(COLLECTOR_FULL_INTERVAL))
+# Resoluciones (segundos por punto, puntos conservados): 1 h a la cadencia del recolector (15 s), 12 h a 1 min, 14 días a 1 h
+LEVELS = ((FINEST_RESOLUTION, 3600 // FINEST_RESOLUTION), (60, 720), (3600, 336))
+
+# Métricas de cada túnel que se guardan en el histórico
+TUNNEL_SERIES = (
+    "connections", "upload", "download", "requests_per_second",
+    "errors_per_second", "rtt_ms", "cpu_usage", "memory_usage",
+    "edge_rtt_ms", "edge_retransmits_per_second"
+)
+
+
+
+def default_max_series(tunnels):
+    """Series para una flota de `tunnels` túneles, con margen de crecimiento"""
+    return max(TSDB_MIN_SERIES, int(tunnels * len(TUNNEL_SERIES) * TSDB_HEADROOM))
+
+
+_MAGIC = b"CFTS0001"
+_HEADER = struct.Struct("<8sII")
+_HEADER_SIZE = 64
+# Por punto: cubeta (uint32), muestras (uint32), mínimo, máximo y suma (float32)
+_FIELDS = (("bucket", "I"), ("count", "I"), ("min", "f"), ("max", "f"), ("sum", "f"))
+_POINT_SIZE = 20
+
+
+class TimeSeriesStore:
+    """
+    Almacén de series temporales en anillos de tamaño fijo sobre un archivo mapeado en memoria.
+    Cada muestra se agrega a la vez en todas las resoluciones (mín/máx/media), por lo que
+    no hay proceso de compactación y el histórico sobrevive a los reinicios tal cual.
+    Con varios workers solo uno escribe (cerrojo sobre el archivo); el resto lee el mismo mapa.
+    max_series fija la geometría (un archivo con otra se sustituye); sin él se adopta la del
+    archivo existente o se crea con create_series.
+    """
+
+    def __init__(self, path=None, max_series=None, levels=LEVELS, create_series=None):
+        self.path = path
+        self.max_series = max_series
+        self.levels = levels
+        self._lock = threading.Lock()
+        self._index = {}
+        self._index_mtime = None
+        self._index_dirty = False
+        # Huecos libres por debajo de _next_slot (series liberadas), para reutilizarlos
+        self._free = []
+        self._next_slot = 0
+        self._full_warned = False
+        self._dropped = set()
+        self._writer_fd = None
+        self._file = None
+
+        create_series = max_series or create_series or TSDB_MIN_SERIES
+        if path:
+            try:
+                self._file, self.max_series = self._open_file(path, create_series)
+                self._mmap = mmap.mmap(self._file, self._size(self.max_series))
+            except OSError as e:
+                logger.warning(f"No se pudo abrir el histórico de métricas {path}, se usará memoria: {str(e)}")
+                self.path = None
+                self._file = None
+                self._writer_fd = None
+        if not self.path:
+            self.max_series = create_series
+            self._mmap = mmap.mmap(-1, self._size(self.max_series))
+
+        # Vistas tipadas sobre cada campo de cada nivel
+        self._views = []
+        offset = _HEADER_SIZE
+        view = memoryview(self._mmap)
+        for _, capacity in levels:
+            fields = {}
+            count = capacity * self.max_series
+            for name, code in _FIELDS:
+                fields[name] = view[offset:offset + count * 4].cast(code)
+                offset += count * 4
+            self._views.append(fields)
+
+    def _size(self, max_series):
+        return _HEADER_SIZE + sum(capacity for _, capacity in self.levels) * _POINT_SIZE * max_series
+
+    def _usable_series(self, fd):
+        """Series del archivo si su cabecera y tamaño son válidos y su geometría sirve; si no, None"""
+        header = os.pread(fd, _HEADER.size, 0)
+        if len(header) != _HEADER.size:
+            return None
+        magic, max_series, levels = _HEADER.unpack(header)
+        if magic != _MAGIC or levels != len(self.levels) or os.fstat(fd).st_size != self._size(max_series):
+            return None
+        if self.max_series and max_series != self.max_series:
+            return None
+        return max_series
+
+    def _open_file(self, path, create_series):
+        """
+        Abrir el archivo; retorna (descriptor, series)
+        Solo se crea con el cerrojo del escritor, de modo que nunca se recorta un archivo que
+        otro proceso tiene mapeado (le provocaría SIGBUS)
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        deadline = time.monotonic() + TSDB_INIT_WAIT
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            max_series = self._usable_series(fd)
+            if max_series is not None:
+                return fd, max_series
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Otro proceso es el escritor: lo está creando o lo usa con otra geometría
+                os.close(fd)
+                if time.monotonic() >= deadline:
+                    raise OSError("otro proceso usa el archivo con otra geometría (TSDB_MAX_SERIES)")
+                time.sleep(0.05)
+                continue
+
+            # Con el cerrojo nadie más lo está creando; pudo terminar otro proceso entre tanto
+            max_series = self._usable_series(fd)
+            if max_series is None:
+                fd, max_series = self._create_file(path, fd, create_series)
+            self._writer_fd = fd
+            return fd, max_series
+
+    def _create_file(self, path, fd, max_series):
+        """Inicializar el archivo (con el cerrojo del escritor sobre fd); retorna (descriptor, series)"""
+        header = _HEADER.pack(_MAGIC, max_series, len(self.levels))
+        self._remove_index()
+        if os.fstat(fd).st_size == 0:
+            # Archivo nuevo: ningún proceso puede tenerlo mapeado
+            os.ftruncate(fd, self._size(max_series))
+            os.pwrite(fd, header, 0)
+            return fd, max_series
+
+        # Otra geometría: sustituirlo en lugar de recortarlo, los lectores conservan el mapa anterior
+        logger.warning(f"El histórico de métricas {path} tiene otra geometría, se crea de nuevo con {max_series} series")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        new_fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        fcntl.flock(new_fd, fcntl.LOCK_EX)
+        os.ftruncate(new_fd, self._size(max_series))
+        os.pwrite(new_fd, header, 0)
+        os.replace(tmp_path, path)
+        os.close(fd)
+        return new_fd, max_series
+
+    # --- Registro de series (archivo JSON junto al histórico) ---
+
+    def _index_path(self):
+        return f"{self.path}.index.json" if self.path else None
+
+    def _remove_index(self):
+        try:
+            os.remove(self._index_path())
+        except (FileNotFoundError, TypeError):
+            pass
+
+    def _reload_index(self):
+        index_path = self._index_path()
+        if not index_path:
+            return
+        try:
+            mtime = os.stat(index_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._index_mtime:
+            return
+        with open(index_path, "r") as f:
+            self._index = json.load(f)
+        self._index_mtime = mtime
+        used = set(self._index.values())
+        self._next_slot = max(used) + 1 if used else 0
+        self._free = [slot for slot in range(self._next_slot) if slot not in used]
+
+    def _save_index(self):
+        index_path = self._index_path()
+        if not index_path:
+            return
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, index_path)
+        self._index_mtime = os.stat(index_path).st_mtime_ns
+
+    def _slot(self, key, create):
+        slot = self._index.get(key)
+        if slot is None:
+            self._reload_index()
+            slot = self._index.get(key)
+        if slot is None and create:
+            if len(self._index) >= self.max_series:
+                self._dropped.add(key)
+                # Un aviso por proceso: con flotas grandes se descartan miles de series en cada muestreo
+                if not self._full_warned:
+                    logger.warning(
+                        f"Histórico de métricas lleno ({self.max_series} series, unos {self.max_series // len(TUNNEL_SERIES)} túneles), "
+                        f"se descartan las nuevas; aumente TSDB_MAX_SERIES (el archivo se crea de nuevo)"
+                    )
+                    self._full_warned = True
+                return None
+            if self._free:
+                slot = heapq.heappop(self._free)
+            else:
+                slot = self._next_slot
+                self._next_slot += 1
+            self._index[key] = slot
+            # Se guarda en save_index: reescribir el JSON por cada alta es cuadrático con flotas grandes
+            self._index_dirty = True
+        return slot
+
+    # --- Escritura ---
+
+    def is_writer(self):
+        """Intentar ser el único proceso que escribe en el archivo"""
+        if not self.path:
+            return True
+        if self._writer_fd is not None:
+            return True
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        self._writer_fd = self._file
+        # Otro proceso pudo registrar series mientras era el escritor
+        self._index_mtime = None
+        self._reload_index()
+        return True
+
+    def save_index(self):
+        """Guardar el registro de series si hubo altas desde la última vez"""
+        with self._lock:
+            if self._index_dirty:
+                self._save_index()
+                self._index_dirty = False
+
+    def release(self, keys):
+        """Liberar series: se borran sus puntos y su hueco queda para series nuevas; retorna cuántas"""
+        with self._lock:
+            if not self.is_writer():
+                return 0
+            self._reload_index()
+            released = 0
+            for key in keys:
+                slot = self._index.pop(key, None)
+                if slot is None:
+                    continue
+                for (_, capacity), fields in zip(self.levels, self._views):
+                    zeros = memoryview(bytes(capacity * 4))
+                    for name, code in _FIELDS:
+                        fields[name][slot * capacity:(slot + 1) * capacity] = zeros.cast(code)
+                heapq.heappush(self._free, slot)
+                released += 1
+            if released:
+                self._index_dirty = True
+                # Vuelve a haber espacio: avisar de nuevo si se llena
+                self._dropped.clear()
+                self._full_warned = False
+            return released
+
+    def record(self, key, value, timestamp=None):
+        """Añadir una muestra a la serie `key` en todas las resoluciones"""
+        if value is None:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        value = float(value)
+        with self._lock:
+            if not self.is_writer():
+                return
+            slot = self._slot(key, create=True)
+            if slot is None:
+                return
+            for (resolution, capacity), fields in zip(self.levels, self._views):
+                bucket = int(timestamp // resolution)
+                i = slot * capacity + bucket % capacity
+                if fields["bucket"][i] != bucket or fields["count"][i] == 0:
+                    fields["bucket"][i] = bucket
+                    fields["count"][i] = 1
+                    fields["min"][i] = value
+                    fields["max"][i] = value
+                    fields["sum"][i] = value
+                else:
+                    fields["count"][i] += 1
+                    fields["min"][i] = min(fields["min"][i], value)
+                    fields["max"][i] = max(fields["max"][i], value)
+                    fields["sum"][i] += value
+
+    # --- Lectura ---
+
+    def query(self, key, resolution=60, since=None):
+        """
+        Obtener los puntos de una serie en la resolución indicada (FINEST_RESOLUTION, 60 o 3600 s)
+        Retorna una lista ordenada de {t, min, max, avg}
+        """
+        for (level_resolution, capacity), fields in zip(self.levels, self._views):
+            if level_resolution == resolution:
+                break
+        else:
+            raise ValueError(f"Resolución no disponible: {resolution}")
+
+        with self._lock:
+            slot = self._slot(key, create=False)
+            if slot is None:
+                return []
+            newest = int(time.time() // resolution)
+            oldest = newest - capacity + 1
+            if since is not None:
+                oldest = max(oldest, int(since // resolution))
+            points = []
+            base = slot * capacity
+            # Recorrer solo las cubetas de la ventana pedida (ya en orden)
+            for bucket in range(oldest, newest + 1):
+                i = base + bucket % capacity
+                count = fields["count"][i]
+                if count and fields["bucket"][i] == bucket:
+                    points.append({
+                        "t": bucket * resolution,
+                        "min": round(fields["min"][i], 3),
+                        "max": round(fields["max"][i], 3),
+                        "avg": round(fields["sum"][i] / count, 3)
+                    })
+        return points
+
+    def series(self):
+        """Claves de todas las series registradas"""
+        with self._lock:
+            self._reload_index()
+            return sorted(self._index)
+
+    def stats(self):
+        """Ocupación del histórico: series registradas, capacidad y series descartadas por falta de espacio"""
+        with self._lock:
+            return {
+                "status": "full" if self._dropped else "ok",
+                "series": len(self._index),
+                "max_series": self.max_series,
+                "dropped_series": len(self._dropped),
+                "persistent": bool(self.path)
+            }
+
+    def flush(self):
+        """Forzar la escritura del mapa a disco"""
+        if self.path:
+            self._mmap.flush()
+
+
+def series_key(tunnel_name, metric):
+    return f"{tunnel_name}|{metric}"
+
+
+_store = None
+_store_lock = threading.Lock()
+_last_recorded = None
+# Momento en que cada túnel con series guardadas dejó de aparecer en el inventario
+_absent_since = {}
+
+
+def get_store(tunnels=None):
+    """
+    Histórico compartido por el proceso (se crea al primer uso)
+    Si hay que crear el archivo, su tamaño se calcula para `tunnels` túneles (por defecto los de la última instantánea)
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            if tunnels is None:
+                snapshot = collector.peek()
+                tunnels = len(snapshot.tunnels) if snapshot else 0
+            _store = TimeSeriesStore(TSDB_PATH, max_series=TSDB_MAX_SERIES or None, create_series=default_max_series(tunnels))
+        return _store
+
+
+def history_stats():
+    """Ocupación del histórico sin crearlo (para los health checks)"""
+    store = _store
+    if store is None:
+        return {"status": "starting"}
+    return store.stats()
+
+
+def record_snapshot(snapshot):
+    """Guardar en el histórico las métricas de los túneles de una instantánea del recolector"""
+    global _last_recorded
+    # Las métricas solo cambian en los muestreos completos; el resto repite los mismos valores
+    if snapshot.full_generated_at is None or snapshot.full_generated_at == _last_recorded:
+        return
+    _last_recorded = snapshot.full_generated_at
+
+    store = get_store(len(snapshot.tunnels))
+    now = snapshot.full_generated_at
+    _reclaim(store, snapshot.tunnel_names(), now)
+    for tunnel_name in snapshot.tunnel_names():
+        metrics = snapshot.metrics.get(tunnel_name)
+        if not metrics:
+            continue
+        for metric in TUNNEL_SERIES:
+            store.record(series_key(tunnel_name, metric), metrics.get(metric), now)
+    store.save_index()
+
+
+def _reclaim(store, inventory, now):
+    """Liberar las series de los túneles que llevan TSDB_RECLAIM_AFTER segundos fuera del inventario"""
+    # Un inventario vacío suele ser un fallo al listar los túneles: no borrar nada
+    if not inventory or not store.is_writer():
+        return
+    inventory = set(inventory)
+
+    stored = {}
+    for key in store.series():
+        stored.setdefault(key.rsplit("|", 1)[0], []).append(key)
+
+    for tunnel_name in list(_absent_since):
+        if tunnel_name in inventory or tunnel_name not in stored:
+            del _absent_since[tunnel_name]
+
+    expired = []
+    for tunnel_name, keys in stored.items():
+        if tunnel_name in inventory:
+            continue
+        if now - _absent_since.setdefault(tunnel_name, now) >= TSDB_RECLAIM_AFTER:
+            expired.extend(keys)
+            del _absent_since[tunnel_name]
+
+    if expired:
+        released = store.release(expired)
+        logger.info(f"Histórico de métricas: liberadas {released} series de túneles eliminados")
+
+
+def get_tunnel_history(tunnel_name, resolution=60, since=None, metrics=TUNNEL_SERIES):
+    """Histórico de las métricas de un túnel"""
+    store = get_store()
+    return {metric: store.query(series_key(tunnel_name, metric), resolution, since) for metric in metrics}
+
+
+def get_tunnels_history(tunnel_names, resolution=60, since=None, metrics=TUNNEL_SERIES):
+    """Histórico de las métricas de varios túneles, indexado por nombre"""
+    return {tunnel_name: get_tunnel_history(tunnel_name, resolution, since, metrics) for tunnel_name in tunnel_names}
+
+
+collector.add_listener(record_snapshot)
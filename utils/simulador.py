@@ -0,0 +1,361 @@
+import os
+import math
+import time
+import asyncio
+import uuid
+import base64
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from utils.backend_tuneles import TunnelBackend
+from utils.procesos import format_elapsed
+from utils.monitorizacion import format_bytes_per_second
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Túneles de la flota simulada al arrancar
+SIM_TUNNELS = int(os.environ.get('SIM_TUNNELS', 1000))
+# Semilla: la misma semilla produce la misma flota, los mismos fallos y las mismas métricas
+SIM_SEED = int(os.environ.get('SIM_SEED', 1))
+# Latencia media (ms) por operación, p. ej. "list=800,info=150"; el resto conserva su valor por defecto
+SIM_LATENCY_MS = os.environ.get('SIM_LATENCY_MS', '')
+# Multiplicador de todas las latencias (0 para no esperar)
+SIM_LATENCY_SCALE = float(os.environ.get('SIM_LATENCY_SCALE', 1))
+# Fracción de operaciones (list, start, stop, create, delete) que fallan
+SIM_FAILURE_RATE = float(os.environ.get('SIM_FAILURE_RATE', 0.01))
+# Fracción de túneles detenidos al arrancar
+SIM_STOPPED_RATE = float(os.environ.get('SIM_STOPPED_RATE', 0.1))
+# Fracción de túneles cuyo conector se cae y se recupera periódicamente
+SIM_FLAPPING_RATE = float(os.environ.get('SIM_FLAPPING_RATE', 0.03))
+# Periodo (segundos) de un ciclo caída/recuperación de los túneles inestables
+SIM_FLAP_PERIOD = float(os.environ.get('SIM_FLAP_PERIOD', 300))
+
+# Latencias por defecto, del orden de las de cloudflared contra la API de Cloudflare
+DEFAULT_LATENCIES_MS = {
+    "list": 600,
+    "info": 150,
+    "start": 900,
+    "stop": 400,
+    "create": 1500,
+    "delete": 1200
+}
+
+# Centros de datos que aparecen en las conexiones simuladas
+COLOS = ("MAD", "BCN", "CDG", "FRA", "AMS", "LHR", "LIS", "MIL")
+
+PID_BASE = 400000
+HA_CONNECTIONS = 4
+
+
+def _parse_latencies(text):
+    latencies = dict(DEFAULT_LATENCIES_MS)
+    for item in text.split(","):
+        operation, sep, value = item.partition("=")
+        if sep and operation.strip() in latencies:
+            try:
+                latencies[operation.strip()] = float(value)
+            except ValueError:
+                logger.warning(f"Latencia simulada no válida: {item}")
+    return latencies
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FleetSimulator(TunnelBackend):
+    """
+    Flota de túneles en memoria, determinista a partir de SIM_SEED
+    Cada valor "aleatorio" es un hash de la semilla, el túnel y el número de operación,
+    así que no depende del orden en que se intercalan los hilos. El estado es de cada
+    proceso: los workers de gunicorn y el monitor simulan la misma flota inicial pero
+    no ven los cambios que hagan los demás
+    """
+
+    name = "simulador"
+
+    def __init__(self, size=None, seed=None):
+        self.seed = SIM_SEED if seed is None else seed
+        self.latencies = _parse_latencies(SIM_LATENCY_MS)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._tunnels = {}
+        self._indexes = {}
+
+        now = time.time()
+        for i in range(SIM_TUNNELS if size is None else size):
+            name = f"sim-{i:05d}"
+            self._add(name, created_at=now - 86400 * (1 + 365 * self._unit("antiguedad", name)))
+            tunnel = self._tunnels[name]
+            if self._unit("detenido", name) >= SIM_STOPPED_RATE:
+                tunnel["running"] = True
+                tunnel["started_at"] = now - 7 * 86400 * self._unit("arranque", name)
+        logger.info(f"Flota simulada de {len(self._tunnels)} túneles (semilla {self.seed})")
+
+    def _unit(self, *parts):
+        """Número en [0, 1) que solo depende de la semilla y de las partes"""
+        key = ":".join(str(part) for part in (self.seed,) + parts).encode()
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big") / 2**64
+
+    def _next(self, operation, name):
+        """Número de orden de una operación sobre un túnel (para fallos y latencias reproducibles)"""
+        with self._lock:
+            key = (operation, name)
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def _delay(self, operation, name):
+        """Latencia simulada (segundos) de la operación y si debe fallar"""
+        count = self._next(operation, name)
+        base = self.latencies.get(operation, 0) * SIM_LATENCY_SCALE
+        seconds = 0
+        if base > 0:
+            # Distribución de cola larga alrededor de la media: la mayoría rápidas, algunas lentas
+            seconds = base / 1000 * -math.log(1 - self._unit("latencia", operation, name, count) * 0.999)
+        return seconds, operation != "info" and self._unit("fallo", operation, name, count) < SIM_FAILURE_RATE
+
+    def _wait(self, operation, name):
+        """Simular la latencia de la operación; retorna True si la operación debe fallar"""
+        seconds, fails = self._delay(operation, name)
+        if seconds:
+            time.sleep(seconds)
+        return fails
+
+    def _add(self, name, created_at):
+        self._indexes[name] = len(self._indexes)
+        self._tunnels[name] = {
+            "id": str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{self.seed}.{name}.tunel.simulado")),
+            "name": name,
+            "created_at": created_at,
+            "running": False,
+            "started_at": None
+        }
+
+    def _flapping(self, name):
+        return self._unit("inestable", name) < SIM_FLAPPING_RATE
+
+    def _connector_up(self, tunnel, now=None):
+        """El conector de un túnel iniciado puede estar caído durante parte del ciclo si es inestable"""
+        if not tunnel["running"]:
+            return False
+        if not self._flapping(tunnel["name"]):
+            return True
+        now = time.time() if now is None else now
+        phase = now / SIM_FLAP_PERIOD + self._unit("fase", tunnel["name"])
+        # Caído durante el primer cuarto de cada periodo
+        return phase - math.floor(phase) >= 0.25
+
+    def _get(self, name):
+        with self._lock:
+            tunnel = self._tunnels.get(name)
+            return dict(tunnel) if tunnel else None
+
+    def is_installed(self):
+        return True
+
+    def version(self):
+        return "2024.1.0-simulada"
+
+    def list_tunnels(self):
+        if self._wait("list", "*"):
+            raise RuntimeError("failed to list tunnels: REST request failed: 503 Service Unavailable (simulado)")
+        now = time.time()
+        with self._lock:
+            tunnels = [dict(tunnel) for tunnel in self._tunnels.values()]
+        return [
+            {
+                "id": tunnel["id"],
+                "name": tunnel["name"],
+                "created_at": _iso(tunnel["created_at"]),
+                "deleted_at": "0001-01-01T00:00:00Z",
+                "connections": [
+                    {
+                        "colo_name": COLOS[int(self._unit("colo", tunnel["name"], i) * len(COLOS))],
+                        "id": str(uuid.uuid5(uuid.NAMESPACE_OID, f"{tunnel['id']}.{i}")),
+                        "is_pending_reconnect": False,
+                        "opened_at": _iso(tunnel["started_at"])
+                    }
+                    for i in range(HA_CONNECTIONS)
+                ] if self._connector_up(tunnel, now) else []
+            }
+            for tunnel in tunnels
+        ]
+
+    def is_running(self, tunnel_name):
+        tunnel = self._get(tunnel_name)
+        return tunnel is not None and self._connector_up(tunnel)
+
+    def find_process(self, tunnel_name):
+        tunnel = self._get(tunnel_name)
+        if tunnel is None or not self._connector_up(tunnel):
+            return None
+        uptime_seconds = max(0.0, time.time() - tunnel["started_at"])
+        return {
+            "pid": PID_BASE + self._indexes[tunnel_name],
+            "tunnel": tunnel_name,
+            "uptime_seconds": uptime_seconds,
+            "uptime": format_elapsed(uptime_seconds),
+            "cpu_percent": round(0.2 + 3 * self._load(tunnel_name), 1),
+            "memory_percent": round(0.3 + 0.6 * self._unit("memoria", tunnel_name), 1)
+        }
+
+    def get_status(self, tunnel_name):
+        process = self.find_process(tunnel_name)
+        status = {
+            "running": process is not None,
+            "pid": process["pid"] if process else None,
+            "uptime": process["uptime"] if process else None,
+            "connectivity": False,
+            "last_updated": datetime.now().strftime("%H:%M:%S")
+        }
+        if process is not None:
+            # Equivalente a `cloudflared tunnel info`
+            self._wait("info", tunnel_name)
+            status["connectivity"] = True
+        return status
+
+    def _load(self, tunnel_name, now=None):
+        """Carga relativa del túnel en [0, 1]: una onda diaria desfasada por túnel"""
+        now = time.time() if now is None else now
+        phase = 2 * math.pi * (now / 86400 + self._unit("fase-carga", tunnel_name))
+        return 0.5 + 0.5 * math.sin(phase)
+
+    def get_metrics(self, tunnel_name):
+        now = time.time()
+        metrics = {
+            "connections": 0,
+            "upload": 0,
+            "download": 0,
+            "upload_formatted": "0 B/s",
+            "download_formatted": "0 B/s",
+            "metrics_available": False,
+            "socket_metrics_available": False,
+            "timestamp": datetime.now().strftime("%H:%M:%S")
+        }
+        process = self.find_process(tunnel_name)
+        if process is None:
+            return metrics
+
+        # Pocos túneles concentran casi todo el tráfico, como en una flota real
+        peak_rps = 0.05 + 200 * self._unit("trafico", tunnel_name) ** 4
+        requests_per_second = peak_rps * (0.2 + 0.8 * self._load(tunnel_name, now))
+        error_ratio = 0.002 + 0.05 * self._unit("errores", tunnel_name) ** 3
+        rtt = 8 + 120 * self._unit("rtt", tunnel_name) ** 2
+        upload = requests_per_second * (500 + 4000 * self._unit("subida", tunnel_name))
+        download = requests_per_second * (2000 + 60000 * self._unit("bajada", tunnel_name))
+        total_requests = int(peak_rps * 0.6 * process["uptime_seconds"])
+
+        metrics.update({
+            "cpu_usage": process["cpu_percent"],
+            "memory_usage": process["memory_percent"],
+            "edge_connections": HA_CONNECTIONS,
+            "edge_tcp_connections": 0,
+            "edge_udp_sockets": HA_CONNECTIONS,
+            "edge_rtt_ms": round(rtt, 2),
+            "edge_retransmits_per_second": round(requests_per_second * 0.01, 3),
+            "edge_upload": upload,
+            "edge_download": download,
+            "ha_connections": HA_CONNECTIONS,
+            "concurrent_requests": int(requests_per_second * rtt / 1000),
+            "total_requests": total_requests,
+            "request_errors": int(total_requests * error_ratio),
+            "requests_per_second": round(requests_per_second, 3),
+            "errors_per_second": round(requests_per_second * error_ratio, 3),
+            "upload": upload,
+            "download": download,
+            "responses_by_code": {
+                "200": round(requests_per_second * (1 - error_ratio) * 0.95, 3),
+                "404": round(requests_per_second * (1 - error_ratio) * 0.05, 3),
+                "502": round(requests_per_second * error_ratio, 3)
+            },
+            "rtt_ms": round(rtt, 2),
+            "min_rtt_ms": round(rtt * 0.8, 2),
+            "latest_rtt_ms": round(rtt * (0.9 + 0.2 * self._load(tunnel_name, now * 7)), 2),
+            "metrics_available": True,
+            "socket_metrics_available": True,
+            "connections": HA_CONNECTIONS,
+            "upload_formatted": format_bytes_per_second(upload),
+            "download_formatted": format_bytes_per_second(download)
+        })
+        return metrics
+
+    def check(self, tunnel_name):
+        tunnel = self._get(tunnel_name)
+        connector_up = tunnel is not None and self._connector_up(tunnel)
+        if connector_up:
+            self._wait("info", tunnel_name)
+        return self._check_result(tunnel_name, tunnel, connector_up)
+
+    async def check_async(self, tunnel_name):
+        tunnel = self._get(tunnel_name)
+        connector_up = tunnel is not None and self._connector_up(tunnel)
+        if connector_up:
+            seconds, _ = self._delay("info", tunnel_name)
+            await asyncio.sleep(seconds)
+        return self._check_result(tunnel_name, tunnel, connector_up)
+
+    def quick_states(self, tunnel_names):
+        states = {}
+        for name in tunnel_names:
+            tunnel = self._get(name)
+            states[name] = (tunnel is not None and tunnel["running"], tunnel is not None and self._connector_up(tunnel))
+        return states
+
+    def _check_result(self, tunnel_name, tunnel, connector_up):
+        info = None
+        if connector_up:
+            info = f"NAME: {tunnel_name}\nID: {tunnel['id']}\nActive connectors: 1 ({HA_CONNECTIONS} connections)\n"
+        return {
+            # Un conector inestable caído sigue con la unidad activa (systemd lo está reiniciando)
+            "service_active": tunnel is not None and tunnel["running"],
+            "process_running": connector_up,
+            "info": info
+        }
+
+    def start(self, tunnel_name):
+        if self._get(tunnel_name) is None:
+            return {"success": False, "error": f"Unit cloudflared-{tunnel_name}.service not found."}
+        if self._wait("start", tunnel_name):
+            return {"success": False, "error": f"Job for cloudflared-{tunnel_name}.service failed (simulado)"}
+        with self._lock:
+            tunnel = self._tunnels.get(tunnel_name)
+            if tunnel and not tunnel["running"]:
+                tunnel["running"] = True
+                tunnel["started_at"] = time.time()
+        return {"success": True}
+
+    def stop(self, tunnel_name):
+        if self._get(tunnel_name) is None:
+            return {"success": False, "error": f"Unit cloudflared-{tunnel_name}.service not loaded."}
+        if self._wait("stop", tunnel_name):
+            return {"success": False, "error": f"Failed to stop cloudflared-{tunnel_name}.service (simulado)"}
+        with self._lock:
+            tunnel = self._tunnels.get(tunnel_name)
+            if tunnel:
+                tunnel["running"] = False
+                tunnel["started_at"] = None
+        return {"success": True}
+
+    def create(self, tunnel_name):
+        if self._get(tunnel_name) is not None:
+            return {"success": False, "error": "failed to create tunnel: tunnel with name already exists"}
+        if self._wait("create", tunnel_name):
+            return {"success": False, "error": "failed to create tunnel: REST request failed (simulado)"}
+        with self._lock:
+            if tunnel_name in self._tunnels:
+                return {"success": False, "error": "failed to create tunnel: tunnel with name already exists"}
+            self._add(tunnel_name, created_at=time.time())
+            tunnel_id = self._tunnels[tunnel_name]["id"]
+        token = base64.b64encode(f'{{"t":"{tunnel_id}","s":"simulado"}}'.encode()).decode()
+        return {"success": True, "tunnel_id": tunnel_id, "token": token}
+
+    def delete(self, tunnel_name):
+        if self._get(tunnel_name) is None:
+            return {"success": False, "error": f"tunnel {tunnel_name} not found"}
+        if self._wait("delete", tunnel_name):
+            return {"success": False, "error": "failed to delete tunnel: REST request failed (simulado)"}
+        with self._lock:
+            self._tunnels.pop(tunnel_name, None)
+        return {"success": True}
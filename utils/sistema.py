@@ -1,9 +1,10 @@
 import os
-import subprocess
+import socket
 import logging
 import platform
 import psutil
-import shutil
+from utils.capacidades import capabilities
+from utils.ejecucion import run_command
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -24,20 +25,14 @@ def check_dependencies():
         # Verificar cada dependencia básica
         for i, dep in enumerate(dependencies):
             if dep["name"] != "systemd":  # Systemd requiere verificación específica
-                result = subprocess.run(["which", dep["name"]], capture_output=True, text=True)
-                dependencies[i]["installed"] = result.returncode == 0
+                dependencies[i]["installed"] = capabilities.which(dep["name"]) is not None
         
         # Verificar systemd de forma específica (es un servicio, no un comando)
-        try:
-            systemd_check = subprocess.run(
-                ["systemctl", "--version"], 
-                capture_output=True, 
-                text=True
-            )
+        if capabilities.which("systemctl") is not None:
             for i, dep in enumerate(dependencies):
                 if dep["name"] == "systemd":
-                    dependencies[i]["installed"] = systemd_check.returncode == 0
-        except FileNotFoundError:
+                    dependencies[i]["installed"] = capabilities.version("systemctl") is not None
+        else:
             # Si systemctl no existe, systemd no está disponible pero es opcional
             logger.warning("systemd no está disponible en este sistema")
             for i, dep in enumerate(dependencies):
@@ -66,7 +61,7 @@ def install_dependencies():
             
         # Actualizar índices de paquetes
         logger.info("Actualizando índices de paquetes...")
-        update_result = subprocess.run(
+        update_result = run_command(
             ["sudo", "apt-get", "update", "-y"],
             capture_output=True,
             text=True
@@ -79,7 +74,7 @@ def install_dependencies():
         # Instalar cada dependencia
         for dep in deps_to_install:
             logger.info(f"Instalando {dep}...")
-            install_result = subprocess.run(
+            install_result = run_command(
                 ["sudo", "apt-get", "install", "-y", dep],
                 capture_output=True,
                 text=True
@@ -88,12 +83,25 @@ def install_dependencies():
             if install_result.returncode != 0:
                 logger.error(f"Error al instalar {dep}: {install_result.stderr}")
                 return False
-                
+        
+        # Los binarios recién instalados deben volver a sondearse
+        capabilities.invalidate()
         return True
     except Exception as e:
         logger.error(f"Error al instalar dependencias: {str(e)}")
         return False
 
+def get_primary_ip():
+    """Primera dirección IPv4 que no es de loopback ni de enlace local"""
+    for addresses in psutil.net_if_addrs().values():
+        for address in addresses:
+            if address.family != socket.AF_INET:
+                continue
+            if address.address.startswith("127.") or address.address.startswith("169.254."):
+                continue
+            return address.address
+    return None
+
 def get_system_info():
     """
     Obtener información del sistema operativo
@@ -114,16 +122,10 @@ def get_system_info():
         # Hostname
         info["hostname"] = platform.node()
         
-        # IP local (primera interfaz no lo de loopback)
-        ip_command = subprocess.run(
-            ["hostname", "-I"], 
-            capture_output=True, 
-            text=True
-        )
-        if ip_command.returncode == 0:
-            ips = ip_command.stdout.strip().split()
-            if ips:
-                info["ip"] = ips[0]
+        # IP local (primera interfaz no lo de loopback, como `hostname -I`)
+        ip = get_primary_ip()
+        if ip:
+            info["ip"] = ip
         
         # Memoria RAM
         ram = psutil.virtual_memory()
@@ -158,7 +160,7 @@ def check_service_status(service_name):
     # Verificar si systemd está disponible
     try:
         # Comprobar si systemctl existe
-        systemctl_exists = shutil.which('systemctl') is not None
+        systemctl_exists = capabilities.which('systemctl') is not None
         
         if not systemctl_exists:
             status["systemd_available"] = False
@@ -167,7 +169,7 @@ def check_service_status(service_name):
             return status
     
         # Verificar si el servicio existe
-        status_result = subprocess.run(
+        status_result = run_command(
             ["systemctl", "status", service_name],
             capture_output=True,
             text=True
@@ -179,7 +181,7 @@ def check_service_status(service_name):
             return status
             
         # Verificar si está activo
-        active_result = subprocess.run(
+        active_result = run_command(
             ["systemctl", "is-active", service_name],
             capture_output=True,
             text=True
@@ -187,7 +189,7 @@ def check_service_status(service_name):
         status["active"] = active_result.stdout.strip() == "active"
         
         # Verificar si está habilitado para iniciar con el sistema
-        enabled_result = subprocess.run(
+        enabled_result = run_command(
             ["systemctl", "is-enabled", service_name],
             capture_output=True,
             text=True
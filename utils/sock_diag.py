@@ -0,0 +1,254 @@
+import os
+import time
+import socket
+import struct
+import logging
+import threading
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+PROC_DIR = "/proc"
+
+# Puerto del edge de Cloudflare al que se conectan los conectores (HTTP/2 por TCP y QUIC por UDP)
+EDGE_PORT = int(os.environ.get('CLOUDFLARED_EDGE_PORT', 7844))
+# Segundos durante los que se reutiliza el último volcado de sockets
+SOCKET_TABLE_TTL = float(os.environ.get('SOCKET_TABLE_TTL', 1))
+
+# Constantes de linux/netlink.h, linux/sock_diag.h y linux/inet_diag.h
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_INFO = 2
+TCP_ESTABLISHED = 1
+ALL_STATES = 0xffffffff
+
+_NLMSGHDR = struct.Struct("=IHHII")
+# inet_diag_req_v2: familia, protocolo, extensiones, relleno, estados e inet_diag_sockid (a cero: todos)
+_REQUEST = struct.Struct("=BBBxI48x")
+# inet_diag_msg: familia, estado, temporizador, retransmisiones, puertos (big endian),
+# direcciones, interfaz, cookie, expires, colas, uid e inodo
+_DIAG_MSG = struct.Struct("=BBBB2H16s16sI8sIIIII")
+_RTATTR = struct.Struct("=HH")
+
+# Campos de struct tcp_info (linux/tcp.h) que se usan: (desplazamiento, formato)
+_TCP_INFO_FIELDS = {
+    "rtt_us": (68, "I"),
+    "total_retrans": (100, "I"),
+    "bytes_acked": (120, "Q"),
+    "bytes_received": (128, "Q"),
+    "bytes_sent": (200, "Q")
+}
+
+_lock = threading.Lock()
+_table = None
+_unavailable_logged = False
+
+
+def _parse_tcp_info(data):
+    """Extraer de tcp_info los campos conocidos; los kernels antiguos envían una estructura más corta"""
+    info = {}
+    for name, (offset, fmt) in _TCP_INFO_FIELDS.items():
+        size = struct.calcsize(fmt)
+        if len(data) >= offset + size:
+            info[name] = struct.unpack_from("=" + fmt, data, offset)[0]
+    return info
+
+
+def _format_address(family, raw):
+    if family == socket.AF_INET:
+        return socket.inet_ntop(family, raw[:4])
+    return socket.inet_ntop(family, raw)
+
+
+def dump_sockets(family, protocol, states=ALL_STATES, with_info=False):
+    """
+    Volcar los sockets de una familia (AF_INET/AF_INET6) y protocolo (TCP/UDP) con NETLINK_SOCK_DIAG
+    Retorna una lista de diccionarios; con with_info incluye tcp_info de los sockets TCP
+    """
+    ext = (1 << (INET_DIAG_INFO - 1)) if with_info else 0
+    request = _NLMSGHDR.pack(
+        _NLMSGHDR.size + _REQUEST.size, SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST | NLM_F_DUMP, 1, 0
+    ) + _REQUEST.pack(family, protocol, ext, states)
+
+    sockets = []
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG) as nl:
+        nl.sendall(request)
+        while True:
+            data = nl.recv(65536)
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length, msg_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+                if length < _NLMSGHDR.size:
+                    return sockets
+                if msg_type == NLMSG_DONE:
+                    return sockets
+                if msg_type == NLMSG_ERROR:
+                    code = -struct.unpack_from("=i", data, offset + _NLMSGHDR.size)[0]
+                    raise OSError(code, os.strerror(code))
+
+                body = offset + _NLMSGHDR.size
+                (msg_family, state, _, _, sport, dport, src, dst,
+                 _, _, _, _, _, _, inode) = _DIAG_MSG.unpack_from(data, body)
+                entry = {
+                    "inode": inode,
+                    "state": state,
+                    "protocol": protocol,
+                    "src": _format_address(msg_family, src),
+                    "sport": socket.ntohs(sport),
+                    "dst": _format_address(msg_family, dst),
+                    "dport": socket.ntohs(dport),
+                    "info": None
+                }
+
+                # Atributos (rtattr) a continuación del mensaje, alineados a 4 bytes
+                attr = body + _DIAG_MSG.size
+                end = offset + length
+                while attr + _RTATTR.size <= end:
+                    attr_len, attr_type = _RTATTR.unpack_from(data, attr)
+                    if attr_len < _RTATTR.size:
+                        break
+                    if attr_type == INET_DIAG_INFO:
+                        entry["info"] = _parse_tcp_info(data[attr + _RTATTR.size:attr + attr_len])
+                    attr += (attr_len + 3) & ~3
+
+                sockets.append(entry)
+                offset += (length + 3) & ~3
+
+
+class SocketTable:
+    """Volcado de los sockets TCP y UDP del sistema indexado por inodo"""
+
+    def __init__(self, sockets):
+        self.created_at = time.monotonic()
+        self.by_inode = {entry["inode"]: entry for entry in sockets}
+
+
+def _build_table():
+    sockets = []
+    for family in (socket.AF_INET, socket.AF_INET6):
+        sockets.extend(dump_sockets(family, socket.IPPROTO_TCP, 1 << TCP_ESTABLISHED, with_info=True))
+        sockets.extend(dump_sockets(family, socket.IPPROTO_UDP))
+    return SocketTable(sockets)
+
+
+def get_socket_table(max_age=None):
+    """
+    Obtener el volcado de sockets, reutilizando el último si es reciente
+    Retorna None si el kernel no permite NETLINK_SOCK_DIAG
+    """
+    global _table, _unavailable_logged
+    if max_age is None:
+        max_age = SOCKET_TABLE_TTL
+
+    with _lock:
+        if _table is not None and time.monotonic() - _table.created_at < max_age:
+            return _table
+        try:
+            _table = _build_table()
+        except OSError as e:
+            if not _unavailable_logged:
+                # Kernel sin inet_diag o contenedor sin netlink: no se repite el aviso
+                logger.warning(f"NETLINK_SOCK_DIAG no disponible, sin métricas de sockets: {str(e)}")
+                _unavailable_logged = True
+            _table = None
+            return None
+        return _table
+
+
+def process_socket_inodes(pid):
+    """Inodos de los sockets abiertos por un proceso (enlaces socket:[N] de /proc/<pid>/fd)"""
+    inodes = set()
+    fd_dir = os.path.join(PROC_DIR, str(pid), "fd")
+    for fd in os.listdir(fd_dir):
+        try:
+            target = os.readlink(os.path.join(fd_dir, fd))
+        except OSError:
+            continue
+        if target.startswith("socket:["):
+            inodes.add(int(target[8:-1]))
+    return inodes
+
+
+class SocketStatsCollector:
+    """
+    Atribuye a cada conector sus sockets con el edge y calcula tasas
+    a partir de los contadores de tcp_info de cada conexión
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._previous = {}
+
+    def _rates(self, tunnel_name, pid, counters):
+        """Tasas por segundo sumando la variación de cada conexión desde la lectura anterior"""
+        now = time.monotonic()
+        with self._lock:
+            previous = self._previous.get(tunnel_name)
+            self._previous[tunnel_name] = (pid, now, counters)
+
+        if not previous or previous[0] != pid or now <= previous[1]:
+            return None
+
+        elapsed = now - previous[1]
+        totals = {"bytes_acked": 0, "bytes_received": 0, "total_retrans": 0}
+        for inode, values in counters.items():
+            # Una conexión nueva aporta todo lo que ha transferido desde que se abrió
+            before = previous[2].get(inode, {})
+            for name in totals:
+                totals[name] += max(0, values.get(name, 0) - before.get(name, 0))
+        return {name: value / elapsed for name, value in totals.items()}
+
+    def collect(self, tunnel_name, process):
+        """
+        Obtener conexiones con el edge, RTT, retransmisiones y tráfico de un conector
+        Retorna None si no se pueden leer los sockets
+        """
+        if process is None:
+            return None
+        table = get_socket_table()
+        if table is None:
+            return None
+        try:
+            inodes = process_socket_inodes(process["pid"])
+        except (FileNotFoundError, PermissionError):
+            return None
+
+        tcp_connections = 0
+        udp_sockets = 0
+        rtts = []
+        counters = {}
+        for inode in inodes:
+            entry = table.by_inode.get(inode)
+            if entry is None:
+                continue
+            if entry["protocol"] == socket.IPPROTO_UDP:
+                # quic-go usa sockets UDP sin conectar: no tienen destino ni tcp_info
+                udp_sockets += 1
+                continue
+            if entry["dport"] != EDGE_PORT:
+                # Conexiones con el servicio de origen
+                continue
+            tcp_connections += 1
+            info = entry["info"] or {}
+            if "rtt_us" in info:
+                rtts.append(info["rtt_us"] / 1000)
+            counters[inode] = info
+
+        rates = self._rates(tunnel_name, process["pid"], counters)
+        return {
+            "edge_connections": tcp_connections + udp_sockets,
+            "edge_tcp_connections": tcp_connections,
+            "edge_udp_sockets": udp_sockets,
+            "edge_rtt_ms": round(sum(rtts) / len(rtts), 2) if rtts else None,
+            "edge_retransmits_per_second": round(rates["total_retrans"], 3) if rates else 0.0,
+            "edge_upload": rates["bytes_acked"] if rates else 0.0,
+            "edge_download": rates["bytes_received"] if rates else 0.0
+        }
+
+
+# Colector compartido por el proceso (conserva la lectura anterior de cada túnel)
+socket_stats = SocketStatsCollector()
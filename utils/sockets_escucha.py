@@ -0,0 +1,237 @@
+import os
+import time
+import socket
+import logging
+import threading
+from utils.rendimiento import count_cache, timed
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+PROC_DIR = "/proc"
+
+# Segundos durante los que se reutiliza el índice sin volver a leer /proc/net
+LISTENER_INDEX_TTL = float(os.environ.get('LISTENER_INDEX_TTL', 2))
+
+# Tablas de /proc/net y estado que indica "en escucha" (TCP_LISTEN, o TCP_CLOSE para UDP enlazado)
+_TABLES = (
+    ("tcp", "tcp", False, "0A"),
+    ("tcp6", "tcp", True, "0A"),
+    ("udp", "udp", False, "07"),
+    ("udp6", "udp", True, "07")
+)
+
+# Rango de puertos efímeros por defecto de Linux (si no se puede leer /proc/sys)
+DEFAULT_EPHEMERAL_RANGE = (32768, 60999)
+
+_lock = threading.Lock()
+_index = None
+_ephemeral_range = None
+
+
+def ephemeral_port_range():
+    """Rango de puertos locales que el kernel asigna a los sockets cliente (se lee una vez)"""
+    global _ephemeral_range
+    if _ephemeral_range is None:
+        try:
+            with open(os.path.join(PROC_DIR, "sys", "net", "ipv4", "ip_local_port_range"), "r") as f:
+                low, high = f.read().split()[:2]
+            _ephemeral_range = (int(low), int(high))
+        except (OSError, ValueError):
+            _ephemeral_range = DEFAULT_EPHEMERAL_RANGE
+    return _ephemeral_range
+
+
+def _decode_address(hex_address, ipv6):
+    """Convertir la dirección hexadecimal de /proc/net (palabras de 32 bits en orden del host) en texto"""
+    raw = bytes.fromhex(hex_address)
+    if not ipv6:
+        return socket.inet_ntop(socket.AF_INET, raw[::-1])
+    words = b"".join(raw[i:i + 4][::-1] for i in range(0, 16, 4))
+    return socket.inet_ntop(socket.AF_INET6, words)
+
+
+@timed("io")
+def read_listening_sockets():
+    """
+    Leer los sockets en escucha de /proc/net/{tcp,tcp6,udp,udp6}
+    Retorna una lista de diccionarios {protocol, address, port, inode}
+    Todo socket UDP sin conectar tiene el estado 07, también los de los clientes (QUIC de
+    cloudflared, resolutores); los que usan un puerto efímero no se consideran servicios
+    """
+    ephemeral_low, ephemeral_high = ephemeral_port_range()
+    sockets = []
+    for table, protocol, ipv6, listen_state in _TABLES:
+        try:
+            with open(os.path.join(PROC_DIR, "net", table), "r") as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 10 or fields[3] != listen_state:
+                        continue
+                    address, port = fields[1].split(":")
+                    port = int(port, 16)
+                    inode = int(fields[9])
+                    # Los sockets UDP sin puerto o sin inodo no son servicios
+                    if port == 0 or inode == 0:
+                        continue
+                    if protocol == "udp" and ephemeral_low <= port <= ephemeral_high:
+                        continue
+                    sockets.append({
+                        "protocol": protocol,
+                        "address": _decode_address(address, ipv6),
+                        "port": port,
+                        "inode": inode
+                    })
+        except (FileNotFoundError, StopIteration):
+            continue
+    return sockets
+
+
+def _unit_from_cgroup(pid):
+    """Unidad de systemd que contiene al proceso, según /proc/<pid>/cgroup"""
+    try:
+        with open(os.path.join(PROC_DIR, str(pid), "cgroup"), "r") as f:
+            for line in f:
+                for part in reversed(line.strip().split(":", 2)[-1].split("/")):
+                    if part.endswith(".service") or part.endswith(".scope"):
+                        return part
+    except (FileNotFoundError, PermissionError, ProcessLookupError):
+        pass
+    return None
+
+
+def _process_name(pid):
+    try:
+        with open(os.path.join(PROC_DIR, str(pid), "comm"), "r") as f:
+            return f.read().strip()
+    except (FileNotFoundError, PermissionError, ProcessLookupError):
+        return None
+
+
+def _resolve_owners(inodes):
+    """
+    Asociar inodos de sockets con el PID que los tiene abiertos recorriendo /proc/<pid>/fd
+    Termina en cuanto se han encontrado todos
+    """
+    owners = {}
+    pending = set(inodes)
+    for entry in os.listdir(PROC_DIR):
+        if not pending:
+            break
+        if not entry.isdigit():
+            continue
+        fd_dir = os.path.join(PROC_DIR, entry, "fd")
+        try:
+            fds = os.listdir(fd_dir)
+        except (FileNotFoundError, PermissionError, ProcessLookupError):
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if target.startswith("socket:["):
+                inode = int(target[8:-1])
+                if inode in pending:
+                    owners[inode] = int(entry)
+                    pending.discard(inode)
+    return owners
+
+
+class ListenerIndex:
+    """Sockets en escucha del sistema con el proceso y la unidad de systemd propietarios"""
+
+    def __init__(self, listeners, signature, ignored=None):
+        self.created_at = time.monotonic()
+        self.signature = signature
+        self.listeners = listeners
+        # Sockets descartados con su propietario ya resuelto {inodo: (pid, proceso, unidad)}
+        self.ignored = ignored or {}
+        self.by_port = {}
+        self.by_pid = {}
+        for listener in listeners:
+            self.by_port.setdefault(listener["port"], []).append(listener)
+            if listener["pid"] is not None:
+                self.by_pid.setdefault(listener["pid"], []).append(listener)
+
+    def is_listening(self, port, protocol=None):
+        """Indica si hay algún socket en escucha exactamente en ese puerto"""
+        return any(protocol is None or l["protocol"] == protocol for l in self.by_port.get(port, ()))
+
+    def tcp_addresses(self, pid):
+        """Direcciones host:puerto TCP de un proceso accesibles desde localhost"""
+        addresses = []
+        for listener in self.by_pid.get(pid, ()):
+            if listener["protocol"] != "tcp":
+                continue
+            address = listener["address"]
+            if address in ("0.0.0.0", "127.0.0.1"):
+                addresses.append(f"127.0.0.1:{listener['port']}")
+            elif address in ("::", "::1"):
+                addresses.append(f"[::1]:{listener['port']}")
+        return addresses
+
+
+def _build_index(sockets, previous):
+    """Construir el índice reaprovechando los propietarios ya conocidos del índice anterior"""
+    known = {}
+    if previous is not None:
+        known = {l["inode"]: (l["pid"], l["process"], l["unit"]) for l in previous.listeners}
+        known.update(previous.ignored)
+
+    unresolved = [s["inode"] for s in sockets if s["inode"] not in known]
+    owners = _resolve_owners(unresolved) if unresolved else {}
+
+    listeners = []
+    ignored = {}
+    for socket_entry in sockets:
+        inode = socket_entry["inode"]
+        if inode in known:
+            pid, process, unit = known[inode]
+        else:
+            pid = owners.get(inode)
+            process = _process_name(pid) if pid else None
+            unit = _unit_from_cgroup(pid) if pid else None
+        # Los sockets UDP de cloudflared son conexiones QUIC salientes, no servicios
+        if socket_entry["protocol"] == "udp" and process == "cloudflared":
+            ignored[inode] = (pid, process, unit)
+            continue
+        listeners.append(dict(socket_entry, pid=pid, process=process, unit=unit))
+
+    signature = frozenset(s["inode"] for s in sockets)
+    return ListenerIndex(listeners, signature, ignored)
+
+
+def get_listener_index(max_age=None):
+    """
+    Obtener el índice de sockets en escucha
+    Solo se recorre /proc/<pid>/fd cuando aparecen sockets nuevos
+    """
+    global _index
+    if max_age is None:
+        max_age = LISTENER_INDEX_TTL
+
+    with _lock:
+        if _index is not None and time.monotonic() - _index.created_at < max_age:
+            count_cache(True)
+            return _index
+
+        sockets = read_listening_sockets()
+        signature = frozenset(s["inode"] for s in sockets)
+        if _index is not None and signature == _index.signature:
+            # Nada ha cambiado: renovar la antigüedad sin reconstruir
+            _index.created_at = time.monotonic()
+            count_cache(True)
+            return _index
+        count_cache(False)
+
+        _index = _build_index(sockets, _index)
+        return _index
+
+
+def invalidate_listener_index():
+    """Descartar el índice (p. ej. tras arrancar o detener servicios)"""
+    global _index
+    with _lock:
+        _index = None
@@ -0,0 +1,118 @@
+import os
+import json
+import logging
+import secrets
+import threading
+from collections import deque
+from utils.recolector import collector
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Segundos entre comentarios de keepalive cuando no hay cambios
+ESTADO_STREAM_HEARTBEAT = float(os.environ.get('ESTADO_STREAM_HEARTBEAT', 15))
+# Eventos que se conservan para reenviar tras una reconexión (Last-Event-ID)
+ESTADO_STREAM_BUFFER = int(os.environ.get('ESTADO_STREAM_BUFFER', 1000))
+# Milisegundos que espera el navegador antes de reconectar
+ESTADO_STREAM_RETRY_MS = 3000
+
+
+def _signature(payload):
+    """Campos cuyo cambio merece un evento (el uptime cambia cada segundo y se ignora)"""
+    status = payload['status']
+    metrics = payload['metrics'] or {}
+    return (
+        status.get('running'),
+        status.get('pid'),
+        status.get('unknown', False),
+        status.get('stale', False),
+        payload['connectivity'],
+        metrics.get('connections'),
+        metrics.get('upload'),
+        metrics.get('download')
+    )
+
+
+def format_event(event_id, event, data):
+    """Serializar un evento en formato Server-Sent Events"""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StatusBroadcaster:
+    """
+    Convierte las instantáneas del recolector en eventos de cambio y los
+    reparte a todos los clientes conectados, sea cual sea su número
+    """
+
+    def __init__(self):
+        # Prefijo por proceso: un Last-Event-ID de otro worker obliga a reenviar todo
+        self._epoch = secrets.token_hex(4)
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=ESTADO_STREAM_BUFFER)
+        self._sequence = 0
+        self._current = {}
+        self._signatures = {}
+
+    def _event_id(self, sequence):
+        return f"{self._epoch}-{sequence}"
+
+    def on_snapshot(self, snapshot):
+        """Registrar los túneles cuyo estado ha cambiado y despertar a los clientes"""
+        payloads = {name: snapshot.tunnel_payload(name) for name in snapshot.tunnel_names()}
+        with self._condition:
+            changed = False
+            for tunnel_name, payload in payloads.items():
+                signature = _signature(payload)
+                if self._signatures.get(tunnel_name) == signature:
+                    continue
+                self._signatures[tunnel_name] = signature
+                self._current[tunnel_name] = payload
+                self._sequence += 1
+                self._events.append((self._sequence, tunnel_name, payload))
+                changed = True
+            for tunnel_name in set(self._current) - set(payloads):
+                # Túnel eliminado
+                del self._current[tunnel_name]
+                self._signatures.pop(tunnel_name, None)
+            if changed:
+                self._condition.notify_all()
+
+    def _events_after(self, last_event_id):
+        """Eventos posteriores a last_event_id o None si no se pueden reenviar"""
+        epoch, _, sequence = (last_event_id or "").partition("-")
+        if epoch != self._epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if self._events and self._events[0][0] > sequence + 1:
+            # El cliente estuvo desconectado más tiempo del que cubre el búfer
+            return None
+        return [event for event in self._events if event[0] > sequence]
+
+    def stream(self, last_event_id=None):
+        """Generador de eventos SSE para un cliente"""
+        # Garantizar que existe al menos una instantánea antes del estado inicial
+        collector.get_snapshot()
+        with self._condition:
+            pending = self._events_after(last_event_id)
+            if pending is None:
+                # Conexión nueva o reanudación imposible: enviar el estado completo
+                pending = [(self._sequence, name, payload) for name, payload in self._current.items()]
+            sent = self._sequence
+
+        yield f"retry: {ESTADO_STREAM_RETRY_MS}\n\n"
+        while True:
+            for sequence, tunnel_name, payload in pending:
+                yield format_event(self._event_id(sequence), 'estado', dict(payload, tunnel=tunnel_name))
+
+            with self._condition:
+                if self._sequence == sent:
+                    self._condition.wait(timeout=ESTADO_STREAM_HEARTBEAT)
+                pending = [event for event in self._events if event[0] > sent]
+                sent = self._sequence
+
+            if not pending:
+                yield ": keepalive\n\n"
+
+
+broadcaster = StatusBroadcaster()
+collector.add_listener(broadcaster.on_snapshot)
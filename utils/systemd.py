@@ -0,0 +1,140 @@
+import os
+import time
+import logging
+import threading
+from utils.ejecucion import run_command
+from utils.rendimiento import count_cache
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Unidades systemd creadas para los túneles (ver configure_tunnel_service)
+UNIT_PREFIX = "cloudflared-"
+UNIT_SUFFIX = ".service"
+UNIT_PROPERTIES = ["Id", "ActiveState", "SubState", "MainPID", "ActiveEnterTimestamp"]
+
+# Segundos durante los que se reutiliza la última consulta a systemd
+UNITS_STATE_TTL = float(os.environ.get('UNITS_STATE_TTL', 2))
+# Segundos hasta reintentar la consulta cuando systemctl falla (mientras tanto se sirve el último estado bueno)
+UNITS_STATE_RETRY = float(os.environ.get('UNITS_STATE_RETRY', 0.5))
+
+_lock = threading.Lock()
+_units_state = {}
+_fetched_at = None
+# El último intento falló y _units_state es el último estado bueno (marcado con "stale")
+_stale = False
+
+
+def parse_systemctl_show(output):
+    """
+    Convertir la salida de `systemctl show` (bloques KEY=VALUE separados
+    por líneas en blanco) en una lista de diccionarios
+    """
+    units = []
+    current = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if not line:
+            if current:
+                units.append(current)
+                current = {}
+            continue
+        key, sep, value = line.partition("=")
+        if sep:
+            current[key] = value
+    if current:
+        units.append(current)
+    return units
+
+
+def _fetch_units_state():
+    """Consultar en una sola llamada el estado de todas las unidades cloudflared-*"""
+    result = run_command(
+        ["systemctl", "show", f"--property={','.join(UNIT_PROPERTIES)}",
+         f"{UNIT_PREFIX}*{UNIT_SUFFIX}"],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or "systemctl show falló")
+
+    states = {}
+    for unit in parse_systemctl_show(result.stdout):
+        unit_id = unit.get("Id", "")
+        if not (unit_id.startswith(UNIT_PREFIX) and unit_id.endswith(UNIT_SUFFIX)):
+            continue
+        tunnel_name = unit_id[len(UNIT_PREFIX):-len(UNIT_SUFFIX)]
+        try:
+            main_pid = int(unit.get("MainPID") or 0)
+        except ValueError:
+            main_pid = 0
+        states[tunnel_name] = {
+            "unit": unit_id,
+            "active_state": unit.get("ActiveState", "unknown"),
+            "sub_state": unit.get("SubState", "unknown"),
+            "main_pid": main_pid or None,
+            "active_enter_timestamp": unit.get("ActiveEnterTimestamp") or None
+        }
+    return states
+
+
+def get_cloudflared_units_state(max_age=None):
+    """
+    Obtener el estado de todas las unidades cloudflared-*.service
+    Retorna un diccionario {nombre_túnel: estado} compartido por la web y el monitor
+    Si systemctl falla se sigue sirviendo el último estado bueno, con "stale" en cada unidad,
+    y se reintenta pasados UNITS_STATE_RETRY segundos
+    """
+    global _units_state, _fetched_at, _stale
+
+    if max_age is None:
+        max_age = UNITS_STATE_TTL
+
+    with _lock:
+        now = time.monotonic()
+        ttl = min(max_age, UNITS_STATE_RETRY) if _stale else max_age
+        fresh = _fetched_at is not None and now - _fetched_at < ttl
+        count_cache(fresh)
+        if fresh:
+            return _units_state
+
+        try:
+            _units_state = _fetch_units_state()
+            if _stale:
+                logger.info("Estado de las unidades systemd recuperado")
+            _stale = False
+        except FileNotFoundError:
+            logger.debug("systemctl no está disponible en este sistema")
+            _units_state = {}
+            _stale = False
+        except Exception as e:
+            # Sin el último estado bueno todas las unidades parecerían inactivas
+            if not _stale:
+                logger.error(f"Error al obtener el estado de las unidades systemd, se usa el último conocido: {str(e)}")
+                _units_state = {name: dict(state, stale=True) for name, state in _units_state.items()}
+                _stale = True
+        _fetched_at = time.monotonic()
+        return _units_state
+
+
+def units_state_is_stale():
+    """Verificar si el estado servido es el último bueno porque la consulta a systemd está fallando"""
+    return _stale
+
+
+def get_unit_state(tunnel_name):
+    """Obtener el estado de la unidad de un túnel o None si no está cargada"""
+    return get_cloudflared_units_state().get(tunnel_name)
+
+
+def is_unit_active(tunnel_name):
+    """Verificar si la unidad systemd de un túnel está activa"""
+    state = get_unit_state(tunnel_name)
+    return state is not None and state["active_state"] == "active"
+
+
+def invalidate_units_state():
+    """Forzar una nueva consulta tras iniciar, detener o crear unidades"""
+    global _fetched_at
+    with _lock:
+        _fetched_at = None